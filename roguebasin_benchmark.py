@@ -0,0 +1,205 @@
+"""
+benchmarks for roguebasin_python3: times the hot paths of the game (level generation,
+field of view, monster turns, tile lookups, save/load, stairs and drawing) on a seeded synthetic
+dungeon, so the numbers of two commits can be compared.
+The same seed, size and density always give the same dungeon and the same monster moves.
+
+    python3 roguebasin_benchmark.py --output before.json
+    ... change something ...
+    python3 roguebasin_benchmark.py --compare before.json   # exit code 1 if something got slower
+    python3 roguebasin_benchmark.py --replay game.rpl       # also time a recorded game (see Replay)
+
+author: Horst JENS
+email: horstjens@gmail.com
+contact: see http://spielend-programmieren.at/de:kontakt
+license: gpl, see http://www.gnu.org/licenses/gpl-3.0.de.html
+download: https://github.com/horstjens/roguebasin_python3
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from roguebasin_engine import *
+
+
+def measure(function, repeat):
+    """call function once to warm up caches, then repeat times. returns {median_ms, min_ms, runs}"""
+    function()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": statistics.median(durations), "min_ms": min(durations), "runs": repeat}
+
+
+def synthetic_game(width, height, seed, density):
+    """a headless Game with the player on a generated level (level 1) of width x height tiles.
+       density: factor for the number of monsters and loot (see generate_level)"""
+    Game.pregenerate = None  # no worker: level generation is timed on its own
+    Game.level_density = density
+    game = Game(tiles_x=width, tiles_y=height, seed=seed)
+    # climb down the first stair of the hand-made level 0
+    stair = next(iter(Game.spatial.level(0, StairDown)))
+    Game.spatial.move(game.player, stair.x, stair.y, 0)
+    game.step("stairs")
+    # nobody may die or win during the benchmark
+    game.player.hitpoints_max = game.player.hitpoints = 1000000
+    return game
+
+
+def use_stairs(game, levels):
+    """climb levels down (or up, if negative) by stairs. Checks after each level that no more
+       than Game.hot_levels levels are hot (see Game.manage_levels)"""
+    cls = StairDown if levels > 0 else StairUp
+    for _ in range(abs(levels)):
+        stair = next(iter(Game.spatial.level(game.player.z, cls)))
+        Game.spatial.move(game.player, stair.x, stair.y, game.player.z)
+        game.step("stairs")
+        game.player.hitpoints = game.player.hitpoints_max  # the monsters near the stairs may fight
+        hot = [z for z in range(len(Game.dungeon)) if Game.dungeon.is_decoded(z) or Game.spatial.count(z) > 0]
+        if len(hot) > Game.hot_levels:
+            raise SystemError("{} hot levels, but Game.hot_levels is {}: {}".format(len(hot), Game.hot_levels, hot))
+
+
+def floor_tiles(level, count):
+    """count x,y positions of floor tiles, evenly spread over the level"""
+    tiles = [i for i, t in enumerate(level.tiles) if t == FLOOR]
+    step = max(1, len(tiles) // count)
+    return [divmod(i, level.width)[::-1] for i in tiles[::step][:count]]
+
+
+def run_benchmarks(width=80, height=40, seed=1, density=1.0, repeat=20, render=True, replay=None):
+    """returns {benchmark name: {median_ms, min_ms, runs}}.
+       replay: a Replay to play headless as one more benchmark, None: no replay"""
+    results = {}
+    game = synthetic_game(width, height, seed, density)
+    z = game.player.z
+    level = Game.dungeon[z]
+    # ---- level generation: a new level each time, with stairs up below the stairs down of level z ----
+    levels = iter(range(z + 1, z + 2 + repeat))  # one more for the warm up, see measure
+    seed, _, *arguments = game.level_arguments(z + 1)
+    results["generate_level"] = measure(lambda: generate_level(seed, next(levels), *arguments), repeat)
+    # ---- field of view from many floor tiles, without the fov cache ----
+    positions = floor_tiles(level, 50)
+    for name, algorithm in FOV_ALGORITHMS.items():
+        results["fov_" + name] = measure(
+            lambda: [algorithm(level, x, y, Game.torch_radius) for x, y in positions], repeat)
+    # ---- what is on each tile of the level ----
+    def lookup():
+        at = Game.spatial.at
+        for y in range(level.height):
+            for x in range(level.width):
+                level.tile(x, y)
+                at(x, y, z)
+    results["tile_lookup"] = measure(lookup, repeat)
+    # ---- monster turns. the monsters come closer and fight with the player ----
+    results["monster_turn"] = measure(game.new_turn, repeat * 10)
+    results["player_turn"] = measure(lambda: game.step("wait"), repeat * 10)
+    # ---- drawing everything into the (invisible) screen surface ----
+    if render:
+        results.update(render_benchmarks(game, repeat))
+    # ---- save and load the whole game ----
+    filename = os.path.join(tempfile.mkdtemp(), "benchmark.sav")
+    results["save"] = measure(lambda: game.save(filename), repeat)
+    results["load"] = measure(lambda: Game.load(filename), repeat)
+    game = Game.load(filename)
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
+    # ---- dive, climb and dive again: new levels, freezing and thawing (see Game.manage_levels) ----
+    results["stairs"] = measure(lambda: [use_stairs(game, levels) for levels in (6, -4, 2)], repeat)
+    # ---- a whole recorded game, see Replay ----
+    if replay is not None:
+        results["replay"] = measure(replay.play, repeat)
+    return results
+
+
+def render_benchmarks(game, repeat):
+    """times the pygame Viewer drawing the game without a window (SDL dummy video driver).
+       Empty if pygame is not installed"""
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")  # stdout is only for the json results
+    try:
+        import roguebasin_pygame
+    except ImportError:
+        print("pygame not found, no render benchmarks", file=sys.stderr)
+        return {}
+    with contextlib.redirect_stdout(sys.stderr):  # the Viewer reports missing images on stdout
+        viewer = roguebasin_pygame.Viewer(game, width=1200, height=800, grid_size=(32, 32), run=False)
+    game.renderer = None  # no animations during the following game turns
+    results = {}
+
+    def redraw():
+        viewer.drawn = None  # paint everything, see Viewer.update_dungeon
+        viewer.update_dungeon()
+    results["render_dungeon"] = measure(redraw, repeat)
+
+    def radar():
+        viewer.radar_key = None  # no cached radar picture, see Viewer.draw_radar
+        viewer.draw_radar()
+    results["render_radar"] = measure(radar, repeat)
+    results["render_panel"] = measure(viewer.draw_panel, repeat)
+    results["render_log"] = measure(viewer.draw_log, repeat)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """returns a list of (name, baseline ms, ms) of all benchmarks whose median is more than
+       threshold (0.25: 25%) slower than in baseline"""
+    slower = []
+    for name, row in results.items():
+        old = baseline.get(name)
+        if old is not None and row["median_ms"] > old["median_ms"] * (1 + threshold):
+            slower.append((name, old["median_ms"], row["median_ms"]))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmarks for roguebasin_python3")
+    parser.add_argument("--width", type=int, default=80, help="width of the generated levels in tiles")
+    parser.add_argument("--height", type=int, default=40, help="height of the generated levels in tiles")
+    parser.add_argument("--seed", type=int, default=1, help="same seed, same dungeon")
+    parser.add_argument("--density", type=float, default=1.0, help="factor for the number of monsters and loot")
+    parser.add_argument("--repeat", type=int, default=20, help="number of runs of each benchmark")
+    parser.add_argument("--no-render", action="store_true", help="skip the pygame drawing benchmarks")
+    parser.add_argument("--replay", metavar="FILE", default=None,
+                        help="also time the headless playback of a game recorded with --record")
+    parser.add_argument("--output", metavar="FILE", default=None, help="write the results as json into FILE")
+    parser.add_argument("--compare", metavar="FILE", default=None,
+                        help="json results of an earlier run. exit code 1 if a benchmark got slower")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown of the median for --compare (0.25: 25%%)")
+    args = parser.parse_args()
+    replay = None if args.replay is None else Replay.load(args.replay)
+    results = run_benchmarks(args.width, args.height, args.seed, args.density, args.repeat,
+                             not args.no_render, replay)
+    report = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+              "settings": {"width": args.width, "height": args.height, "seed": args.seed,
+                           "density": args.density, "repeat": args.repeat, "replay": args.replay},
+              "results": results}
+    for name, row in results.items():
+        print("{:<22}{:>10.3f} ms  (min {:.3f} ms)".format(name, row["median_ms"], row["min_ms"]), file=sys.stderr)
+    if args.output is None:
+        print(json.dumps(report, indent=1))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["settings"] != report["settings"]:
+            print("warning: {} was made with other settings: {}".format(args.compare, baseline["settings"]),
+                  file=sys.stderr)
+        slower = compare(results, baseline["results"], args.threshold)
+        for name, old, new in slower:
+            print("slower: {} {:.3f} ms -> {:.3f} ms ({:+.0%})".format(name, old, new, new / old - 1),
+                  file=sys.stderr)
+        if slower:
+            sys.exit(1)
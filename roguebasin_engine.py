@@ -0,0 +1,2643 @@
+"""
+game logic of roguebasin_python3: dungeon levels, objects, monsters, field of view
+and the Game class. This module does not need pygame: a Game can be created and
+played without any display by calling Game.step (see Game.step for the actions).
+Visual effects are not drawn here, Game collects them as events
+(see Game.emit) for a renderer like the Viewer in roguebasin_pygame.py
+author: Horst JENS
+email: horstjens@gmail.com
+contact: see http://spielend-programmieren.at/de:kontakt
+license: gpl, see http://www.gnu.org/licenses/gpl-3.0.de.html
+download: https://github.com/horstjens/roguebasin_python3
+"""
+
+import random
+import collections
+import csv
+import functools
+import time
+import array
+import atexit
+import os
+import types
+import concurrent.futures
+import multiprocessing
+import struct
+import zlib
+import json
+import mmap
+import re
+import shutil
+import tempfile
+from roguebasin_pathfinding import DijkstraMap, astar, nearest
+
+# declare constants
+ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+#  TODO monster speed > 1 tile possible ?
+#  TODO rework NaturalWeapon
+#  TODO Item
+#  TODO Equipment
+#  TODO Consumable
+
+
+
+class NaturalWeapon():
+
+    def __init__(self, ):
+        # self.number = NaturalWeapon.number
+        # NaturalWeapon.number += 1
+        # NaturalWeapon.store[self.number] = self
+        self.damage_bonus = 0
+        self.attack_bonus = 0
+        self.defense_bonus = 0
+
+        self.overwrite_parameters()
+
+    def overwrite_parameters(self):
+        pass
+
+
+class Fist(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 0
+        self.attack_bonus = 0
+        self.defense_bonus = 0
+
+
+class Kick(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 3
+        self.attack_bonus = -2
+        self.defense_bonus = 2
+
+
+class YetiSnowBall(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 1
+        self.attack_bonus = 4
+        self.defense_bonus = 1
+
+
+class YetiSlap(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 4
+        self.attack_bonus = -1
+        self.defense_bonus = 0
+
+
+class SnakeBite(NaturalWeapon):
+
+    def overwrite_parameters(self):
+        self.damage_bonus = 1
+        self.attack_bonus = 2
+        self.defense_bonus = 2
+
+
+class WolfBite(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 1
+        self.attack_bonus = 2
+        self.defense_bonus = 2
+
+
+class GolemArm(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 2
+        self.attack_bonus = 0
+        self.defense_bonus = 0
+
+
+class DragonBite(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 9
+        self.attack_bonus = -3
+        self.defense_bonus = -3
+
+
+class DragonClaw(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 2
+        self.attack_bonus = -1
+        self.defense_bonus = -1
+
+
+class DragonTail(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 3
+        self.attack_bonus = 0
+        self.defense_bonus = 0
+
+
+class FireBreath(NaturalWeapon):
+    def overwrite_parameters(self):
+        self.damage_bonus = 4
+        self.attack_bonus = 3
+        self.defense_bonus = -4
+
+
+def megaroll(dicestring="1d6 1d20", bonus=0, generator=None):
+    """roll all the dice in the dicestring and adds a bonus to the sum
+    1d6 means one 6-sided die without re-roll
+    1D6 means one 6-sided die with re-roll.
+    re-roll: 1D6 means that when hightest side (6) is rolled, 5 (=6-1) is added and he rolls again"""
+    dlist = dicestring.split(" ")
+    total = 0
+    #print("calculating: ", dicestring, "+", bonus)
+    for code in dlist:
+        #print("---processing", code)
+        if "d" in code:
+            # reroll = False
+            rolls = int(code.split("d")[0])
+            sides = int(code.split("d")[1])
+            total += roll((rolls, sides), bonus=0, reroll=False, generator=generator)
+        elif "D" in code:
+            # reroll = True
+            rolls = int(code.split("D")[0])
+            sides = int(code.split("D")[1])
+            total += roll((rolls, sides), bonus=0, reroll=True, generator=generator)
+        else:
+            raise SystemError("unknow dice type: {} use 1d6, 1D20 etc".format(code))
+        #print("---result of", code, "is :", str(total))
+    #print("adding " + str(bonus) + "=", str(total + bonus))
+    return total + bonus
+
+
+def roll(dice, bonus=0, reroll=True, generator=None):
+    """simulate a dice throw, and adding a bonus
+       reroll means that if the highest number is rolled,
+       one is substracted from the score and
+       another roll is added, until a not-hightest number is rolled.
+       e.g. 1D6 throws a 6, and re-rolls a 2 -> (6-1)+2= 7
+       generator is a random.Random instance, default is the combat stream (rng.combat)"""
+    # TODO format-micro-language for aligning the numbers better
+    # TODO: accepting string of several dice, like '2D6 3d4' where 'd' means no re-roll, 'D' means re-roll
+    if generator is None:
+        generator = rng.combat
+    rolls = dice[0]
+    sides = dice[1]
+    total = 0
+    #print("------------------------")
+    #print("rolling {}{}{} + bonus {}".format(rolls, "D" if reroll else "d", sides, bonus))
+    #print("------------------------")
+    i = 0
+    verb = "rolls   "
+    # for d in range(rolls):
+    while True:
+        i += 1
+        if i > rolls:
+            break
+        value = generator.randint(1, sides)
+
+        if reroll and value == sides:
+            total += value - 1
+            #print("die #{} {} {}  ∑: {} (count as {} and rolls again)".format(i, verb, value, total, value - 1))
+            verb = "re-rolls"
+            i -= 1
+            continue
+        else:
+            total += value
+            #print("die #{} {} {}  ∑: {}".format(i, verb, value, total))
+            verb = "rolls   "
+
+    #print("=========================")
+    #print("=result:    {}".format(total))
+    #print("+bonus:     {}".format(bonus))
+    #print("=========================")
+    #print("=total:     {}".format(total + bonus))
+    return total + bonus
+
+
+def minmax(value, lower_limit=-1, upper_limit=1):
+    """constrains a value inside two limits"""
+    value = max(lower_limit, value)
+    value = min(upper_limit, value)
+    return value
+
+
+def randomizer(list_of_chances=(1.0,), generator=None):
+    """gives back an integer depending on chance.
+       e.g. randomizer((.75, 0.15, 0.05, 0.05)) gives in 75% 0, in 15% 1, and in 5% 2 or 3
+       generator is a random.Random instance, default is the dungeon generation stream (rng.generation)"""
+    if generator is None:
+        generator = rng.generation
+    total = sum(list_of_chances)
+    v = generator.random() * total  # a value between 0 and total
+    edge = 0
+    for i, c in enumerate(list_of_chances):
+        edge += c
+        if v <= edge:
+            return i
+    else:
+        raise SystemError("problem with list of chances:", list_of_chances)
+
+
+class RandomStreams:
+    """seeded random number generators (random.Random instances), one for each part of the game,
+       so that e.g. more particles in an explosion never change the next dungeon or fight:
+       generation: dungeon level generation. restarted for each level with start_level,
+                   so a dungeon level depends only on the seed and its level number
+       combat: dice rolls and damage
+       ai: monster decisions
+       cosmetic: everything only visible on the screen (particles, colors...)
+       the same seed gives the same dungeon and the same fights
+    """
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """restart all streams. seed None means a random seed"""
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed_value = seed
+        self.combat = random.Random("{}-combat".format(seed))
+        self.ai = random.Random("{}-ai".format(seed))
+        self.cosmetic = random.Random("{}-cosmetic".format(seed))
+        self.start_level(0)
+
+    def level_generator(self, z):
+        """returns a new random generator for dungeon level z"""
+        return level_random(self.seed_value, z)
+
+    def start_level(self, z):
+        """restart the generation stream for dungeon level z"""
+        self.generation = self.level_generator(z)
+
+    def continue_level(self, state):
+        """continue the generation stream of a level, from a state of random.Random.getstate()"""
+        self.generation = random.Random()
+        self.generation.setstate(state)
+
+
+def level_random(seed, z):
+    """the random generator for dungeon level z of the game with this seed"""
+    return random.Random("{}-level-{}".format(seed, z))
+
+
+rng = RandomStreams()  # the random streams of the current game, see Game.__init__
+
+
+class Profiler:
+    """measures how long named sections of the game take: turns, fov, monsters, drawing...
+       A section is a function or method, registered with watch(). While the profiler is
+       disabled (the default) nothing is wrapped, so the watched code runs at full speed.
+       enable() replaces every watched function by a timing wrapper, disable() puts the
+       originals back. The last `window` durations of each section are kept for the
+       percentiles (see stats), count and total time are kept for the whole run"""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.enabled = False
+        self.watched = []  # (owner, attribute, section name)
+        self.originals = {}  # {(owner, attribute): function}, only while enabled
+        self.samples = {}  # {section name: deque of the last durations in seconds}
+        self.totals = {}  # {section name: [count, seconds]}
+
+    def watch(self, owner, attribute, name=None):
+        """time owner.attribute (a function of a module or class) whenever the profiler is enabled.
+           name of the section: "Class.attribute" by default"""
+        if name is None:
+            name = "{}.{}".format(getattr(owner, "__name__", owner), attribute)
+        self.watched.append((owner, attribute, name))
+        if self.enabled:
+            self.wrap(owner, attribute, name)
+
+    def wrap(self, owner, attribute, name):
+        original = owner.__dict__[attribute]  # staticmethod or classmethod objects, not the bound methods
+        if isinstance(original, (staticmethod, classmethod)):
+            wrapper = type(original)(self.timed(original.__func__, name))
+        else:
+            wrapper = self.timed(original, name)
+        self.originals[owner, attribute] = original
+        setattr(owner, attribute, wrapper)
+
+    def timed(self, function, name):
+        """returns function wrapped by a timer for section name"""
+        add = self.add
+        clock = time.perf_counter
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(name, clock() - start)
+        return wrapper
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            for owner, attribute, name in self.watched:
+                self.wrap(owner, attribute, name)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            for (owner, attribute), original in self.originals.items():
+                setattr(owner, attribute, original)
+            self.originals.clear()
+
+    def reset(self):
+        """forget all measurements"""
+        self.samples.clear()
+        self.totals.clear()
+
+    def add(self, name, seconds):
+        """record one duration of section name. For code that is not a watched function"""
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = collections.deque(maxlen=self.window)
+            self.totals[name] = [0, 0.0]
+        samples.append(seconds)
+        total = self.totals[name]
+        total[0] += 1
+        total[1] += seconds
+
+    def stats(self):
+        """{section name: {count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}.
+           The percentiles and the maximum are taken from the last `window` durations only"""
+        result = {}
+        for name, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            count, seconds = self.totals[name]
+            row = {"count": count, "total_ms": seconds * 1000, "mean_ms": seconds * 1000 / count}
+            for p in (50, 95, 99):
+                # nearest rank: the smallest duration that is not shorter than p percent of all durations
+                row["p{}_ms".format(p)] = ordered[max(0, -(-p * len(ordered) // 100) - 1)] * 1000
+            row["max_ms"] = ordered[-1] * 1000
+            result[name] = row
+        return result
+
+    def export(self, filename):
+        """write stats into filename: csv if it ends with .csv, otherwise json"""
+        stats = self.stats()
+        with open(filename, "w", newline="") as f:
+            if filename.lower().endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["section", "count", "total_ms", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                for name, row in stats.items():
+                    writer.writerow([name] + ["{:.4f}".format(v) if isinstance(v, float) else v for v in row.values()])
+            else:
+                json.dump({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "window": self.window,
+                           "sections": stats}, f, indent=1)
+
+
+profiler = Profiler()  # times the sections of the game, see Profiler. disabled by default
+
+
+def get_line(start, end):
+    """Bresenham's Line Algorithm
+       Produces a list of tuples from start and end
+       source: http://www.roguebasin.com/index.php?title=Bresenham%27s_Line_Algorithm#Python
+       see also: https://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm
+
+       #>>> points1 = get_line((0, 0), (3, 4))
+       # >>> points2 = get_line((3, 4), (0, 0))
+       #>>> assert(set(points1) == set(points2))
+       #>>> print points1
+       #[(0, 0), (1, 1), (1, 2), (2, 3), (3, 4)]
+       #>>> print points2
+       #[(3, 4), (2, 3), (1, 2), (1, 1), (0, 0)]
+    """
+    # Setup initial conditions
+    x1, y1 = start
+    x2, y2 = end
+    dx = x2 - x1
+    dy = y2 - y1
+
+    # Determine how steep the line is
+    is_steep = abs(dy) > abs(dx)
+
+    # Rotate line
+    if is_steep:
+        x1, y1 = y1, x1
+        x2, y2 = y2, x2
+
+    # Swap start and end points if necessary and store swap state
+    swapped = False
+    if x1 > x2:
+        x1, x2 = x2, x1
+        y1, y2 = y2, y1
+        swapped = True
+
+    # Recalculate differentials
+    dx = x2 - x1
+    dy = y2 - y1
+
+    # Calculate error
+    error = int(dx / 2.0)
+    ystep = 1 if y1 < y2 else -1
+
+    # Iterate over bounding box generating points between start and end
+    y = y1
+    points = []
+    for x in range(x1, x2 + 1):
+        coord = (y, x) if is_steep else (x, y)
+        points.append(coord)
+        error -= abs(dy)
+        if error < 0:
+            y += ystep
+            error += dx
+
+    # Reverse the list if the coordinates were swapped
+    if swapped:
+        points.reverse()
+    return points
+
+
+class FovMap:
+    """field of view of one dungeon level: one byte per tile in a bytearray, 1 = visible.
+       Cached FovMaps are shared (see Game.make_fov_map), don't change them after creation"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = bytearray(width * height)  # all tiles invisible
+
+    @classmethod
+    def for_level(cls, level):
+        """creates an empty FovMap with the dimensions of level"""
+        return cls(level.width, level.height)
+
+    def inside(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def visible(self, x, y):
+        """True if tile x,y is visible. Tiles outside the level are never visible"""
+        return 0 <= x < self.width and 0 <= y < self.height and self.cells[y * self.width + x] == 1
+
+    def set_visible(self, x, y):
+        self.cells[y * self.width + x] = 1
+
+
+def raycast_fov(level, px, py, radius):
+    """field of view by casting a Bresenham line (see get_line) from px, py to
+       each tile on the border of the torch square, followed by a post-processing pass
+       to remove artifacts. level is a Level.
+       returns a FovMap"""
+    fov_map = FovMap.for_level(level)  # all tiles invisible
+    # set player's tile to visible
+    fov_map.set_visible(px, py)
+    # get coordinates form player to point at end of torchradius / torchsquare
+    endpoints = set()
+    for y in range(py - radius, py + radius + 1):
+        if y == py - radius or y == py + radius:
+            for x in range(px - radius, px + radius + 1):
+                endpoints.add((x, y))
+        else:
+            endpoints.add((px - radius, y))
+            endpoints.add((px + radius, y))
+    for coordinate in endpoints:
+        # a line of points from the player position to the outer edge of the torchsquare
+        for x, y in get_line((px, py), (coordinate[0], coordinate[1])):
+            # player tile always visible
+            if x == px and y == py:
+                continue
+            # outside of dungeon level ?
+            if not level.inside(x, y):
+                break
+            tile = level.tile(x, y)
+            # outside of torch radius ?
+            distance = ((px - x) ** 2 + (py - y) ** 2) ** 0.5
+            if distance > radius:
+                continue
+            fov_map.set_visible(x, y)  # make this tile visible
+            if tile.block_sight:
+                break  # forget the rest
+    # ---------- the fov map is now ready to use, but has some ugly artifacts ------------
+    # ---------- start post-processing fov map to clean up the artifacts ---
+    # -- basic idea: divide the torch-square into 4 equal sub-squares.
+    # -- look of a invisible wall is behind (from the player perspective) a visible
+    # -- ground floor. if yes, make this wall visible as well.
+    # -- see https://sites.google.com/site/jicenospam/visibilitydetermination
+    # ------ north-west of player
+    for xstart, ystart, xstep, ystep, neighbors in [
+        (-radius, -radius, 1, 1, [(0, 1), (1, 0), (1, 1)]),
+        (-radius, radius, 1, -1, [(0, -1), (1, 0), (1, -1)]),
+        (radius, -radius, -1, 1, [(0, -1), (-1, 0), (-1, -1)]),
+        (radius, radius, -1, -1, [(0, 1), (-1, 0), (-1, 1)])]:
+
+        for x in range(px + xstart, px, xstep):
+            for y in range(py + ystart, py, ystep):
+                # not even in dungeon?
+                if not fov_map.inside(x, y):
+                    continue
+                if fov_map.visible(x, y):
+                    continue  # next, i search invisible tiles!
+                # oh, we found an invisble tile! now let's check:
+                # is it a wall?
+                if level.tile(x, y).char != "#":
+                    continue  # next, i search walls!
+                # --ok, found an invisible wall.
+                # check south-east neighbors
+
+                for dx, dy in neighbors:
+                    # does neigbor even exist?
+                    if not fov_map.inside(x + dx, y + dy):
+                        continue
+                    v = fov_map.visible(x + dx, y + dy)
+                    t = level.tile(x + dx, y + dy)
+                    # is neighbor a tile AND visible?
+                    if isinstance(t, Floor) and v == True:
+                        # ok, found a visible floor tile neighbor. now let's make this wall
+                        # visible as well
+                        fov_map.set_visible(x, y)
+                        break  # other neighbors are irrelevant now
+    return fov_map
+
+
+# multipliers to transform the coordinates of the first octant into the other 7 octants
+# (xx, xy, yx, yy) for each octant
+_OCTANTS = ((1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+            (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1))
+
+
+def shadowcast_fov(level, px, py, radius):
+    """field of view by recursive shadowcasting, see
+       http://www.roguebasin.com/index.php?title=FOV_using_recursive_shadowcasting
+       scans the torch circle octant by octant, row by row, and skips everything
+       in the shadow of a sight-blocking tile. No post-processing necessary.
+       level is a Level.
+       returns a FovMap"""
+    fov_map = FovMap.for_level(level)
+    fov_map.set_visible(px, py)
+    opaque = level.tiles.translate(BLOCK_SIGHT)  # 1 for each tile that blocks sight
+    for xx, xy, yx, yy in _OCTANTS:
+        _cast_light(opaque, fov_map, px, py, 1, 1.0, 0.0, radius, xx, xy, yx, yy)
+    return fov_map
+
+
+def _cast_light(opaque, fov_map, cx, cy, row, start, end, radius, xx, xy, yx, yy):
+    """light up one octant of the fov_map, starting at row (distance from cx, cy)
+       between the slopes start and end. Calls itself for each gap behind a blocking tile.
+       opaque has one byte per tile of the level, 1 means blocking sight"""
+    if start < end:
+        return
+    radius_squared = radius * radius
+    width = fov_map.width
+    height = fov_map.height
+    new_start = start
+    for j in range(row, radius + 1):
+        dx, dy = -j - 1, -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            # translate the octant coordinates dx, dy into map coordinates
+            x = cx + dx * xx + dy * xy
+            y = cy + dx * yx + dy * yy
+            # left and right slope of this tile
+            l_slope = (dx - 0.5) / (dy + 0.5)
+            r_slope = (dx + 0.5) / (dy - 0.5)
+            if start < r_slope:
+                continue
+            elif end > l_slope:
+                break
+            inside = 0 <= y < height and 0 <= x < width
+            if inside and dx * dx + dy * dy <= radius_squared:
+                fov_map.cells[y * width + x] = 1
+            blocks = not inside or opaque[y * width + x]
+            if blocked:
+                # we are scanning a row of blocking tiles
+                if blocks:
+                    new_start = r_slope
+                    continue
+                blocked = False
+                start = new_start
+            elif blocks and j < radius:
+                # this is a blocking tile, start a child scan behind the gap
+                blocked = True
+                _cast_light(opaque, fov_map, cx, cy, j + 1, start, l_slope, radius, xx, xy, yx, yy)
+                new_start = r_slope
+        # row is scanned. stop if the last tile was blocking
+        if blocked:
+            break
+
+
+# field of view algorithms, selectable by Game.fov_algorithm
+FOV_ALGORITHMS = {"shadowcast": shadowcast_fov,
+                  "raycast": raycast_fov,
+                  }
+
+
+class Rect:
+    """a rectangle object (room) for the dungeon
+       x,y is the topleft coordinate
+    """
+
+    def __init__(self, x, y, width, height):
+        self.x1 = x
+        self.y1 = y
+        self.x2 = x + width
+        self.y2 = y + height
+
+    def center(self):
+        """returns the center coordinate of a room"""
+        center_x = (self.x1 + self.x2) // 2  # TODO: // instead of / ?
+        center_y = (self.y1 + self.y2) // 2
+        return (center_x, center_y)
+
+    def intersect(self, other):
+        """returns true if this rectangle intersects with another one"""
+        return (self.x1 <= other.x2 and self.x2 >= other.x1 and
+                self.y1 <= other.y2 and self.y2 >= other.y1)
+
+
+class Tile:
+    """# a type of map tile and its properties
+       block_movement means blocking the movement of Monster/Player, like a wall or water
+       block_sight means blocking the field of view
+       block_flying means the tile blocks flying objects like arrows or flying monsters
+       Tiles are flyweights: there is only one instance for each tile type (see TILES).
+       A dungeon Level stores only the tile number, decoration and explored flag of each x,y.
+    """
+
+    images = [] # for Viewer. light_images, dark_images
+
+    def __init__(self, block_movement=None, block_sight=None, block_flying=None):
+        self.char = "?"
+        self.block_movement = block_movement
+        self.block_sight = block_sight
+        self.block_flying = block_flying
+        # chances for each decoration (image variant) of this tile, see randomizer
+        self.decoration_chances = (1.0,)
+        self._overwrite()
+        self.decoration_table = self._make_decoration_table()
+
+    def _overwrite(self):
+        pass
+
+    def _make_decoration_table(self):
+        """returns 256 bytes, mapping each random decoration byte of a Level
+           to a decoration index (mostly 0, very seldom 1 and very rarely 2 or 3, see randomizer)"""
+        total = sum(self.decoration_chances)
+        table = bytearray(256)
+        for b in range(256):
+            v = (b + 0.5) / 256 * total  # a value between 0 and total
+            edge = 0
+            for i, c in enumerate(self.decoration_chances):
+                edge += c
+                if v <= edge:
+                    break
+            table[b] = i
+        return bytes(table)
+
+
+class Wall(Tile):
+
+    def _overwrite(self):
+        super()._overwrite()
+        self.char = "#"
+        self.decoration_chances = (.30, 0.15, 0.15, 0.15, 0.1, 0.1, 0.025, 0.025)  # 8
+        self.block_movement = True
+        self.block_flying = True
+        self.block_sight = True
+
+
+class Floor(Tile):
+
+    def _overwrite(self):
+        super()._overwrite()
+        self.char = "."
+        self.decoration_chances = (.15, 0.15, 0.15, 0.15, 0.15, 0.1, 0.1, 0.025, 0.025)  # 9
+        self.block_movement = False
+        self.block_flying = False
+        self.block_sight = False
+
+
+# the flyweight Tile instances. a Level stores the index of this tuple (tile number) for each x,y
+TILES = (Wall(), Floor())
+WALL = 0
+FLOOR = 1
+# translation tables from tile number to 1 (blocking) or 0 (not blocking), for bytes.translate
+BLOCK_SIGHT = bytes(1 if n < len(TILES) and TILES[n].block_sight else 0 for n in range(256))
+# the other way round: 1 for each tile number a monster can walk on
+WALKABLE = bytes(1 if n < len(TILES) and not TILES[n].block_movement else 0 for n in range(256))
+
+
+class Level:
+    """one dungeon level of width x height tiles.
+       Instead of a Tile instance for each x,y the level keeps everything in
+       bytearrays with one byte per tile (index: y * width + x):
+       tiles: the tile number (index of TILES)
+       decorations: a random byte, used to choose an image variant (see Level.decoration)
+       explored: 1 if the player has already seen this tile, otherwise 0
+    """
+
+    def __init__(self, width, height, tile=WALL, decorations=None):
+        self.width = width
+        self.height = height
+        self.tiles = bytearray([tile]) * (width * height)
+        if decorations is None:
+            decorations = rng.generation.randbytes(width * height)
+        self.decorations = bytearray(decorations)
+        self.explored = bytearray(width * height)
+
+    def inside(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def tile(self, x, y):
+        """returns the Tile (flyweight) at x,y"""
+        return TILES[self.tiles[y * self.width + x]]
+
+    def set_tile(self, x, y, tile):
+        """tile is a tile number like WALL or FLOOR"""
+        self.tiles[y * self.width + x] = tile
+
+    def fill_rect(self, x, y, width, height, tile):
+        """set all tiles inside the rectangle to tile number tile"""
+        row = bytes([tile]) * width
+        for y in range(y, y + height):
+            start = y * self.width + x
+            self.tiles[start:start + width] = row
+
+    def decoration(self, x, y):
+        """returns the decoration (image variant) number of tile x,y"""
+        i = y * self.width + x
+        return TILES[self.tiles[i]].decoration_table[self.decorations[i]]
+
+    def is_explored(self, x, y):
+        return self.explored[y * self.width + x] == 1
+
+    def set_explored(self, x, y):
+        self.explored[y * self.width + x] = 1
+
+    def explore(self, fov_map, y1=0, y2=None):
+        """mark all tiles that are visible in fov_map (a FovMap of this level) as explored.
+           only rows y1 to y2 (exclusive) are checked, default all rows"""
+        start = y1 * self.width
+        end = len(self.explored) if y2 is None else y2 * self.width
+        if start >= end:
+            return
+        # bitwise or of both byte-strings, done with python's (fast) large integers
+        explored = int.from_bytes(self.explored[start:end], "little")
+        visible = int.from_bytes(fov_map.cells[start:end], "little")
+        self.explored[start:end] = (explored | visible).to_bytes(end - start, "little")
+
+    def explore_all(self):
+        self.explored[:] = b"\x01" * len(self.explored)
+
+
+LEVEL_HEADER = struct.Struct("<HHB")  # width, height, flags (1: zlib compressed)
+
+
+def encode_level(level, compress=True):
+    """returns tiles, decorations and explored flags of a Level packed into bytes (see decode_level)"""
+    payload = b"".join((level.tiles, level.decorations, level.explored))
+    if compress:
+        payload = zlib.compress(payload)
+    return LEVEL_HEADER.pack(level.width, level.height, 1 if compress else 0) + payload
+
+
+def decode_level(data):
+    """returns a Level from bytes made by encode_level"""
+    width, height, flags = LEVEL_HEADER.unpack_from(data)
+    payload = data[LEVEL_HEADER.size:]
+    if flags & 1:
+        payload = zlib.decompress(payload)
+    n = width * height
+    level = Level(width, height, WALL, payload[n:2 * n])
+    level.tiles[:] = payload[:n]
+    level.explored[:] = payload[2 * n:3 * n]
+    return level
+
+
+# ----- hand-made level files, see Game.load_level -----
+CHAR_TILES = bytes(WALL if c == ord("#") else FLOOR for c in range(256))  # for bytes.translate
+SPAWN_MARKERS = re.compile(rb"[<>$a*M]")  # chars that create an Object (see Game.load_level)
+LEVEL_FILE_MAGIC = b"RBLV"
+LEVEL_FILE_VERSION = 1
+LEVEL_FILE_HEADER = struct.Struct("<4sHHHI")  # magic, version, width, height, number of spawns
+SPAWN_RECORD = struct.Struct("<cHH")  # marker char, x, y
+
+
+def read_level_text(filename):
+    """read a level text file: each char is a tile, "#" is a wall, everything else floor.
+       Empty lines are ignored, missing chars at the end of short lines become walls.
+       The file is memory-mapped and each line is translated by CHAR_TILES in one go.
+       returns width, height, tiles (bytearray) and spawns, a list of (marker char, x, y)"""
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        # --- start and end of all non-empty lines ---
+        rows = []
+        start = 0
+        while start < len(m):
+            end = m.find(b"\n", start)
+            if end < 0:
+                end = len(m)
+            if m[start:end].strip():
+                rows.append((start, end - 1 if m[end - 1:end] == b"\r" else end))
+            start = end + 1
+        width = max(end - start for start, end in rows)
+        tiles = bytearray([WALL]) * (width * len(rows))
+        spawns = []
+        for y, (start, end) in enumerate(rows):
+            tiles[y * width:y * width + end - start] = m[start:end].translate(CHAR_TILES)
+            for match in SPAWN_MARKERS.finditer(m, start, end):
+                spawns.append((match.group(), match.start() - start, y))
+    return width, len(rows), tiles, spawns
+
+
+def read_level_binary(filename):
+    """read a level file made by compile_level. returns the same as read_level_text"""
+    with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        magic, version, width, height, number_of_spawns = LEVEL_FILE_HEADER.unpack_from(m)
+        if magic != LEVEL_FILE_MAGIC or version > LEVEL_FILE_VERSION:
+            raise ValueError("{} is not a level file (version {})".format(filename, LEVEL_FILE_VERSION))
+        start = LEVEL_FILE_HEADER.size
+        tiles = bytearray(m[start:start + width * height])
+        start += width * height
+        spawns = list(SPAWN_RECORD.iter_unpack(m[start:start + number_of_spawns * SPAWN_RECORD.size]))
+    return width, height, tiles, spawns
+
+
+def compile_level(filename):
+    """convert a level text file into the binary level format (same name, but .lvl).
+       Game.load_level prefers the .lvl file if it is not older than the text file.
+       returns the name of the .lvl file"""
+    width, height, tiles, spawns = read_level_text(filename)
+    binary = os.path.splitext(filename)[0] + ".lvl"
+    with open(binary, "wb") as f:
+        f.write(LEVEL_FILE_HEADER.pack(LEVEL_FILE_MAGIC, LEVEL_FILE_VERSION, width, height, len(spawns)))
+        f.write(tiles)
+        f.write(b"".join(SPAWN_RECORD.pack(*spawn) for spawn in spawns))
+    return binary
+
+
+class Dungeon:
+    """the list of all dungeon levels (Game.dungeon), used like a list of Level instances.
+       A level can also be kept encoded (see encode_level), then it is decoded
+       only when it is needed for the first time (see Game.load)"""
+
+    def __init__(self, levels=()):
+        self.levels = list(levels)  # Level instances, bytes or the name of a file with those bytes
+
+    def __len__(self):
+        return len(self.levels)
+
+    def __getitem__(self, z):
+        level = self.levels[z]
+        if not isinstance(level, Level):
+            if isinstance(level, str):
+                filename = level
+                with open(filename, "rb") as f:
+                    level = f.read()
+                os.remove(filename)
+            level = decode_level(level)
+            self.levels[z] = level
+        return level
+
+    def __setitem__(self, z, level):
+        self.levels[z] = level
+
+    def __iter__(self):
+        for z in range(len(self.levels)):
+            yield self[z]
+
+    def append(self, level):
+        self.levels.append(level)
+
+    def is_decoded(self, z):
+        return isinstance(self.levels[z], Level)
+
+    def encoded(self, z, compress=True):
+        """returns level z as bytes, without decoding it if it is still encoded"""
+        level = self.levels[z]
+        if isinstance(level, Level):
+            return encode_level(level, compress)
+        if isinstance(level, str):
+            with open(level, "rb") as f:
+                return f.read()
+        return level
+
+    def nbytes(self, z):
+        """bytes used by decoded level z"""
+        level = self.levels[z]
+        return len(level.tiles) + len(level.decorations) + len(level.explored)
+
+    def evict(self, z, folder=None, prefix=""):
+        """encode level z (compressed). folder None: keep the bytes in memory,
+           otherwise write them into a file in folder. It is decoded again when needed"""
+        data = self.encoded(z)
+        if folder is not None:
+            filename = os.path.join(folder, "{}-{}.level".format(prefix, z))
+            with open(filename, "wb") as f:
+                f.write(data)
+            data = filename
+        self.levels[z] = data
+
+
+def carve_tunnel(level, x1, y1, x2, y2, generator):
+    """carve a tunnel of floor tiles from x1,y1 to x2,y2: first horizontally, then vertically
+       or the other way round (generator: random.Random instance decides)"""
+    if generator.choice([0, 1]) == 1:
+        level.fill_rect(min(x1, x2), y1, abs(x2 - x1) + 1, 1, FLOOR)
+        level.fill_rect(x2, min(y1, y2), 1, abs(y2 - y1) + 1, FLOOR)
+    else:
+        level.fill_rect(x1, min(y1, y2), 1, abs(y2 - y1) + 1, FLOOR)
+        level.fill_rect(min(x1, x2), y2, abs(x2 - x1) + 1, 1, FLOOR)
+
+
+class LevelPlan:
+    """a generated dungeon level that is not yet part of the Game (see Game.install_level).
+       Has no Objects, only their class names, so it can be pickled and come from another process:
+       tiles, decorations: bytes like in Level
+       rooms: list of Rect
+       spawns: list of (class name, x, y) of all Objects in this level
+       rng_state: state of the level's random stream when generation stopped. The Game continues
+                  with it, so the level is the same no matter where and when it was generated
+    """
+
+    def __init__(self, z, width, height, tiles, decorations, rooms, spawns, rng_state):
+        self.z = z
+        self.width = width
+        self.height = height
+        self.tiles = tiles
+        self.decorations = decorations
+        self.rooms = rooms
+        self.spawns = spawns
+        self.rng_state = rng_state
+
+
+def generate_level(seed, z, width, height, monsters, loot, density=1.0, stairs_up=None,
+                   room_max_size=10, room_min_size=6, max_rooms=30):
+    """carve some random rooms, connected by tunnels, out of a level full of walls and decide
+       where stairs, monsters and loot will be. Needs nothing from the Game, so it can run in
+       a worker thread or process (see Game.pregenerate_level).
+       monsters, loot: lists of class names to choose from.
+       density: factor for the number of monsters and loot (2: twice as many).
+       stairs_up: x,y of the stairs down of the level above. Each gets a stair up, with a tunnel
+                  to a random room if it is inside a wall. None: one stair up in a random room.
+       There is no tunnel from the player's position to the first room: the player arrives
+       on one of the stairs up, and those are connected anyway. returns a LevelPlan"""
+    generator = level_random(seed, z)
+    level = Level(width, height, WALL, generator.randbytes(width * height))
+    rooms = []
+    for r in range(max_rooms):
+        # random width and height
+        w = generator.randint(room_min_size, room_max_size)
+        h = generator.randint(room_min_size, room_max_size)
+        # random topleft position without going out of the boundaries of the map
+        x = generator.randint(0, width - w - 1)
+        y = generator.randint(0, height - h - 1)
+        new_room = Rect(x, y, w, h)
+        # run through the other rooms and see if they intersect with this one
+        for other_room in rooms:
+            if new_room.intersect(other_room):
+                break
+        else:  # for loop got through without a break
+            # no intersections, so this room is valid. carve it out! (each room has a wall)
+            level.fill_rect(x + 1, y + 1, w - 1, h - 1, FLOOR)
+            if len(rooms) > 0:
+                # connect the new room with the previous room
+                carve_tunnel(level, *rooms[-1].center(), *new_room.center(), generator)
+            rooms.append(new_room)
+    spawns = []
+    # ---------- stairs up ---------------
+    if stairs_up is None:
+        stairs_up = [generator.choice(rooms).center()]
+    for x, y in stairs_up:
+        if level.tile(x, y).block_movement:
+            carve_tunnel(level, x, y, *generator.choice(rooms).center(), generator)
+        spawns.append(("StairUp", x, y))
+    # ------------------ stairs down ----------------
+    # up to 3 random rooms get a stair down in their center, if there is no stair up
+    occupied = set(stairs_up)
+    stairs = min(generator.randint(1, 3), len({room.center() for room in rooms} - occupied))
+    while stairs > 0:
+        x, y = generator.choice(rooms).center()
+        if (x, y) not in occupied:
+            occupied.add((x, y))
+            spawns.append(("StairDown", x, y))
+            stairs -= 1
+    if not any(name == "StairDown" for name, x, y in spawns):
+        # stairs up in all room centers. any other tile of a room will do
+        room = generator.choice(rooms)
+        spawns.append(("StairDown", *generator.choice([(x, y) for y in range(room.y1 + 1, room.y2)
+                                                       for x in range(room.x1 + 1, room.x2)
+                                                       if (x, y) not in occupied])))
+    # --------------- monsters -------------------
+    # 10% chance for 0 monster in a room. 70% chance for 1 monster, 15% for 2, 5% for 3
+    for room in rooms:
+        for _ in range(round(randomizer([0.1, 0.7, 0.15, 0.05], generator) * density)):
+            x = generator.randint(room.x1 + 1, room.x2 - 1)
+            y = generator.randint(room.y1 + 1, room.y2 - 1)
+            spawns.append((generator.choice(monsters), x, y))
+    # ---- each floor tile has a small chance to spawn loot and very small chance to spawn a shop ----
+    for i, tile in enumerate(level.tiles):
+        if tile == FLOOR:
+            y, x = divmod(i, width)
+            if generator.random() < 0.01 * density:
+                spawns.append((generator.choice(loot), x, y))
+            if generator.random() < 0.001:
+                spawns.append(("Shop", x, y))
+    return LevelPlan(z, width, height, bytes(level.tiles), bytes(level.decorations),
+                     rooms, spawns, generator.getstate())
+
+
+class SpatialIndex:
+    """per-level, per-tile multimap of all dungeon objects: {z: {(x, y): [Object, ...]}}
+       Object.__init__, Object.kill and every position change keep it in sync,
+       so asking 'what is on this tile?' costs O(objects on tile) instead of
+       scanning Game.objects (all objects of all dungeon levels)
+    """
+
+    def __init__(self):
+        self.levels = {}  # {z: {(x, y): [Object, ...]}}
+        # set of (x, y, z) of all tiles where objects came, went or changed their look.
+        # None: nobody wants to know. A renderer sets it to a set() and empties it after
+        # each redraw, to paint only the tiles that have changed (see Viewer.update_dungeon)
+        self.changed = None
+
+    def add(self, o):
+        self.levels.setdefault(o.z, {}).setdefault((o.x, o.y), []).append(o)
+        if self.changed is not None:
+            self.changed.add((o.x, o.y, o.z))
+
+    def remove(self, o):
+        level = self.levels[o.z]
+        here = level[(o.x, o.y)]
+        here.remove(o)
+        if len(here) == 0:
+            del level[(o.x, o.y)]  # keep only occupied tiles in the index
+        if self.changed is not None:
+            self.changed.add((o.x, o.y, o.z))
+
+    def touch(self, o):
+        """o looks different now (but stays on its tile), see changed"""
+        if self.changed is not None:
+            self.changed.add((o.x, o.y, o.z))
+
+    def move(self, o, x, y, z):
+        """change position of object o to x, y, z and update the index"""
+        self.remove(o)
+        o.x, o.y, o.z = x, y, z
+        self.add(o)
+
+    def at(self, x, y, z, cls=None):
+        """returns a list of all objects at tile x, y of level z.
+           if cls is given, only objects that are instances of cls"""
+        try:
+            here = self.levels[z][(x, y)]
+        except KeyError:
+            return []
+        if cls is None:
+            return list(here)
+        return [o for o in here if isinstance(o, cls)]
+
+    def count(self, z):
+        """number of objects in dungeon level z"""
+        return sum(len(here) for here in self.levels.get(z, {}).values())
+
+    def level(self, z, cls=None):
+        """returns a list of all objects in dungeon level z.
+           if cls is given, only objects that are instances of cls"""
+        result = []
+        for here in self.levels.get(z, {}).values():
+            for o in here:
+                if cls is None or isinstance(o, cls):
+                    result.append(o)
+        return result
+
+
+class EntityStore:
+    """all Objects of the game (Game.objects), stored as component columns: one array per
+       component (x, y, z, hitpoints, look_direction, kind), indexed by the object number.
+       An Object is only a thin view with its number, its attributes x, y, z, hitpoints and
+       look_direction are read from and written to the columns (see column).
+       Systems like the monster turn ask select for object numbers and work on the columns,
+       instead of walking through the objects and checking isinstance.
+       It can be used like the old dictionary {number: Object}"""
+
+    def __init__(self):
+        self.kind = bytearray()  # 0: no object (killed or frozen). otherwise index + 1 in self.classes
+        self.x = array.array("i")
+        self.y = array.array("i")
+        self.z = array.array("i")
+        self.hitpoints = array.array("i")
+        self.look_direction = array.array("b")
+        self.views = []  # the Object of each number, or None
+        self.classes = []  # all classes that have (or had) objects here
+        self.tables = {}  # {cls: bytes.translate table: 1 for each kind that is a subclass of cls}
+        self.count = 0
+
+    def __setitem__(self, number, o):
+        """add Object o (with number) to the store"""
+        while len(self.kind) <= number:
+            self.kind.append(0)
+            for column in (self.x, self.y, self.z, self.hitpoints, self.look_direction):
+                column.append(0)
+            self.views.append(None)
+        if o.__class__ not in self.classes:
+            self.classes.append(o.__class__)
+            self.tables = {}
+        if self.views[number] is None:
+            self.count += 1
+        self.kind[number] = self.classes.index(o.__class__) + 1
+        self.views[number] = o
+
+    def __delitem__(self, number):
+        if self.views[number] is None:
+            raise KeyError(number)
+        self.kind[number] = 0
+        self.views[number] = None
+        self.count -= 1
+
+    def __getitem__(self, number):
+        o = self.views[number] if 0 <= number < len(self.views) else None
+        if o is None:
+            raise KeyError(number)
+        return o
+
+    def __contains__(self, number):
+        return 0 <= number < len(self.views) and self.views[number] is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.select(Object))
+
+    def keys(self):
+        return self.select(Object)
+
+    def values(self):
+        return [self.views[n] for n in self.select(Object)]
+
+    def items(self):
+        return [(n, self.views[n]) for n in self.select(Object)]
+
+    def select(self, cls, z=None):
+        """returns the numbers (ascending) of all objects that are instances of cls
+           (a class or a tuple of classes), only those in dungeon level z if z is not None"""
+        table = self.tables.get(cls)
+        if table is None:
+            table = bytes([0] + [1 if issubclass(c, cls) else 0 for c in self.classes] +
+                          [0] * (255 - len(self.classes)))
+            self.tables[cls] = table
+        mask = self.kind.translate(table)
+        numbers = []
+        number = mask.find(1)
+        while number >= 0:
+            numbers.append(number)
+            number = mask.find(1, number + 1)
+        if z is not None:
+            zs = self.z
+            numbers = [n for n in numbers if zs[n] == z]
+        return numbers
+
+
+def column(name):
+    """an Object attribute that lives in the column name of the EntityStore Game.objects"""
+
+    def get(self):
+        return getattr(Game.objects, name)[self.number]
+
+    def set(self, value):
+        getattr(Game.objects, name)[self.number] = value
+
+    return property(get, set)
+
+
+class Object():
+    """this is a generic dungeon object: the player, a monster, an item, a stair..
+       it's always represented by a character (for text representation).
+       NOTE: a dungeon tile (wall, floor, water..) is represented by the Tile class
+       Objects have no __dict__: each class declares the attributes that differ from object
+       to object in __slots__. Everything that is the same for all objects of a class
+       (char, color, monster stats...) is a class attribute, the template of this class.
+    """
+    __slots__ = ("number",)
+    x = column("x")
+    y = column("y")
+    z = column("z")
+    hitpoints = column("hitpoints")
+    look_direction = column("look_direction")  # 0 -> looks to left, 1 -> looks to right
+    images = [] # for Viewer
+    next_number = 0  # number of the next new object. the number is the key for Game.objects
+    save_fields = ()  # attributes that Game.save must store (x, y, z, hitpoints and look_direction always)
+    # ---- template ----
+    char = "?"  # for text representation
+    color = None
+    hint = None  # longer description and hint for panel
+    image_name = None
+    base_hitpoints = 1  # hitpoints of a new object. objects with 0 or less hitpoints will be deleted
+    stay_visible_once_explored = False
+
+    def __init__(self, x, y, z=0, **kwargs):
+        self.number = Object.next_number
+        Object.next_number += 1
+        self._setup(x, y, z)
+        # --- child classes draw their random values in _roll(). Decoded objects keep their old ones
+        self._roll()
+        # --- named arguments set slots or columns, like Wolf(1, 2, hitpoints=33) ---
+        for key, arg in kwargs.items():
+            if not isinstance(getattr(self.__class__, key, None), (types.MemberDescriptorType, property)):
+                raise TypeError("{} has no attribute {} (see __slots__)".format(self.__class__.__name__, key))
+            setattr(self, key, arg)
+        # --- update legend ---
+        #if self.char not in Game.legend:
+        #    Game.legend[self.char] = self.__class__.__name__
+
+    @classmethod
+    def restore(cls, number, x, y, z, hitpoints, look_direction, fields):
+        """an Object decoded by Game.decode_objects: like cls(x, y, z), but with its old number,
+           hitpoints, look_direction and save_fields instead of new random values"""
+        o = cls.__new__(cls)  # not __init__: _roll would use up numbers of rng.generation
+        o.number = number
+        o._setup(x, y, z)
+        o.hitpoints = hitpoints
+        o.look_direction = look_direction
+        for field, value in fields.items():
+            setattr(o, field, value)
+        return o
+
+    def _setup(self, x, y, z):
+        """everything __init__ does, except choosing the number and the random values"""
+        Game.objects[self.number] = self
+        self.x = x
+        self.y = y
+        self.z = z
+        Game.spatial.add(self)
+        self.hitpoints = self.base_hitpoints
+        self.look_direction = 0
+        # --- child classes can do stuff in the _overwrite() method  without needing their own __init__ method
+        self._overwrite()
+
+    def kill(self):
+        # delete this object from Game.objects and from the spatial index
+        del Game.objects[self.number]
+        Game.spatial.remove(self)
+
+    def _overwrite(self):
+        pass
+
+    def _roll(self):
+        pass
+
+
+class Item(Object):
+    """an item that you can pick up"""
+
+    __slots__ = ()
+    images = []
+    color = (255, 165, 0)  # orange
+    weight = 0
+    i = 0 # index of item image
+
+
+class Scroll(Item):
+    """a scroll with a spell on it"""
+
+    __slots__ = ("spell",)
+    save_fields = ("spell",)
+    color = (200, 200, 0)
+    char = "i"
+    hint = "consumable magic scroll "
+
+    def _roll(self):
+        # TODO: scroll icons, hotkey tooltip?
+        self.spell = rng.generation.choice(("heal",
+                                    "magic map",
+                                    "blink",
+                                    "bleed",
+                                    "magic missile",
+                                    "fireball",
+                                    ))
+        # disarm onfuse hurt bleed combat bless defense bless bull strenght dragon strenght superman
+        # TODO: different image index (i) for different spells
+
+
+class Gold(Item):
+    """a heap of gold"""
+
+    __slots__ = ("value",)
+    save_fields = ("value",)
+    color = (200, 200, 0)
+    char = "*"
+
+    def _roll(self):
+        self.value = rng.generation.randint(1, 10)
+
+class Arrows(Item):
+
+    __slots__ = ("quantity",)
+    save_fields = ("quantity",)
+    color = (14,55,15)
+    char = "a"
+
+    def _roll(self):
+        self.quantity = rng.generation.randint(1, 33)
+
+class Immobile(Object):
+    """immobile object like trees, shops, stairs, doors etc
+    immobile's can't be picked up """
+
+    __slots__ = ()
+    stay_visible_once_explored = True
+
+
+class Shop(Immobile):
+    """a shop to trade items"""
+
+    __slots__ = ("closed",)
+    images_closed = []  # for Viewer, when the shop is closed
+    save_fields = ("closed",)
+    color = (200, 200, 0)
+    char = "$"
+    hint = "press Space to buy hp"
+
+    def close_shop(self):
+        self.closed = True
+        Game.spatial.touch(self)
+
+    def _overwrite(self):
+        self.closed = False
+
+class StairUp(Immobile):
+    """a stair, going upwards < or downwards >"""
+
+    __slots__ = ()
+    char = "<"
+    color = (128, 0, 128)  # violet
+    hint = "press < to climb up"
+
+class StairDown(Immobile):
+
+    __slots__ = ()
+    char = ">"
+    color = (128, 0, 128)  # violet
+    hint = "press > to climb down"
+
+
+
+class Monster(Object):
+    """a (moving?) dungeon Monster, like the player, a boss, a NPC...
+       the stats (aggro, attack, defense, damage, natural weapons...) are class attributes,
+       shared by all monsters of a class"""
+
+    __slots__ = ()
+    images =[]
+    char = "M"
+    color = (255, 255, 0)
+    aggro = 3
+    shoot_arrows = False
+    shoot_magic = False
+
+    def ai(self, player):
+        """returns dx, dy toward the player (if distance < aggro) or randomly. see ai_intents"""
+        return ai_intents([self.number], player)[0]
+
+    def move(self, dx, dy, dz=0):
+        if dx != 0 and self.look_direction != (dx > 0):
+            self.look_direction = 1 if dx > 0 else 0
+            Game.spatial.touch(self)
+        level = Game.dungeon[self.z + dz]
+        if not level.inside(self.x + dx, self.y + dy):
+            raise SystemError("out of dungeon?", self.x, self.y, self.z)
+        target = level.tile(self.x + dx, self.y + dy)
+        # --- check if monsters is trying to run into a wall ---
+        if target.block_movement:
+            if isinstance(self, Player):
+                self.hitpoints -= 1
+                Game.log.append("ouch!")  # movement is not possible
+            return
+
+        Game.spatial.move(self, self.x + dx, self.y + dy, self.z + dz)
+
+
+def ai_intents(numbers, player):
+    """the ai system: returns a list of dx, dy for the monsters with these object numbers
+       (all in the same dungeon level), working on the columns of Game.objects.
+       A monster nearer to the player than its aggro goes toward the player, following the
+       flow field around walls (see Game.make_flow_map), otherwise it moves randomly.
+       Moves out of the level or into a wall become 0, 0"""
+    objects = Game.objects
+    xs, ys, zs, kinds = objects.x, objects.y, objects.z, objects.kind
+    aggros = [0] + [getattr(c, "aggro", 0) for c in objects.classes]  # class template of each kind
+    intents = []
+    for n in numbers:
+        x, y = xs[n], ys[n]
+        level = Game.dungeon[zs[n]]
+        if (x - player.x) ** 2 + (y - player.y) ** 2 < aggros[kinds[n]] ** 2:
+            step = None
+            if Game.flow_map is not None and zs[n] == player.z:
+                step = Game.flow_map.downhill(x, y)
+            if step is None:
+                dx = minmax(player.x - x, -1, 1)
+                dy = minmax(player.y - y, -1, 1)
+            else:
+                dx, dy = step
+        else:
+            dx = rng.ai.choice((-1, 0, 1))
+            dy = rng.ai.choice((-1, 0, 1))
+        if not level.inside(x + dx, y + dy) or level.tile(x + dx, y + dy).block_movement:
+            dx, dy = 0, 0  # monster trying to leave the dungeon or to move into a wall
+        intents.append((dx, dy))
+    return intents
+
+
+class Wolf(Monster):
+
+    __slots__ = ()
+    char = "W"
+    level = 1
+    aggro = 5
+    base_hitpoints = 30
+    attack = (2, 6)
+    defense = (2, 5)
+    damage = (2, 4)
+    agility = 0.4
+    natural_weapons = (WolfBite(),)
+    image_name = "direwolf"
+
+
+class Snake(Monster):
+
+    __slots__ = ()
+    char = "S"
+    aggro = 2
+    level = 1
+    base_hitpoints = 20
+    attack = (2, 4)
+    defense = (3, 3)
+    damage = (3, 4)
+    fighting_range = 3
+    natural_weapons = (SnakeBite(),)
+    image_name = "snake"
+
+
+class Yeti(Monster):
+
+    __slots__ = ()
+    char = "Y"
+    aggro = 4
+    level = 2
+    base_hitpoints = 20
+    attack = (8, 2)
+    defense = (4, 3)
+    damage = (4, 5)
+    fighting_range = 15
+    natural_weapons = (YetiSnowBall(), YetiSlap())
+    image_name = "yeti"
+
+
+class Dragon(Monster):
+
+    __slots__ = ()
+    char = "D"
+    aggro = 6
+    level = 3
+    immobile = True
+    shoot_arrows = True
+    fighting_range = 15 #random.randint(10, 15)
+    base_hitpoints = 50
+    attack = (6, 3)
+    defense = (6, 3)
+    damage = (5, 3)
+    natural_weapons = (DragonBite(), DragonClaw(), DragonTail(), FireBreath())
+    image_name = "dragon"
+
+
+class Player(Monster):
+
+    __slots__ = ("hitpoints_max", "gold", "arrows", "scrolls", "scroll_list", "victims", "items")
+    save_fields = ("hitpoints_max", "gold", "arrows", "scrolls", "victims")
+    char = "@"
+    color = (0, 0, 255)
+    base_hitpoints = 100
+    attack = (3, 6)
+    defense = (3, 5)
+    damage = (4, 5)
+    natural_weapons = (Fist(), Kick())
+    image_name = "arch-mage"
+    sniffrange_monster = 4
+    sniffrange_items = 6
+
+    def _overwrite(self):
+        self.hitpoints_max = 125
+        self.items = {}
+        self.gold = 100
+        self.scrolls = {}
+        self.scroll_list = []
+        self.victims = {}
+        self.arrows = 5
+
+    def calculate_scroll_list(self):
+        """returns a list of (key, spell name, number of scrolls) tuples"""
+
+        result = []
+        for i, spell in enumerate(self.scrolls):
+            result.append((ALPHABET[i], spell, self.scrolls[spell]))
+        self.scroll_list = result
+
+    def spell_from_key(self, key):
+        for i, spell, number in self.scroll_list:
+            if i == key and number > 0:
+                return spell
+        return None
+
+
+# Objects for the marker chars in hand-made level files ("M" is a random monster, see Game.load_level)
+SPAWNS = {b"<": StairUp, b">": StairDown, b"$": Shop, b"a": Arrows, b"*": Gold}
+
+# ----- savegame format, see Game.save -----
+SAVE_MAGIC = b"RBSV"
+SAVE_VERSION = 1
+SAVE_HEADER = struct.Struct("<4sHBI")  # magic, format version, flags (1: zlib compressed), number of levels
+BLOCK_LENGTH = struct.Struct("<I")  # each block starts with its length in bytes
+OBJECT_RECORD = struct.Struct("<BIHHHiBH")  # class index, number, x, y, z, hitpoints, look_direction,
+                                            # length of the json with the save_fields that follows
+# ----- replay format, see Replay -----
+REPLAY_MAGIC = b"RBRP"
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct("<4sHI")  # magic, format version, length of the json with the game settings
+# the actions of Game.step and the struct format of their arguments. "s": a name, stored as
+# a byte: its index in the list of names of the replay
+REPLAY_ACTIONS = (("move", "bb"), ("wait", ""), ("fire", "hh"), ("cast", "shh"), ("stairs", ""),
+                  ("torch", "b"), ("travel", "hh"), ("explore", ""), ("fov", "s"))
+REPLAY_RECORDS = {name: (code, struct.Struct("<B" + arguments.replace("s", "B")))
+                  for code, (name, arguments) in enumerate(REPLAY_ACTIONS)}
+
+
+class Game():
+    dungeon = Dungeon()  # all Levels. z=0: first level. z=1: second level etc
+    fov_map = None  # field of view map (FovMap), only for current level!
+    fov_cache = collections.OrderedDict()  # {(z, x, y, torch_radius, fov_algorithm, map version): FovMap}
+    fov_cache_size = 64  # max. number of FovMaps in fov_cache
+    map_versions = {}  # {z: version}. version of a level increases whenever its tiles change
+    flow_map = None  # DijkstraMap toward the player, only for current level! see make_flow_map
+    flow_key = None  # (z, x, y, map version) of the player when flow_map was calculated
+    flow_range = 20  # max. number of steps a monster can follow the flow_map
+    path_cache = collections.OrderedDict()  # {(z, start, goal, map version): path}. see find_path
+    path_cache_size = 32  # max. number of paths in path_cache
+    travel_limit = 1000  # max. number of turns for one "explore" action
+    pregenerate = "thread"  # generate the next level in advance in a "thread" or "process". None: never
+    level_pools = {}  # {"thread" or "process": concurrent.futures executor}, created when first needed
+    pending_levels = {}  # {z: Future of a LevelPlan}, see pregenerate_level
+    levelmonsters = [Snake, Wolf, Yeti, Dragon]  # in level z, only the first z monsters appear
+    level_density = 1.0  # factor for the number of monsters and loot in generated levels
+    object_classes = []  # class names of Objects. OBJECT_RECORD stores the index. see encode_objects
+    frozen = {}  # {z: zlib-compressed OBJECT_RECORDs or file name}. Objects of levels far away
+    visits = collections.OrderedDict()  # {z: None} least recently visited level first
+    hot_levels = 5  # max. number of decoded levels (at least the current level and its neighbours)
+    hot_bytes = 64 * 1024 * 1024  # max. bytes of hot levels (decoded tiles and live objects), see manage_levels
+    object_bytes = 200  # about the memory of one live Object (instance, columns, spatial index), see manage_levels
+    cold_folder = None  # None: keep cold levels compressed in memory. otherwise: write them into this folder
+    cold_files = None  # folder of this game inside cold_folder, created when needed. see cold_files_folder
+    lootlist = [Gold, Arrows, Scroll]
+    objects = EntityStore()  # all Object instances in this dungeon, see EntityStore
+    spatial = SpatialIndex()  # the same objects, indexed by level and tile position
+    tiles_x = 0
+    tiles_y = 0
+    torch_radius = 10 # for field of view calculation
+    fov_algorithm = "shadowcast"  # key of FOV_ALGORITHMS
+    log = []  # message log
+    game_over = False
+    cursor_x = 0  # absolute coordinate, tile
+    cursor_y = 0
+    player = None
+    seed = None  # seed of all random streams (see RandomStreams)
+    events = []  # visual effects of the last actions, as (name, {data}) tuples. see emit
+    renderer = None  # something with a method handle_events(events), like the Viewer. None when headless
+    replay = None  # Replay that records each action of Game.step, None: no recording
+
+    # friend_image = "arch-mage-idle"
+    # foe_image = None
+
+    def __init__(self, tiles_x=80, tiles_y=40, seed=None):
+        """seed: the same seed gives the same dungeon and the same fights. None for a random seed"""
+        self.forget_everything(tiles_x, tiles_y, seed)
+        # self.checked = set()   # like a list, but without duplicates. for fov calculation
+        Game.player = Player(x=1, y=1, z=0)
+        Game.cursor_x = self.player.x
+        Game.cursor_y = self.player.y
+        # Monster(2,2,0)
+        Wolf(2, 2, 0)
+        #Yeti(2,2,0)
+        Snake(3, 3, 0)
+        Yeti(4, 4, 0)
+        Dragon(33, 6, 0)
+        Dragon(30, 5, 0)
+        Dragon(31, 4, 0)
+        Shop(7, 1, 0)
+        #for a in range(5):
+        #    Gold(2, 1+a , 0)
+        Gold(3,1,0)
+        Gold(4,1,0)
+
+        for _ in range(15):
+            Scroll(4, 4, 0)
+            Scroll(5, 4, 0)
+            Scroll(4, 6, 0)
+
+        # Scroll(4, 5, 0)
+        self.log.append("Welcome to the first dungeon level (level 0)!")
+        self.log.append("Use cursor keys to move around")
+        self.log.append("dungeon seed: {}".format(Game.seed))
+        self.load_level(0, "level001.txt", "data")
+        # self.load_level(1, "level002.txt", "data")
+        # self.load_level(2, "level003.txt", "data")
+        self.create_level(1)  # random rooms and tunnels
+        self.visit_level(0)
+        self.make_fov_map()  # ready for the first Game.step
+
+    def forget_everything(self, tiles_x, tiles_y, seed):
+        """start a new game: forget everything from a previous game
+           (many headless games can run in one process) and restart the random streams"""
+        rng.seed(seed)
+        Game.seed = rng.seed_value
+        Game.forget_cold_files()
+        Game.dungeon = Dungeon()
+        Game.fov_map = None
+        Game.fov_cache = collections.OrderedDict()
+        Game.map_versions = {}
+        Game.flow_map = None
+        Game.flow_key = None
+        Game.path_cache = collections.OrderedDict()
+        Game.stop_workers()  # levels of a previous game are useless
+        Game.object_classes = []
+        Game.frozen = {}
+        Game.visits = collections.OrderedDict()
+        Game.objects = EntityStore()
+        Game.spatial = SpatialIndex()
+        Game.log = []
+        Game.events = []
+        Game.game_over = False
+        Object.next_number = 0
+        Game.tiles_x = tiles_x  # max. width of the level in tiles
+        Game.tiles_y = tiles_y  # max. height of the level in tiles, top row is 0, second row is 1 etc.
+        self.turn = 1
+
+    def save(self, filename, compress=True):
+        """write the whole game into a binary file. The file is a header (see SAVE_HEADER)
+           followed by blocks, each starting with its length:
+           the game state (seed, turn, log, random streams...) as json,
+           all Objects as typed records (see OBJECT_RECORD and Object.save_fields),
+           one block for each level (see encode_level), so Game.load can decode levels lazily.
+           compress: zlib-compress all blocks"""
+        records = self.encode_objects(Game.objects.values())
+        # objects of frozen levels are already encoded (see freeze_level)
+        records += b"".join(self.frozen_records(z) for z in sorted(Game.frozen))
+        state = {"seed": Game.seed, "tiles_x": Game.tiles_x, "tiles_y": Game.tiles_y,
+                 "turn": self.turn, "log": Game.log, "game_over": Game.game_over,
+                 "torch_radius": Game.torch_radius, "fov_algorithm": Game.fov_algorithm,
+                 "cursor": [Game.cursor_x, Game.cursor_y], "player": self.player.number,
+                 "next_number": Object.next_number, "classes": Game.object_classes,
+                 "random": {name: getattr(rng, name).getstate() for name in ("combat", "ai", "cosmetic")}}
+        blocks = [json.dumps(state, separators=(",", ":")).encode("utf-8"), records]
+        if compress:
+            blocks = [zlib.compress(block) for block in blocks]
+        blocks.extend(Game.dungeon.encoded(z, compress) for z in range(len(Game.dungeon)))
+        with open(filename, "wb") as f:
+            f.write(SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, 1 if compress else 0, len(Game.dungeon)))
+            for block in blocks:
+                f.write(BLOCK_LENGTH.pack(len(block)))
+                f.write(block)
+
+    @classmethod
+    def load(cls, filename):
+        """returns the Game saved in filename by Game.save. The levels stay encoded
+           until they are needed (see Dungeon), the Objects of all levels except the current
+           one and its neighbours stay frozen (see freeze_level)"""
+        with open(filename, "rb") as f:
+            data = f.read()
+        magic, version, flags, number_of_levels = SAVE_HEADER.unpack_from(data)
+        if magic != SAVE_MAGIC:
+            raise ValueError("{} is not a savegame".format(filename))
+        if version > SAVE_VERSION:
+            raise ValueError("savegame version {} is too new, i know only version {}".format(version, SAVE_VERSION))
+        blocks = []
+        offset = SAVE_HEADER.size
+        for _ in range(2 + number_of_levels):
+            length, = BLOCK_LENGTH.unpack_from(data, offset)
+            offset += BLOCK_LENGTH.size
+            blocks.append(data[offset:offset + length])
+            offset += length
+        state, records = blocks[:2]
+        if flags & 1:
+            state = zlib.decompress(state)
+            records = zlib.decompress(records)
+        state = json.loads(state)
+        game = cls.__new__(cls)  # not __init__: that would create a new dungeon
+        game.forget_everything(state["tiles_x"], state["tiles_y"], state["seed"])
+        for name, (version, internal, gauss) in state["random"].items():
+            getattr(rng, name).setstate((version, tuple(internal), gauss))
+        Game.dungeon = Dungeon(blocks[2:])
+        # ---- objects: all levels start frozen, the player's level and its neighbours thaw ----
+        Game.object_classes = state["classes"]
+        for z, level_records in Game.split_records(records).items():
+            Game.frozen[z] = zlib.compress(level_records, 1)
+        Object.next_number = state["next_number"]
+        player_z = OBJECT_RECORD.unpack_from(records, Game.find_record(records, state["player"]))[4]
+        game.visit_level(player_z)
+        Game.player = Game.objects[state["player"]]
+        Game.player.calculate_scroll_list()
+        game.turn = state["turn"]
+        Game.log = state["log"]
+        Game.game_over = state["game_over"]
+        Game.torch_radius = state["torch_radius"]
+        Game.fov_algorithm = state["fov_algorithm"]
+        Game.cursor_x, Game.cursor_y = state["cursor"]
+        game.make_fov_map()  # decodes the current level
+        return game
+
+    def encode_objects(self, objects):
+        """returns OBJECT_RECORDs of objects, each followed by a json of its save_fields"""
+        records = []
+        for o in objects:
+            name = o.__class__.__name__
+            if name not in Game.object_classes:
+                Game.object_classes.append(name)
+            extra = b""
+            if o.save_fields:
+                extra = json.dumps({field: getattr(o, field) for field in o.save_fields},
+                                   separators=(",", ":")).encode("utf-8")
+            records.append(OBJECT_RECORD.pack(Game.object_classes.index(name), o.number,
+                                              o.x, o.y, o.z, o.hitpoints, o.look_direction, len(extra)))
+            records.append(extra)
+        return b"".join(records)
+
+    def decode_objects(self, records):
+        """create the Objects of records made by encode_objects again, with their old numbers
+           and values (see Object.restore): nothing is drawn from the random streams"""
+        offset = 0
+        while offset < len(records):
+            i, number, x, y, z, hitpoints, look_direction, length = OBJECT_RECORD.unpack_from(records, offset)
+            offset += OBJECT_RECORD.size
+            fields = json.loads(records[offset:offset + length]) if length > 0 else {}
+            offset += length
+            globals()[Game.object_classes[i]].restore(number, x, y, z, hitpoints, look_direction, fields)
+
+    @staticmethod
+    def split_records(records):
+        """returns {z: records} of the records made by encode_objects, without creating any Object"""
+        levels = {}
+        offset = 0
+        while offset < len(records):
+            z = OBJECT_RECORD.unpack_from(records, offset)[4]
+            end = offset + OBJECT_RECORD.size + OBJECT_RECORD.unpack_from(records, offset)[7]
+            levels.setdefault(z, []).append(records[offset:end])
+            offset = end
+        return {z: b"".join(parts) for z, parts in levels.items()}
+
+    @staticmethod
+    def find_record(records, number):
+        """returns the offset of the record of Object number in records"""
+        offset = 0
+        while offset < len(records):
+            fields = OBJECT_RECORD.unpack_from(records, offset)
+            if fields[1] == number:
+                return offset
+            offset += OBJECT_RECORD.size + fields[7]
+        raise ValueError("no object number {} in records".format(number))
+
+    def frozen_records(self, z):
+        """returns the (uncompressed) records of the frozen Objects of level z"""
+        data = Game.frozen[z]
+        if isinstance(data, str):
+            with open(data, "rb") as f:
+                data = f.read()
+        return zlib.decompress(data)
+
+    def freeze_level(self, z):
+        """make level z cold: encode and compress its tiles (see Dungeon.evict) and all its Objects.
+           The Objects leave Game.objects until thaw_level"""
+        objects = Game.spatial.level(z)
+        records = self.encode_objects(objects)
+        if z in Game.frozen:
+            records = self.frozen_records(z) + records
+            self.thaw_files(z)
+        data = zlib.compress(records, 1)
+        for o in objects:
+            o.kill()
+        folder = self.cold_files_folder()
+        if folder is not None:
+            filename = os.path.join(folder, "{}-{}.objects".format(Game.seed, z))
+            with open(filename, "wb") as f:
+                f.write(data)
+            data = filename
+        Game.frozen[z] = data
+        if Game.dungeon.is_decoded(z):
+            Game.dungeon.evict(z, folder, Game.seed)
+        # forget cached field of view maps of this level, they can be big
+        for key in [key for key in Game.fov_cache if key[0] == z]:
+            del Game.fov_cache[key]
+
+    @staticmethod
+    def cold_files_folder():
+        """the folder for the files of cold levels of this game, None if Game.cold_folder is None.
+           Each game gets its own folder inside Game.cold_folder, so two games with the same seed
+           (e.g. a replay next to a live game) never overwrite or delete each other's files"""
+        if Game.cold_folder is None:
+            return None
+        if Game.cold_files is None:
+            Game.cold_files = tempfile.mkdtemp(prefix="{}-".format(Game.seed), dir=Game.cold_folder)
+        return Game.cold_files
+
+    @staticmethod
+    def forget_cold_files():
+        """delete the files of cold levels of this game and their folder"""
+        if Game.cold_files is not None:
+            shutil.rmtree(Game.cold_files, ignore_errors=True)
+            Game.cold_files = None
+
+    def thaw_level(self, z):
+        """create the frozen Objects of level z again. The level itself is decoded when needed"""
+        if z in Game.frozen:
+            records = self.frozen_records(z)
+            self.thaw_files(z)
+            self.decode_objects(records)
+
+    def thaw_files(self, z):
+        """forget the frozen Objects of level z (and delete their file, if any)"""
+        data = Game.frozen.pop(z)
+        if isinstance(data, str):
+            os.remove(data)
+
+    def visit_level(self, z):
+        """the player arrives at level z: level z and its neighbours must be hot"""
+        for hot in (z - 1, z, z + 1):
+            self.thaw_level(hot)
+        Game.visits.pop(z, None)
+        Game.visits[z] = None
+        self.manage_levels(z)
+
+    def hot_bytes_of(self, n):
+        """bytes used by level n: its decoded tiles (if decoded) and its live Objects"""
+        size = Game.spatial.count(n) * Game.object_bytes
+        if Game.dungeon.is_decoded(n):
+            size += Game.dungeon.nbytes(n)
+        return size
+
+    def manage_levels(self, z):
+        """freeze least recently visited levels (but never z and its neighbours) until no more than
+           Game.hot_levels levels with no more than Game.hot_bytes bytes are hot.
+           A level is hot if its tiles are decoded or its Objects are live: visit_level thaws
+           the Objects of the neighbour levels without decoding their tiles"""
+        visits = list(Game.visits)
+        hot = [n for n in range(len(Game.dungeon)) if Game.dungeon.is_decoded(n) or Game.spatial.count(n) > 0]
+        # never visited levels first, then the least recently visited ones
+        hot.sort(key=lambda n: visits.index(n) + 1 if n in visits else 0)
+        sizes = {n: self.hot_bytes_of(n) for n in hot}
+        size = sum(sizes.values())
+        count = len(hot)
+        for n in hot:
+            if count <= Game.hot_levels and size <= Game.hot_bytes:
+                break
+            if abs(n - z) <= 1:
+                continue
+            size -= sizes[n]
+            count -= 1
+            self.freeze_level(n)
+
+    def emit(self, name, **data):
+        """remember a visual effect (arrow flying, gold pickup, explosion...) for the renderer.
+           The game itself never waits for or draws anything"""
+        Game.events.append((name, data))
+
+    def flush_events(self):
+        """hand all emitted events over to the renderer (if there is one) and forget them.
+           A renderer may play animations before this method returns"""
+        events = Game.events
+        Game.events = []
+        if self.renderer is not None and len(events) > 0:
+            self.renderer.handle_events(events)
+
+    def step(self, action, *args):
+        """the action API: do one player action, followed by the monster turn if the action took time.
+           Works without any display (headless). Actions and their arguments:
+           "move", dx, dy          move player or attack monster in this direction
+           "wait"                  wait a turn (or go shopping, if the player stays on a shop)
+           "fire", x, y            shoot an arrow at tile x,y
+           "cast", spell, x, y     cast a spell from a magic scroll at tile x,y
+           "stairs"                climb up or down a stair
+           "torch", delta          change torch radius by delta (takes no time)
+           "travel", x, y          walk to the explored tile x,y (one turn per tile)
+           "explore"               walk to unexplored tiles until disturbed or all is explored
+           "fov", name             use another fov algorithm (see FOV_ALGORITHMS, takes no time)
+           returns the result of the action (see the called methods)"""
+        if Game.replay is not None:
+            Game.replay.record(action, args)
+        if action == "move":
+            dx, dy = args
+            self.end_turn()
+            result = self.move_player(dx, dy)
+        elif action == "wait":
+            result = self.shopping()
+            if result:
+                self.emit("heal")
+            self.end_turn()
+        elif action == "fire":
+            Game.cursor_x, Game.cursor_y = args
+            start = (self.player.x, self.player.y)
+            result = self.player_arrow()
+            end, victims = result
+            if end is not None:
+                self.emit("arrow", start=start, end=end, victims=victims)
+                self.flush_events()
+                self.end_turn()
+        elif action == "cast":
+            spell, Game.cursor_x, Game.cursor_y = args
+            start = (self.player.x, self.player.y)
+            result = self.cast(spell)
+            if spell in ("magic missile", "fireball") and result:
+                end, victims = result
+                self.emit(spell, start=start, end=end, victims=victims)
+            elif spell == "heal" and result:
+                self.emit("heal")
+            elif spell == "bleed" and result:
+                self.emit("bleed", pos=result)
+            elif spell == "blink" and result:
+                self.emit("blink", start=result, end=(self.player.x, self.player.y))
+            self.flush_events()
+            if result:
+                self.end_turn()
+        elif action == "stairs":
+            self.end_turn()
+            result = self.use_stairs()
+            if result:
+                self.emit("level", z=self.player.z)
+        elif action == "torch":
+            Game.torch_radius += args[0]
+            self.make_fov_map()
+            result = True
+        elif action == "fov":
+            Game.fov_algorithm = args[0]
+            Game.log.append("field of view algorithm: {}".format(Game.fov_algorithm))
+            self.make_fov_map()
+            result = True
+        elif action == "travel":
+            # many turns, but the events (gold pickups etc.) are given to the renderer only once
+            result = self.travel(*args)
+        elif action == "explore":
+            result = self.explore()
+        else:
+            raise ValueError("unknown action: {}".format(action))
+        self.flush_events()
+        self.check_player()
+        return result
+
+    def end_turn(self):
+        """monsters shoot at the player (the renderer can play those animations), then all monsters act"""
+        self.monsters_shoot()
+        self.flush_events()
+        self.new_turn()
+
+    def monsters_shoot(self):
+        """all shooters (except player) shoot their arrows at the same time"""
+        objects = Game.objects
+        shooters = tuple(c for c in objects.classes if issubclass(c, Monster) and c.shoot_arrows)
+        for monster in [objects[n] for n in objects.select(shooters, self.player.z) if
+                        n != self.player.number and objects.hitpoints[n] > 0]:
+            # calculate distance to player
+            distance = ((monster.x - self.player.x) ** 2 + (monster.y - self.player.y) ** 2) ** 0.5
+            # monster shoots at you if it can, player is in shooting range and player sees monster
+            if Game.fov_map.visible(monster.x, monster.y) and distance < monster.fighting_range:
+                end, victimpos = self.other_arrow((monster.x, monster.y),
+                                                  (self.player.x, self.player.y), object="fire")
+                self.emit("monster missile", shooter=monster.__class__.__name__,
+                          start=(monster.x, monster.y), end=end, victims=victimpos)
+
+    def visible_monsters(self):
+        """returns a set of all living monsters the player can see"""
+        objects = Game.objects
+        return {objects[n] for n in objects.select(Monster, self.player.z) if n != self.player.number and
+                objects.hitpoints[n] > 0 and Game.fov_map.visible(objects.x[n], objects.y[n])}
+
+    def known_walkable(self, z):
+        """returns bytes with 1 for each tile of level z the player has explored and can walk on"""
+        level = Game.dungeon[z]
+        walkable = int.from_bytes(level.tiles.translate(WALKABLE), "little")
+        explored = int.from_bytes(level.explored, "little")
+        return (walkable & explored).to_bytes(len(level.tiles), "little")
+
+    def find_path(self, x, y):
+        """returns the shortest path (tuple of x,y) from the player to x,y over explored tiles
+           or None. Recent paths are kept in Game.path_cache: exploring more tiles does not make
+           a cached path wrong, only a change of the map does (see map_changed)"""
+        z = self.player.z
+        start = (self.player.x, self.player.y)
+        key = (z, start, (x, y), Game.map_versions.get(z, 0))
+        path = Game.path_cache.get(key)
+        if path is None:
+            level = Game.dungeon[z]
+            path = astar(self.known_walkable(z), level.width, level.height, start, (x, y))
+            if path is None:
+                return None  # not cached, exploring more tiles may open a way
+            path = tuple(path)
+            Game.path_cache[key] = path
+            if len(Game.path_cache) > Game.path_cache_size:
+                Game.path_cache.popitem(last=False)  # forget the least recently used path
+        else:
+            Game.path_cache.move_to_end(key)
+        return path
+
+    def walk(self, path, until=None):
+        """move the player along path (x,y tuples), one turn per tile, without attacking anybody.
+           stops if a new monster comes into view, the player gets hurt or until() returns True.
+           returns False if the player was disturbed"""
+        seen = self.visible_monsters()
+        hitpoints = self.player.hitpoints
+        for x, y in path:
+            # like step("move"): first the monsters, then the player
+            self.monsters_shoot()
+            self.new_turn()
+            if Game.spatial.at(x, y, self.player.z, Monster):
+                Game.log.append("Something is in your way")
+                return False
+            self.move_player(x - self.player.x, y - self.player.y)
+            self.check_player()
+            if Game.game_over or self.player.hitpoints < hitpoints:
+                return False
+            if self.visible_monsters() - seen:
+                Game.log.append("You see a monster and stop")
+                return False
+            if until is not None and until():
+                return True
+        return True
+
+    def travel(self, x, y):
+        """walk to the explored tile x,y. returns True if the player arrived there"""
+        level = Game.dungeon[self.player.z]
+        if not level.inside(x, y) or not level.is_explored(x, y) or level.tile(x, y).block_movement:
+            Game.log.append("You can not travel there")
+            return False
+        path = self.find_path(x, y)
+        if path is None:
+            Game.log.append("You know no way to get there")
+            return False
+        self.walk(path)
+        return (self.player.x, self.player.y) == (x, y)
+
+    def explore(self):
+        """walk to the nearest unexplored tile, again and again, until the player
+           gets disturbed or there is nothing left to explore. returns the number of turns"""
+        z = self.player.z
+        level = Game.dungeon[z]
+        first_turn = self.turn
+        while self.turn - first_turn < Game.travel_limit:
+            known = self.known_walkable(z)
+            walkable = int.from_bytes(level.tiles.translate(WALKABLE), "little")
+            explored = int.from_bytes(level.explored, "little")
+            unexplored = (walkable & ~explored).to_bytes(len(level.tiles), "little")
+            target = nearest(known, level.width, level.height, (self.player.x, self.player.y), unexplored)
+            if target is None:
+                Game.log.append("Nothing left to explore here")
+                break
+            path = self.find_path(*target)
+            if path is None or not self.walk(path, until=lambda: level.is_explored(*target)):
+                break
+        return self.turn - first_turn
+
+    def wait_a_turn(self):
+        Game.log.append("You stay around for one turn")
+
+    def shopping(self):
+        """shop hp for gold if player stays on a shop
+        otherwise, just wait a turn doing nothing
+        return True if shopping sucessfull, otherwise return False"""
+        # -----on shop buy 10 hp for one gold------
+        for o in Game.spatial.at(self.player.x, self.player.y, self.player.z, Shop):
+            # player is in a shop
+            if o.closed:
+                Game.log.append("This shop has gone out of business. Find another shop!")
+                return False
+            if self.player.gold <= 0:
+                Game.log.append("You found a shop but you lack Gold to buy anything :-(")
+                return False
+            # player is in shop and has gold
+            if self.player.hitpoints >= self.player.hitpoints_max:
+                Game.log.append("You are already at your maximum health. Shopping is useless now.")
+                return False
+            # shopping
+            self.player.gold -= 1
+            self.player.hitpoints += 10
+            self.player.hitpoints = min(self.player.hitpoints, self.player.hitpoints_max)
+            Game.log.append("You spent one gold for healing")
+            # 20% chance that shop dissapears
+            if rng.combat.random() < 0.2:
+                o.close_shop()  # = True
+                Game.log.append("The shop is closed for business")
+            return True
+        else: # no shop found here
+            self.wait_a_turn()
+            return False
+
+
+
+
+
+    def new_turn(self):
+        self.turn += 1
+        self.make_flow_map()
+        self.move_monsters()
+
+    def player_has_new_position(self):
+        """called after postion change of player,
+        checks if the player can pick up something or stays
+        on an interesting tile"""
+        myfloor = []
+        # ---- pick up items from the floor -----
+        for o in Game.spatial.at(self.player.x, self.player.y, self.player.z, Item):
+        #        myfloor.append(o)
+        #for o in myfloor:
+                if isinstance(o, Gold):
+                    Game.log.append("You found {} gold!".format(o.value))
+                    self.player.gold += o.value
+                    self.emit("gold", pos=(o.x, o.y), value=o.value)
+                    # kill gold from dungeon
+                    o.kill()
+
+
+                elif isinstance(o, Arrows):
+                    Game.log.append("You found {} arrows!".format(o.quantity))
+                    self.player.arrows += o.quantity
+                    o.kill()
+
+                elif isinstance(o, Scroll):
+                    Game.log.append("you found a scroll of {}".format(o.spell))
+                    if o.spell in self.player.scrolls:
+                        self.player.scrolls[o.spell] += 1
+                    else:
+                        self.player.scrolls[o.spell] = 1
+                    self.player.calculate_scroll_list()
+                    o.kill()             # kill this scroll instance in the dungeon
+
+    def other_arrow(self, shooterposition, targetposition, object="arrow"):
+        # returns  end-tile , victimposition(s)
+        # TODO: randomized / formula damage calculation
+        # check if line of tiles in arrow path
+        flightpath = get_line(shooterposition, targetposition)
+        victimposlist = [] # TODO: list of victimpositions (area damage, penetrating arrow)
+        for i, (x, y) in enumerate(flightpath):
+            if i == 0:         # flightpath = flightpath[1:] # remove first tile, because it is blocked by shooter
+                continue  # don't look for objects at shooterposition
+            # print(Game.dungeon[self.player.z][y][x]) # TODO: highlight flightpath with cursor movement ?
+            if Game.dungeon[self.player.z].tile(x, y).block_flying:
+                targetposition = flightpath[i - 1]
+                break  # some tile is blocking the path
+            # is a monster blocking path ?
+            for o in Game.spatial.at(x, y, self.player.z, Monster):
+                # TODO: arrow/object damage calculation, hit or miss calculation
+                if object == "arrow":
+                    damage = rng.combat.randint(5,10)
+                elif object == "magic missile":
+                    damage = rng.combat.randint(15,15)
+                elif object == "fireball":
+                    damage = rng.combat.randint(20,40)
+                else:
+                    damage = 4 # TODO testen ob das jemals vorkommt
+                # example: a fireball hit the Yeti and makes 20 damage
+                Game.log.append("a {} hit the {} and makes {} damage!".format(object, o.__class__.__name__, damage))
+                o.hitpoints -= damage
+                victimposlist.append((o.x, o.y))
+                self.remove_dead_monsters(o)  # only if really dead
+                # non-penetration arrow. the flightpath stops here!
+                # TODO: penetration arrow
+                # return flightpath[:i]
+                return flightpath[i], victimposlist
+        return targetposition, []  # no victim
+        # print("flightpath", flightpath)
+
+    def player_arrow(self):
+        """fires an arrow from player to Cursor.
+           returns  end, victim"""
+        if self.player.arrows < 1:
+            Game.log.append("you must find/buy some arrows before you can shoot them")
+            return None, None
+        if Game.cursor_y == self.player.y and Game.cursor_x == self.player.x:
+            Game.log.append("you must move the cursor with mouse before shooting with f")
+            return None, None  # start, end, victim
+        self.player.arrows -= 1
+        return self.other_arrow((self.player.x, self.player.y),
+                                (Game.cursor_x, Game.cursor_y))
+
+    def checkfight(self, x, y, z):
+        """wir gehen davon aus dass nur der player schaut (checkt) ob er in ein Monster läuft"""
+        # Game.foe_image = None
+        for o in Game.spatial.at(x, y, z, Monster):
+            if o == self.player:
+                continue
+            if o.hitpoints <= 0:
+                continue
+            # the attacked monster turns toward the player
+            if o.x > self.player.x:
+                o.look_direction = 0
+            elif o.x < self.player.x:
+                o.look_direction = 1
+            Game.spatial.touch(o)
+            self.fight(self.player, o)
+            return True
+        return False
+
+    def move_player(self, dx=0, dy=0):
+        if not self.checkfight(self.player.x + dx, self.player.y + dy, self.player.z):
+            self.player.move(dx, dy)
+            self.make_fov_map()
+            self.player_has_new_position()
+
+    def move_monsters(self):
+        """all monsters of the current level act at once, in the order of their numbers:
+           first every monster decides where to go (Monster.ai), then the moves are checked
+           against an occupancy grid (one byte per tile) and done, or a fight with the player starts.
+           A monster never runs into another monster (ai checked already walls and dungeon borders)"""
+        z = self.player.z
+        level = Game.dungeon[z]
+        width = level.width
+        objects = Game.objects
+        xs, ys, hitpoints = objects.x, objects.y, objects.hitpoints
+        monsters = [n for n in objects.select(Monster, z) if n != self.player.number and hitpoints[n] > 0]
+        intents = ai_intents(monsters, self.player)
+        occupied = bytearray(width * level.height)
+        for n in monsters:
+            occupied[ys[n] * width + xs[n]] = 1
+        player_index = self.player.y * width + self.player.x
+        for n, (dx, dy) in zip(monsters, intents):
+            if (dx == 0 and dy == 0) or hitpoints[n] <= 0:
+                continue
+            here = ys[n] * width + xs[n]
+            there = here + dy * width + dx
+            if there == player_index:
+                self.fight(objects[n], self.player)
+                if hitpoints[n] <= 0:
+                    occupied[here] = 0  # killed by the counterstrike
+            elif not occupied[there]:
+                occupied[here] = 0
+                occupied[there] = 1
+                Game.spatial.move(objects[n], xs[n] + dx, ys[n] + dy, z)
+
+    def fight(self, a, b):
+        self.strike(a, b)  # first strike
+        if b.hitpoints > 0:
+            self.strike(b, a)  # counterstrike
+        self.remove_dead_monsters(a, b) # remove dead monsters from game
+
+    def remove_dead_monsters(self, *monster):
+        for mo in monster:  # a monster is a Game.object.value, the key is it's number
+            if mo != self.player and mo.hitpoints <= 0:
+                name = mo.__class__.__name__
+                if name not in self.player.victims:
+                    self.player.victims[name] = 1
+                else:
+                    self.player.victims[name] += 1
+                # del Game.objects[monster.number]
+                mo.kill()
+
+    def strike(self, a, b):
+        wa = rng.combat.choice(a.natural_weapons)
+        attack_value = roll(a.attack, wa.attack_bonus)
+        wd = rng.combat.choice(b.natural_weapons)
+        defense_value = roll(b.defense, wd.defense_bonus)
+        if attack_value > defense_value:
+            damage_value = roll(a.damage, wa.damage_bonus)
+            b.hitpoints -= damage_value
+        else:
+            damage_value = 0
+        Game.log.append("{} ({}hp) strikes at {} ({}hp) using {} against {}".format(
+            a.__class__.__name__,
+            a.hitpoints,
+            b.__class__.__name__,
+            b.hitpoints,
+            wa.__class__.__name__,
+            wd.__class__.__name__))
+        Game.log.append("{}d{}{}{}={}  vs  {}d{}{}{}={} damage: {} hp ({}d{}{}{}) {} --> has {}hp left".format(
+            a.attack[0], a.attack[1], "+" if wa.attack_bonus >= 0 else "", wa.attack_bonus, attack_value,
+            b.defense[0], b.defense[1], "+" if wd.defense_bonus >= 0 else "", wd.defense_bonus, defense_value,
+            damage_value, a.damage[0], a.damage[1], "+" if wa.damage_bonus >= 0 else "", wa.damage_bonus,
+            b.__class__.__name__, b.hitpoints))
+        # TODO: damage calculation only if hit occurs, else "no hit"
+
+    def check_player(self):
+        if self.player.hitpoints <= 0:
+            Game.game_over = True
+
+    def consume_scroll(self, spell):
+        self.player.scrolls[spell] -= 1
+        self.player.calculate_scroll_list()
+
+    def cast(self, spell):
+        if spell not in self.player.scrolls or self.player.scrolls[spell] < 1:
+            Game.log.append("You have currently no scroll of {}".format(spell))
+            return False  # no casting
+
+        # ----- spells that need no cursor position at all -----
+        if spell == "magic map": # make all tiles in this dungeon level explored
+            Game.dungeon[self.player.z].explore_all()
+            self.consume_scroll(spell)
+            return True
+
+        elif spell == "heal": # give player some hitpoints
+            self.consume_scroll(spell)
+            self.log.append("your healing spell gives you +20 hp")
+            self.player.hitpoints += 20 # TODO: max_hp ?
+            return True
+
+        # ----- spells that need a cursor position different from player position ---
+        if Game.cursor_y == self.player.y and Game.cursor_x == self.player.x:
+            Game.log.append("you must select another tile with the mouse before casting {}".format(spell))
+            return False  # no casting
+
+        if spell == "bleed": # monster is  directly damaged, as long as it is visible.
+            for monster in [o for o in Game.spatial.at(Game.cursor_x, Game.cursor_y, self.player.z, Monster)
+                            if o.hitpoints > 0 and Game.fov_map.visible(o.x, o.y)]:
+                monster.hitpoints -= 20
+                Game.log.append("{} bleeds 20 hitpoints".format(monster.__class__.__name__))
+                self.consume_scroll(spell)
+                return (monster.x,monster.y) # return tile of bleeding
+            return False
+
+
+        elif spell == "magic missile": # shoot to Monster at cursor position, like arrow, but more damage
+            self.consume_scroll(spell)
+            # TODO check if target is outside line of sight / torchradius
+            return  self.other_arrow((self.player.x, self.player.y),
+                                    (Game.cursor_x, Game.cursor_y), "magic missile")
+            # return end, victim
+
+        elif spell == "fireball": # like magic missile, more damage # todo: area damage
+            self.consume_scroll(spell)
+            return self.other_arrow((self.player.x, self.player.y),
+                                    (Game.cursor_x, Game.cursor_y), "fireball")
+
+
+        elif spell == "blink":  # teleport the player to cursor position
+            target_tile = Game.dungeon[self.player.z].tile(Game.cursor_x, Game.cursor_y)
+            if not Game.dungeon[self.player.z].is_explored(Game.cursor_x, Game.cursor_y):
+                Game.log.append("You can not blink on a unexplored tile.")
+                return False
+            if target_tile.block_movement:
+                Game.log.append("You can not blink to this tile.")
+                return False
+            if not Game.fov_map.visible(Game.cursor_x, Game.cursor_y):
+                Game.log.append("You can not blink on a tile outside your field of view")
+                return False
+            for o in Game.spatial.at(Game.cursor_x, Game.cursor_y, self.player.z, Monster):
+                if o.hitpoints > 0:
+                    Game.log.append("You can not blink on top of a monster")
+                    return False
+            old = (self.player.x, self.player.y)
+            self.move_player(Game.cursor_x-self.player.x, Game.cursor_y-self.player.y)
+            self.consume_scroll(spell)
+            return old # success
+
+    def load_level(self, z, name, folder="data"):
+        """make dungeon level z from a hand-made level file (see read_level_text).
+           If there is a compiled version of the file (see compile_level), that one is used"""
+        rng.start_level(z)
+        filename = os.path.join(folder, name)
+        binary = os.path.splitext(filename)[0] + ".lvl"
+        if os.path.exists(binary) and (not os.path.exists(filename) or
+                                       os.path.getmtime(binary) >= os.path.getmtime(filename)):
+            width, height, tiles, spawns = read_level_binary(binary)
+        else:
+            width, height, tiles, spawns = read_level_text(filename)
+        level = Level(width, height, WALL)
+        level.tiles[:] = tiles
+        for char, x, y in spawns:
+            if char == b"M":
+                if rng.generation.random() < 0.5:
+                    Wolf(x, y, z)
+                else:
+                    Snake(x, y, z)
+            else:
+                SPAWNS[char](x, y, z)
+        try:
+            Game.dungeon[z] = level
+        except:
+            Game.dungeon.append(level)
+        self.map_changed(z)
+        Game.log.append("level loaded: {} {} x {}".format(name, level.width, level.height))
+
+    def use_stairs(self):
+        """go up or done one dungeon level, depending on stair"""
+        for o in Game.spatial.at(self.player.x, self.player.y, self.player.z, (StairUp, StairDown)):
+            break  # all ok, found a stair
+        else:
+            Game.log.append("You must find a stair up to ascend or descend")
+            return False
+        if isinstance(o, StairUp):
+            self.ascend()
+            return True
+        elif isinstance(o, StairDown):
+            self.descend()
+            return True
+
+    def ascend(self):
+        """go up one dungeon level (or leave the game if already at level 0)"""
+        if self.player.z == 0:
+            Game.log.append("You climb back to the surface and leave the dungeon. Good Bye!")
+            Game.game_over = True
+        else:
+            Game.log.append("climbing up one level....")
+            self.visit_level(self.player.z - 1)
+            Game.spatial.move(self.player, self.player.x, self.player.y, self.player.z - 1)
+            self.make_fov_map()
+            self.player_has_new_position()
+
+    def descend(self):
+        """go down one dungeon level. create this level if necessary,
+           and start to create the level below in the background"""
+        Game.log.append("climbing down one level, deeper into the dungeon...")
+        z_new = self.player.z + 1
+        if z_new >= len(Game.dungeon):
+            self.create_level(z_new)
+        self.visit_level(z_new)
+        Game.spatial.move(self.player, self.player.x, self.player.y, z_new)
+        self.make_fov_map()
+        self.player_has_new_position()
+        self.pregenerate_level(z_new + 1)
+        # return True
+
+    def level_arguments(self, z):
+        """the arguments of generate_level for dungeon level z"""
+        # in level 1 only snakes, in level 2 snakes or wolfes etc. if z > len(levelmonsters), take any monster
+        monsters = [m.__name__ for m in self.levelmonsters[:z]]
+        loot = [l.__name__ for l in self.lootlist]
+        # below each stair down of the level above is a stair up. Level z - 1 is always in memory here
+        stairs_up = None if z == 0 else [(o.x, o.y) for o in Game.spatial.level(z - 1, StairDown)]
+        return Game.seed, z, Game.tiles_x, Game.tiles_y, monsters, loot, Game.level_density, stairs_up
+
+    def pregenerate_level(self, z):
+        """start to generate dungeon level z in a worker thread or process (see Game.pregenerate),
+           so that create_level has nothing left to do when the player arrives"""
+        if Game.pregenerate is None or z < len(Game.dungeon) or z in Game.pending_levels:
+            return
+        pool = Game.level_pools.get(Game.pregenerate)
+        if pool is None:
+            if Game.pregenerate == "process":
+                # spawn, not fork: a fresh interpreter without the display and threads of this one.
+                # It imports the main module again (without running its __main__ block), so
+                # roguebasin_pygame imports pygame there too, but opens no window
+                pool = concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(1)
+            Game.level_pools[Game.pregenerate] = pool
+        Game.pending_levels[z] = pool.submit(generate_level, *self.level_arguments(z))
+
+    @staticmethod
+    def stop_workers():
+        """shut down the workers of pregenerate_level and forget their pending levels"""
+        for pool in Game.level_pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        Game.level_pools = {}
+        Game.pending_levels = {}
+
+    def create_level(self, z):
+        """create random dungeon level z, or take it from the worker if it was pregenerated"""
+        future = Game.pending_levels.pop(z, None)
+        if future is None:
+            plan = generate_level(*self.level_arguments(z))
+        else:
+            plan = future.result()  # waits only if the worker is not yet finished
+        self.install_level(plan)
+
+    def install_level(self, plan):
+        """make a LevelPlan part of the dungeon: create its Level and all its Objects"""
+        z = plan.z
+        rng.continue_level(plan.rng_state)
+        level = Level(plan.width, plan.height, WALL, plan.decorations)
+        level.tiles[:] = plan.tiles
+        if z < len(Game.dungeon):
+            Game.dungeon[z] = level
+        else:
+            Game.dungeon.append(level)
+        self.map_changed(z)
+        for name, x, y in plan.spawns:
+            globals()[name](x, y, z)
+
+    def create_tunnel(self, x1, y1, x2, y2, z=0):
+        """carve a tunnel in dungeon level z, see carve_tunnel"""
+        carve_tunnel(Game.dungeon[z], x1, y1, x2, y2, rng.generation)
+        self.map_changed(z)
+
+    def map_changed(self, z):
+        """must be called whenever tiles of dungeon level z change. Invalidates cached FovMaps of this level"""
+        Game.map_versions[z] = Game.map_versions.get(z, 0) + 1
+
+    def make_flow_map(self):
+        """calculate Game.flow_map, the distance of each tile of the current level to the player.
+           all monsters share it, so a turn costs one breadth first search instead of one
+           path search per monster. Only recalculated if the player moved or the level changed"""
+        z = self.player.z
+        key = (z, self.player.x, self.player.y, Game.map_versions.get(z, 0))
+        if key == Game.flow_key:
+            return
+        level = Game.dungeon[z]
+        Game.flow_map = DijkstraMap(level.tiles.translate(WALKABLE), level.width, level.height,
+                                    [(self.player.x, self.player.y)], Game.flow_range)
+        Game.flow_key = key
+
+    def make_fov_map(self):
+        """calculate Game.fov_map for the current level, using the fov algorithm
+           selected by Game.fov_algorithm (see FOV_ALGORITHMS).
+           Results are kept in Game.fov_cache (least recently used FovMaps are dropped),
+           so standing still or walking back and forth costs no fov calculation"""
+        z = self.player.z
+        key = (z, self.player.x, self.player.y, Game.torch_radius, Game.fov_algorithm, Game.map_versions.get(z, 0))
+        fov_map = Game.fov_cache.get(key)
+        if fov_map is None:
+            algorithm = FOV_ALGORITHMS[Game.fov_algorithm]
+            fov_map = algorithm(Game.dungeon[z], self.player.x, self.player.y, Game.torch_radius)
+            Game.fov_cache[key] = fov_map
+            if len(Game.fov_cache) > Game.fov_cache_size:
+                Game.fov_cache.popitem(last=False)  # forget the least recently used FovMap
+        else:
+            Game.fov_cache.move_to_end(key)
+        Game.fov_map = fov_map
+        # everything visible is now explored. only rows inside the torch radius can be visible
+        Game.dungeon[z].explore(fov_map, max(0, self.player.y - Game.torch_radius),
+                                min(fov_map.height, self.player.y + Game.torch_radius + 1))
+
+
+class Replay:
+    """the settings of a new game and every action of the player (see Game.step), enough to play
+       the whole game again: the random streams (see RandomStreams) give the same dungeon and the
+       same fights, no matter if the game is drawn or not. Record with
+           Game.replay = Replay.start(game)   # right after Game(), before the first action
+       and save the replay with Replay.save. The file (see REPLAY_HEADER) holds the settings as
+       json and the zlib-compressed actions, a few bytes each (see REPLAY_ACTIONS)"""
+
+    def __init__(self, settings, actions=b""):
+        self.settings = settings  # seed, tiles_x, tiles_y, level_density, torch_radius, fov_algorithm and names
+        self.actions = bytearray(actions)
+
+    @classmethod
+    def start(cls, game):
+        """a new, empty replay for a game that has just been created"""
+        return cls({"seed": Game.seed, "tiles_x": Game.tiles_x, "tiles_y": Game.tiles_y,
+                    "level_density": Game.level_density, "torch_radius": Game.torch_radius,
+                    "fov_algorithm": Game.fov_algorithm, "names": []})
+
+    def record(self, action, args):
+        """append one action of Game.step"""
+        if action not in REPLAY_RECORDS:
+            raise ValueError("unknown action: {}".format(action))
+        code, record = REPLAY_RECORDS[action]
+        names = self.settings["names"]
+        values = []
+        for kind, value in zip(REPLAY_ACTIONS[code][1], args):
+            if kind == "s":
+                if value not in names:
+                    names.append(value)
+                value = names.index(value)
+            values.append(value)
+        self.actions += record.pack(code, *values)
+
+    def __iter__(self):
+        """all recorded actions as (action, args) tuples"""
+        names = self.settings["names"]
+        offset = 0
+        while offset < len(self.actions):
+            name, kinds = REPLAY_ACTIONS[self.actions[offset]]
+            code, record = REPLAY_RECORDS[name]
+            values = record.unpack_from(self.actions, offset)[1:]
+            offset += record.size
+            yield name, tuple(names[v] if kind == "s" else v for kind, v in zip(kinds, values))
+
+    def save(self, filename):
+        settings = json.dumps(self.settings, separators=(",", ":")).encode("utf-8")
+        with open(filename, "wb") as f:
+            f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, len(settings)))
+            f.write(settings)
+            f.write(zlib.compress(bytes(self.actions)))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+        magic, version, length = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC:
+            raise ValueError("{} is not a replay".format(filename))
+        if version > REPLAY_VERSION:
+            raise ValueError("replay version {} is too new, i know only version {}".format(version, REPLAY_VERSION))
+        start = REPLAY_HEADER.size
+        settings = json.loads(data[start:start + length])
+        return cls(settings, zlib.decompress(data[start + length:]))
+
+    def new_game(self):
+        """returns a new Game exactly like the game when the recording started"""
+        Game.level_density = self.settings["level_density"]
+        Game.torch_radius = self.settings["torch_radius"]
+        Game.fov_algorithm = self.settings["fov_algorithm"]
+        return Game(self.settings["tiles_x"], self.settings["tiles_y"], self.settings["seed"])
+
+    def play(self, game=None):
+        """play all actions as fast as possible (without a renderer nothing waits for animations).
+           game: a Game from new_game, None for a new one. returns the game"""
+        if game is None:
+            game = self.new_game()
+        for action, args in self:
+            if Game.game_over:
+                break
+            game.step(action, *args)
+        return game
+
+
+atexit.register(Game.stop_workers)
+atexit.register(Game.forget_cold_files)
+
+# sections timed by the profiler when it is enabled. Game.step includes Game.flush_events,
+# where the renderer plays its animations: the game logic of a turn is the difference
+for _name in ("step", "flush_events", "new_turn", "make_flow_map", "make_fov_map", "move_monsters", "create_level"):
+    profiler.watch(Game, _name)
@@ -0,0 +1,137 @@
+"""
+pathfinding for roguebasin_python3. Works on plain level data (width, height and
+a bytes-like walkable map with one byte per tile, index: y * width + x, 1 = walkable)
+so it needs neither pygame nor the Game class
+author: Horst JENS
+email: horstjens@gmail.com
+contact: see http://spielend-programmieren.at/de:kontakt
+license: gpl, see http://www.gnu.org/licenses/gpl-3.0.de.html
+download: https://github.com/horstjens/roguebasin_python3
+"""
+
+import array
+import collections
+import heapq
+
+UNREACHABLE = 0xFFFF  # distance of tiles that can not be reached (or are too far away)
+# the 8 neighbours of a tile. orthogonal first, so a straight step wins over a diagonal one
+NEIGHBOURS = ((0, -1), (1, 0), (0, 1), (-1, 0), (1, -1), (1, 1), (-1, 1), (-1, -1))
+
+
+class DijkstraMap:
+    """distance (number of steps, diagonal steps included) from every tile to the
+       nearest goal tile, found by a breadth first search over the walkable tiles.
+       One DijkstraMap toward the player is shared by all monsters of a level:
+       a monster only has to look at its neighbour tiles to find the way (see downhill).
+       max_distance: stop searching there, all tiles further away stay UNREACHABLE"""
+
+    def __init__(self, walkable, width, height, goals, max_distance=UNREACHABLE - 1):
+        self.width = width
+        self.height = height
+        self.distances = array.array("H", [UNREACHABLE]) * (width * height)
+        distances = self.distances
+        frontier = collections.deque()
+        for x, y in goals:
+            i = y * width + x
+            if distances[i] != 0:
+                distances[i] = 0
+                frontier.append(i)
+        while frontier:
+            i = frontier.popleft()
+            d = distances[i] + 1
+            if d > max_distance:
+                continue
+            y, x = divmod(i, width)
+            for dx, dy in NEIGHBOURS:
+                nx = x + dx
+                ny = y + dy
+                if 0 <= nx < width and 0 <= ny < height:
+                    j = ny * width + nx
+                    if walkable[j] and distances[j] == UNREACHABLE:
+                        distances[j] = d
+                        frontier.append(j)
+
+    def distance(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.distances[y * self.width + x]
+        return UNREACHABLE
+
+    def downhill(self, x, y):
+        """returns dx, dy of the neighbour tile that is nearest to a goal,
+           or None if no neighbour is nearer than x,y itself"""
+        best = self.distance(x, y)
+        step = None
+        for dx, dy in NEIGHBOURS:
+            d = self.distance(x + dx, y + dy)
+            if d < best:
+                best = d
+                step = (dx, dy)
+        return step
+
+
+def astar(walkable, width, height, start, goal):
+    """shortest path from start to goal (both x,y tuples), 8 directions, every step costs 1.
+       The goal itself may be a not walkable tile (walking into it means: bump into it).
+       returns a list of x,y tuples (without start, with goal) or None if there is no path"""
+    if start == goal:
+        return []
+    gx, gy = goal
+    goal_i = gy * width + gx
+    start_i = start[1] * width + start[0]
+    came_from = {start_i: None}
+    cost = {start_i: 0}
+    counter = 0  # equal f values: the older entry first. keeps the paths deterministic
+    todo = [(max(abs(gx - start[0]), abs(gy - start[1])), counter, start_i)]
+    while todo:
+        _, _, i = heapq.heappop(todo)
+        if i == goal_i:
+            path = []
+            while i != start_i:
+                path.append(divmod(i, width)[::-1])
+                i = came_from[i]
+            path.reverse()
+            return path
+        y, x = divmod(i, width)
+        g = cost[i] + 1
+        for dx, dy in NEIGHBOURS:
+            nx = x + dx
+            ny = y + dy
+            if not (0 <= nx < width and 0 <= ny < height):
+                continue
+            j = ny * width + nx
+            if not walkable[j] and j != goal_i:
+                continue
+            if j in cost and cost[j] <= g:
+                continue
+            cost[j] = g
+            came_from[j] = i
+            counter += 1
+            # chebyshev distance: exact for 8 directions without obstacles, never too high
+            heapq.heappush(todo, (g + max(abs(gx - nx), abs(gy - ny)), counter, j))
+    return None
+
+
+def nearest(walkable, width, height, start, goals):
+    """breadth first search from start over walkable tiles for the nearest goal tile.
+       goals: bytes-like, one byte per tile, 1 for a goal tile (it does not need to be walkable)
+       returns x,y of that goal tile or None"""
+    i = start[1] * width + start[0]
+    seen = bytearray(width * height)
+    seen[i] = 1
+    frontier = collections.deque([i])
+    while frontier:
+        i = frontier.popleft()
+        y, x = divmod(i, width)
+        for dx, dy in NEIGHBOURS:
+            nx = x + dx
+            ny = y + dy
+            if 0 <= nx < width and 0 <= ny < height:
+                j = ny * width + nx
+                if seen[j]:
+                    continue
+                seen[j] = 1
+                if goals[j]:
+                    return nx, ny
+                if walkable[j]:
+                    frontier.append(j)
+    return None
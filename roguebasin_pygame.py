@@ -19,13 +19,15 @@ graphics mostly from Dungeon Crawl: http://crawl.develz.org/
 """
 
 import pygame
-import random
+import array
+import collections
 # import inspect
 
 import os
+import argparse
 
-# declare constants
-ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+# game logic without pygame: Game, dungeon levels, monsters, items, fov...
+from roguebasin_engine import *
 
 #TODO: poblem bei DragonFire: wenn die duration zu klein ist sieht man oft gar keine Explosion
 #TODO: warum blinkt panelscreeen --> background blit schuld?
@@ -33,11 +35,6 @@ ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
 #TODO: different graphic engines: pysimplegui/text/arcade/ .. godot?
 #TODO: monster (sprites?) move a bit toward victim on melee attack / move animation between tiles
 # TODO: monster (and floors?) as sprites, for animation loops (flapping wings, glowing torches etc)
-#  TODO monster speed > 1 tile possible ?
-#  TODO rework NaturalWeapon
-#  TODO Item
-#  TODO Equipment
-#  TODO Consumable
 # TODO: blood after impact on floor (feat.png, 58,384,22,32.....
 # TODO: highlight mouse-path for shooting, / Fireball
 
@@ -93,7 +90,7 @@ class VectorSprite(pygame.sprite.Sprite):
             self.height = self.radius * 2
         if "color" not in kwargs:
             # self.color = None
-            self.color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+            self.color = (rng.cosmetic.randint(0, 255), rng.cosmetic.randint(0, 255), rng.cosmetic.randint(0, 255))
         # if "hitpoints" not in kwargs:
         #    self.hitpoints = 100
         # self.hitpointsfull = self.hitpoints # makes a copy
@@ -135,12 +132,12 @@ class VectorSprite(pygame.sprite.Sprite):
 
     def create_image(self):
         if self.picture is not None:
-            self.image = self.picture.copy()
+            self.image = self.picture  # shared by all sprites of a class, never change it
         else:
             self.image = pygame.Surface((self.width, self.height))
             self.image.fill((self.color))
         # self.image = self.image.convert_alpha()
-        self.image0 = self.image.copy()
+        self.image0 = self.image  # the not rotated image, see transformed
         self.rect = self.image.get_rect()
         self.width = self.rect.width
         self.height = self.rect.height
@@ -149,8 +146,7 @@ class VectorSprite(pygame.sprite.Sprite):
         """rotates a sprite and changes it's angle by by_degree"""
         self.angle += by_degree
         oldcenter = self.rect.center
-        self.image = pygame.transform.rotate(self.image0, self.angle)
-        self.image.convert_alpha()
+        self.image = transformed(self.image0, self.angle)
         self.rect = self.image.get_rect()
         self.rect.center = oldcenter
 
@@ -158,8 +154,7 @@ class VectorSprite(pygame.sprite.Sprite):
         """rotates a sprite and changes it's angle to degree"""
         self.angle = degree
         oldcenter = self.rect.center
-        self.image = pygame.transform.rotate(self.image0, self.angle)
-        self.image.convert_alpha()
+        self.image = transformed(self.image0, self.angle)
         self.rect = self.image.get_rect()
         self.rect.center = oldcenter
 
@@ -258,15 +253,14 @@ class BleedingSprite(VectorSprite):
 
         self.rotation = 0
         self.pos += pygame.math.Vector2(Viewer.grid_size[0]//2, Viewer.grid_size[1]//2)
-        self.image0 = self.image.copy()
+        self.image0 = self.image
 
     def update(self, seconds):
         super().update(seconds)
         oldcenter = self.rect.center
         self.zoom += self.zoom_delta
         self.rotation += 0
-        self.image = pygame.transform.rotozoom(self.image0, self.rotation, self.zoom)
-        self.image.convert_alpha()
+        self.image = transformed(self.image0, self.rotation, self.zoom)
         self.rect = self.image.get_rect()
         self.rect.center = oldcenter
 
@@ -274,20 +268,6 @@ class BlinkSprite(BleedingSprite):
 
     image = None
 
-class FragmentSprite(VectorSprite):
-
-    def _overwrite_parameters(self):
-        super()._overwrite_parameters()
-        self.alpha = 255
-        self.delta_alpha = 255 / self.max_age if self.max_age > 0 else 1
-
-    def update(self, seconds):
-        super().update(seconds)
-        # 0 = full transparency, 255 = no transparency at all
-        self.alpha -= self.delta_alpha * seconds * 0.4 # slowly become more transparent
-        self.image.set_alpha(self.alpha )
-        self.image.convert_alpha()
-
 class Flytext(VectorSprite):
     def __init__(self, text, fontsize=22, acceleration_factor=1.02, max_speed=300, **kwargs):
         """a text flying upward and for a short time and disappearing"""
@@ -323,10 +303,10 @@ class GoldSprite(VectorSprite):
     def _overwrite_parameters(self):
         super()._overwrite_parameters()
         self.picture = self.image
-        self.undisturbed = 0 + random.random()*0.5  # time without black hole pull
+        self.undisturbed = 0 + rng.cosmetic.random()*0.5  # time without black hole pull
         self.create_image()
-        self.move = pygame.math.Vector2(random.randint(50, 200),0)
-        self.move.rotate_ip(random.randint(0,360))
+        self.move = pygame.math.Vector2(rng.cosmetic.randint(50, 200),0)
+        self.move.rotate_ip(rng.cosmetic.randint(0,360))
         #self.max_age = 10
         #self.friction = 0.99
         #print("black hole:", self.blackhole)
@@ -340,7 +320,7 @@ class GoldSprite(VectorSprite):
         acc =  self.blackholemass /  distance.length()**1.8 #2
 
         if distance.length() < self.krit:
-            Game.player.gold += 1 # delay, gold is added only after gold-fly animation
+            Viewer.gold_in_flight -= 1 # delay, gold is shown in the panel only after gold-fly animation
             self.kill()
         distance.normalize_ip()
         acc *= distance
@@ -470,192 +450,166 @@ class DragonFireSprite(FlyingObject):
 
     def update(self, seconds):
         # wobble in flight
-        self.set_angle(self.angle + random.randint(-5,5)) # rotate image in flight
+        self.set_angle(self.angle + rng.cosmetic.randint(-5,5)) # rotate image in flight
         super().update(seconds)
         # TODO: zoom?
 
-class NaturalWeapon():
-
-    def __init__(self, ):
-        # self.number = NaturalWeapon.number
-        # NaturalWeapon.number += 1
-        # NaturalWeapon.store[self.number] = self
-        self.damage_bonus = 0
-        self.attack_bonus = 0
-        self.defense_bonus = 0
-
-        self.overwrite_parameters()
-
-    def overwrite_parameters(self):
-        pass
-
-
-class Fist(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 0
-        self.attack_bonus = 0
-        self.defense_bonus = 0
-
-
-class Kick(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 3
-        self.attack_bonus = -2
-        self.defense_bonus = 2
-
-
-class YetiSnowBall(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 1
-        self.attack_bonus = 4
-        self.defense_bonus = 1
-
-
-class YetiSlap(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 4
-        self.attack_bonus = -1
-        self.defense_bonus = 0
-
-
-class SnakeBite(NaturalWeapon):
-
-    def overwrite_parameters(self):
-        self.damage_bonus = 1
-        self.attack_bonus = 2
-        self.defense_bonus = 2
-
-
-class WolfBite(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 1
-        self.attack_bonus = 2
-        self.defense_bonus = 2
-
+class Particles:
+    """the fragments of all explosions (see Viewer.explosion_at_tile): small colored squares that fly
+       away, slowly become transparent and disappear at max_age or at the edge of the screen.
+       Instead of one Sprite per fragment, all fragments are kept in parallel arrays
+       (one entry per fragment) and the main loop moves and draws all of them at once"""
+
+    size = 10  # width and height of a fragment in pixel
+    alpha_steps = 16  # fragments fade out in that many steps, each step of a color has its own image
+    color_steps = 64  # colors are rounded to multiples of this, so that fragments can share images
+    image_cache_size = 4096  # max. number of images in self.images
+
+    def __init__(self):
+        self.x = array.array("d")  # position in pixel
+        self.y = array.array("d")
+        self.dx = array.array("d")  # speed in pixel per second
+        self.dy = array.array("d")
+        self.age = array.array("d")  # in seconds. fragments with negative age wait (invisible)
+        self.max_age = array.array("d")
+        self.alpha = array.array("d")  # 255: not transparent, 0: invisible
+        self.fade = array.array("d")  # alpha lost per second
+        self.gravity = array.array("d")  # added to dy per second
+        self.colors = []
+        self.images = collections.OrderedDict()  # {(color, alpha step): Surface}, oldest first
+        self.rects = []  # where the fragments have been drawn, see clear
+
+    def __len__(self):
+        return len(self.x)
+
+    def emit(self, x, y, dx, dy, max_age, age=0, color=(255, 255, 255), gravity=None):
+        """add one fragment at pixel x,y, flying with dx, dy pixel per second"""
+        for column, value in ((self.x, x), (self.y, y), (self.dx, dx), (self.dy, dy), (self.age, age),
+                              (self.max_age, max_age), (self.alpha, 255),
+                              (self.fade, 0.4 * 255 / max_age if max_age > 0 else 1),
+                              (self.gravity, 0 if gravity is None else gravity)):
+            column.append(value)
+        q = Particles.color_steps
+        self.colors.append(tuple(min(255, (value + q // 2) // q * q) for value in color))
 
-class GolemArm(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 2
-        self.attack_bonus = 0
-        self.defense_bonus = 0
-
-
-class DragonBite(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 9
-        self.attack_bonus = -3
-        self.defense_bonus = -3
-
-
-class DragonClaw(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 2
-        self.attack_bonus = -1
-        self.defense_bonus = -1
-
-
-class DragonTail(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 3
-        self.attack_bonus = 0
-        self.defense_bonus = 0
-
-
-class FireBreath(NaturalWeapon):
-    def overwrite_parameters(self):
-        self.damage_bonus = 4
-        self.attack_bonus = 3
-        self.defense_bonus = -4
-
-
-def megaroll(dicestring="1d6 1d20", bonus=0):
-    """roll all the dice in the dicestring and adds a bonus to the sum
-    1d6 means one 6-sided die without re-roll
-    1D6 means one 6-sided die with re-roll.
-    re-roll: 1D6 means that when hightest side (6) is rolled, 5 (=6-1) is added and he rolls again"""
-    dlist = dicestring.split(" ")
-    total = 0
-    #print("calculating: ", dicestring, "+", bonus)
-    for code in dlist:
-        #print("---processing", code)
-        if "d" in code:
-            # reroll = False
-            rolls = int(code.split("d")[0])
-            sides = int(code.split("d")[1])
-            total += roll((rolls, sides), bonus=0, reroll=False)
-        elif "D" in code:
-            # reroll = True
-            rolls = int(code.split("D")[0])
-            sides = int(code.split("D")[1])
-            total += roll((rolls, sides), bonus=0, reroll=True)
-        else:
-            raise SystemError("unknow dice type: {} use 1d6, 1D20 etc".format(code))
-        #print("---result of", code, "is :", str(total))
-    #print("adding " + str(bonus) + "=", str(total + bonus))
-    return total + bonus
-
-
-def roll(dice, bonus=0, reroll=True):
-    """simulate a dice throw, and adding a bonus
-       reroll means that if the highest number is rolled,
-       one is substracted from the score and
-       another roll is added, until a not-hightest number is rolled.
-       e.g. 1D6 throws a 6, and re-rolls a 2 -> (6-1)+2= 7"""
-    # TODO format-micro-language for aligning the numbers better
-    # TODO: accepting string of several dice, like '2D6 3d4' where 'd' means no re-roll, 'D' means re-roll
-    rolls = dice[0]
-    sides = dice[1]
-    total = 0
-    #print("------------------------")
-    #print("rolling {}{}{} + bonus {}".format(rolls, "D" if reroll else "d", sides, bonus))
-    #print("------------------------")
-    i = 0
-    verb = "rolls   "
-    # for d in range(rolls):
-    while True:
-        i += 1
-        if i > rolls:
-            break
-        value = random.randint(1, sides)
-
-        if reroll and value == sides:
-            total += value - 1
-            #print("die #{} {} {}  ∑: {} (count as {} and rolls again)".format(i, verb, value, total, value - 1))
-            verb = "re-rolls"
-            i -= 1
-            continue
-        else:
-            total += value
-            #print("die #{} {} {}  ∑: {}".format(i, verb, value, total))
-            verb = "rolls   "
-
-    #print("=========================")
-    #print("=result:    {}".format(total))
-    #print("+bonus:     {}".format(bonus))
-    #print("=========================")
-    #print("=total:     {}".format(total + bonus))
-    return total + bonus
-
-
-def minmax(value, lower_limit=-1, upper_limit=1):
-    """constrains a value inside two limits"""
-    value = max(lower_limit, value)
-    value = min(upper_limit, value)
-    return value
-
-
-def randomizer(list_of_chances=(1.0,)):
-    """gives back an integer depending on chance.
-       e.g. randomizer((.75, 0.15, 0.05, 0.05)) gives in 75% 0, in 15% 1, and in 5% 2 or 3"""
-    total = sum(list_of_chances)
-    v = random.random() * total  # a value between 0 and total
-    edge = 0
-    for i, c in enumerate(list_of_chances):
-        edge += c
-        if v <= edge:
-            return i
+    def update(self, seconds):
+        """one step for all fragments: move (after they have started), fall, fade out and get older.
+           Fragments that are too old or have left the screen are forgotten"""
+        started = [a > 0 for a in self.age]
+        self.x = array.array("d", [x + dx * seconds if s else x for x, dx, s in zip(self.x, self.dx, started)])
+        self.y = array.array("d", [y + dy * seconds if s else y for y, dy, s in zip(self.y, self.dy, started)])
+        self.dy = array.array("d", [dy + g * seconds if s else dy for dy, g, s in zip(self.dy, self.gravity, started)])
+        self.alpha = array.array("d", [a - f * seconds for a, f in zip(self.alpha, self.fade)])
+        self.age = array.array("d", [a + seconds for a in self.age])
+        width, height = Viewer.width, Viewer.height
+        alive = [i for i, (x, y, a, m) in enumerate(zip(self.x, self.y, self.age, self.max_age))
+                 if a <= m + seconds and (a < 0 or (0 <= x <= width and 0 <= y <= height))]
+        if len(alive) < len(self.x):
+            for name in ("x", "y", "dx", "dy", "age", "max_age", "alpha", "fade", "gravity"):
+                column = getattr(self, name)
+                setattr(self, name, array.array("d", [column[i] for i in alive]))
+            self.colors = [self.colors[i] for i in alive]
+
+    def new_image(self, key):
+        color, step = key
+        image = pygame.Surface((self.size, self.size)).convert()  # same pixel format as the screen: faster
+        image.fill(color)
+        alpha = 255 * (step + 1) // self.alpha_steps
+        image.set_alpha(alpha if alpha < 255 else None)  # None: no blending at all, much faster than 255
+        self.images[key] = image
+        if len(self.images) > self.image_cache_size:
+            self.images.popitem(last=False)  # forget the oldest image
+        return image
+
+    def clear(self, surface, background):
+        """paint background over all fragments of the last draw"""
+        surface.blits([(background, r[:2], r) for r in self.rects], doreturn=False)
+
+    def draw(self, surface):
+        """blit all started fragments in one batch, returns a list with the rect that has changed"""
+        half = self.size // 2
+        factor = self.alpha_steps / 256  # alpha is never above 255
+        keys = list(zip(self.colors, [int(alpha * factor) if alpha > 0 else 0 for alpha in self.alpha]))
+        images = [self.images.get(key) or self.new_image(key) for key in keys]
+        batch = [(image, (int(x + 0.5) - half, int(y + 0.5) - half)) for image, x, y, a, alpha in
+                 zip(images, self.x, self.y, self.age, self.alpha) if a >= 0 and alpha > 0]
+        surface.blits(batch, doreturn=False)
+        rects = self.rects
+        self.rects = [(x, y, self.size, self.size) for _, (x, y) in batch]
+        changed = rects + self.rects
+        return [pygame.Rect(changed[0]).unionall(changed)] if changed else []
+
+
+# ---- fonts and rendered texts are expensive to create, so they are cached ----
+fonts = {}  # {(font_name, font_size, bold): pygame.font.Font}
+text_cache = collections.OrderedDict()  # {(text, color, font_name, font_size, bold): (Surface, (width, height))}
+text_cache_size = 512  # max. number of rendered texts in text_cache
+
+
+def get_font(font_name="mono", font_size=24, bold=True):
+    """returns a pygame font. The (slow) system font lookup is done only once
+       for each combination of font_name, font_size and bold"""
+    key = (font_name, font_size, bold)
+    font = fonts.get(key)
+    if font is None:
+        font = pygame.font.SysFont(font_name, font_size, bold)
+        fonts[key] = font
+    return font
+
+
+def render_text(text, color, font_size=24, font_name="mono", bold=True):
+    """returns a pygame surface with the rendered text and the x, y dimension in pixel.
+       The last text_cache_size rendered texts are cached, so repeating log lines and panel
+       labels are not rendered again. Never change the returned surface, copy it instead"""
+    key = (text, tuple(color), font_name, font_size, bold)
+    result = text_cache.get(key)
+    if result is not None:
+        text_cache.move_to_end(key)
+        return result
+    font = get_font(font_name, font_size, bold)
+    surface = font.render(text, True, color)
+    if pygame.display.get_surface() is not None:
+        surface = surface.convert_alpha()  # pygame surface, faster for blitting
+    result = (surface, font.size(text))
+    text_cache[key] = result
+    if len(text_cache) > text_cache_size:
+        text_cache.popitem(last=False)  # forget the least recently used text
+    return result
+
+
+# ---- rotated and zoomed sprite images, shared by all sprites with the same picture ----
+transform_cache = collections.OrderedDict()  # {(id(image), angle, zoom): (image, Surface, bytes)}
+transform_cache_bytes = 0  # memory used by all surfaces in transform_cache
+transform_cache_max_bytes = 16 * 1024 * 1024
+transform_angle_step = 3  # degrees. angles are rounded to multiples of this
+transform_zoom_step = 0.02  # zoom factors are rounded to multiples of this
+
+
+def transformed(image, angle=0, zoom=1.0):
+    """returns image rotated by angle (degrees) and zoomed by zoom, like pygame.transform.rotate
+       (zoom 1.0) or pygame.transform.rotozoom. Angle and zoom are rounded, so all sprites with the same
+       picture share a few transformed images. The least recently used ones are forgotten
+       when they need more than transform_cache_max_bytes. Never change the returned surface"""
+    global transform_cache_bytes
+    angle = round(angle / transform_angle_step) * transform_angle_step % 360
+    zoom = round(zoom / transform_zoom_step) * transform_zoom_step
+    key = (id(image), angle, zoom)
+    cached = transform_cache.get(key)
+    if cached is not None and cached[0] is image:
+        transform_cache.move_to_end(key)
+        return cached[1]
+    if zoom == 1.0:
+        surface = pygame.transform.rotate(image, angle)
     else:
-        raise SystemError("problem with list of chances:", list_of_chances)
+        surface = pygame.transform.rotozoom(image, angle, max(0.0, zoom))
+    size = surface.get_width() * surface.get_height() * surface.get_bytesize()
+    if cached is not None:
+        transform_cache_bytes -= cached[2]  # the old image with this id is gone
+    transform_cache[key] = (image, surface, size)  # keeps image alive, so its id stays unique
+    transform_cache_bytes += size
+    while transform_cache_bytes > transform_cache_max_bytes and len(transform_cache) > 1:
+        transform_cache_bytes -= transform_cache.popitem(last=False)[1][2]  # least recently used
+    return surface
 
 
 def make_text(text="@", font_color=(255, 0, 255), font_size=48, font_name="mono", bold=True, grid_size=None):
@@ -665,10 +619,7 @@ def make_text(text="@", font_color=(255, 0, 255), font_size=48, font_name="mono"
        You still need to blit the surface.
        Example: text with one char for font_size 48 returns the dimensions 29,49
     """
-    myfont = pygame.font.SysFont(font_name, font_size, bold)
-    size_x, size_y = myfont.size(text)
-    mytext = myfont.render(text, True, font_color)
-    mytext = mytext.convert_alpha()  # pygame surface, use for blitting
+    mytext, (size_x, size_y) = render_text(text, font_color, font_size, font_name, bold)
     if grid_size is not None:
         # TODO error handler if grid_size is not a tuple of positive integers
         mytext = pygame.transform.scale(mytext, grid_size)
@@ -685,9 +636,7 @@ def write(background, text, x=50, y=150, color=(0, 0, 0),
     """
     if font_size is None:
         font_size = 24
-    font = pygame.font.SysFont(font_name, font_size, bold)
-    width, height = font.size(text)
-    surface = font.render(text, True, color)
+    surface, (width, height) = render_text(text, color, font_size, font_name, bold)
 
     if origin == "center" or origin == "centercenter":
         background.blit(surface, (x - width // 2, y - height // 2))
@@ -709,1153 +658,21 @@ def write(background, text, x=50, y=150, color=(0, 0, 0),
         background.blit(surface, (x - width, y - height))
 
 
-def get_line(start, end):
-    """Bresenham's Line Algorithm
-       Produces a list of tuples from start and end
-       source: http://www.roguebasin.com/index.php?title=Bresenham%27s_Line_Algorithm#Python
-       see also: https://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm
-
-       #>>> points1 = get_line((0, 0), (3, 4))
-       # >>> points2 = get_line((3, 4), (0, 0))
-       #>>> assert(set(points1) == set(points2))
-       #>>> print points1
-       #[(0, 0), (1, 1), (1, 2), (2, 3), (3, 4)]
-       #>>> print points2
-       #[(3, 4), (2, 3), (1, 2), (1, 1), (0, 0)]
-    """
-    # Setup initial conditions
-    x1, y1 = start
-    x2, y2 = end
-    dx = x2 - x1
-    dy = y2 - y1
-
-    # Determine how steep the line is
-    is_steep = abs(dy) > abs(dx)
-
-    # Rotate line
-    if is_steep:
-        x1, y1 = y1, x1
-        x2, y2 = y2, x2
-
-    # Swap start and end points if necessary and store swap state
-    swapped = False
-    if x1 > x2:
-        x1, x2 = x2, x1
-        y1, y2 = y2, y1
-        swapped = True
-
-    # Recalculate differentials
-    dx = x2 - x1
-    dy = y2 - y1
-
-    # Calculate error
-    error = int(dx / 2.0)
-    ystep = 1 if y1 < y2 else -1
-
-    # Iterate over bounding box generating points between start and end
-    y = y1
-    points = []
-    for x in range(x1, x2 + 1):
-        coord = (y, x) if is_steep else (x, y)
-        points.append(coord)
-        error -= abs(dy)
-        if error < 0:
-            y += ystep
-            error += dx
-
-    # Reverse the list if the coordinates were swapped
-    if swapped:
-        points.reverse()
-    return points
-
-
-class Rect:
-    """a rectangle object (room) for the dungeon
-       x,y is the topleft coordinate
-    """
-
-    def __init__(self, x, y, width, height):
-        self.x1 = x
-        self.y1 = y
-        self.x2 = x + width
-        self.y2 = y + height
-
-    def center(self):
-        """returns the center coordinate of a room"""
-        center_x = (self.x1 + self.x2) // 2  # TODO: // instead of / ?
-        center_y = (self.y1 + self.y2) // 2
-        return (center_x, center_y)
-
-    def intersect(self, other):
-        """returns true if this rectangle intersects with another one"""
-        return (self.x1 <= other.x2 and self.x2 >= other.x1 and
-                self.y1 <= other.y2 and self.y2 >= other.y1)
-
-
-class Tile:
-    """# a tile of the map and its properties
-       block_movement means blocking the movement of Monster/Player, like a wall or water
-       block_sight means blocking the field of view
-       block_flying means the tile blocks flying objects like arrows or flying monsters
-    """
-
-    # number = 0  # "globale" class variable
-    images = [] # for Viewer. light_images, dark_images
-
-    def __init__(self, block_movement=None, block_sight=None, explored=False, block_flying=None):
-        # self.number = Tile.number
-        # Tile.number += 1 # each tile instance has a unique number
-        # generate a number that is mostly 0,but very seldom 1 and very rarely 2 or 3
-        # see randomizer .... creates a number between 0 and 8. used for wall and floor tiles
-
-        self.char = "?"
-        self.block_movement = block_movement
-        self.block_sight = block_sight
-        self.block_flying = block_flying
-        self.explored = explored
-        self.decoration = 0
-        self._overwrite()
-
-
-    def _overwrite(self):
-        pass
-
-class Wall(Tile):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "#"
-        self.decoration = randomizer((.30, 0.15, 0.15, 0.15, 0.1, 0.1, 0.025, 0.025))  # 8
-        self.block_movement = True
-        self.block_flying = True
-        self.block_sight = True
-
-class Floor(Tile):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "."
-        self.decoration = randomizer((.15, 0.15, 0.15, 0.15, 0.15, 0.1, 0.1, 0.025, 0.025))  # 9
-        self.block_movement = False
-        self.block_flying = False
-        self.block_sight = False
-
-
-class Object():
-    """this is a generic dungeon object: the player, a monster, an item, a stair..
-       it's always represented by a character (for text representation).
-       NOTE: a dungeon tile (wall, floor, water..) is represented by the Tile class
-    """
-    images = [] # for Viewer
-    number = 0  # current object number. is used as a key for the Game.objects dictionary
-
-    def __init__(self, x, y, z=0, char="?", color=None, **kwargs):
-        self.number = Object.number
-        Object.number += 1
-        Game.objects[self.number] = self
-        self.x = x
-        self.y = y
-        self.z = z
-        self.hint = None  # longer description and hint for panel
-        self.image_name = None
-        self.char = char
-        self.color = color
-        self.hitpoints = 1  # objects with 0 or less hitpoints will be deleted
-        self.look_direction = 0  # 0 -> looks to left, 1 -> looks to right
-        # --- make attributes out of all named arguments. like Object(hp=33) -> self.hp = 33
-        for key, arg in kwargs.items():
-            setattr(self, key, arg)
-        # ---- some default values ----
-        #if "explored" not in kwargs:
-        #    self.explored = False
-        if "stay_visible_once_explored" not in kwargs:
-            self.stay_visible_once_explored = False
-        # --- child classes can do stuff in the _overwrite() method  without needing their own __init__ method
-        self._overwrite()
-        # --- update legend ---
-        #if self.char not in Game.legend:
-        #    Game.legend[self.char] = self.__class__.__name__
-
-    def kill(self):
-        # delete this object from Game.objects dictionary
-        del Game.objects[self.number]
-
-    def _overwrite(self):
-        pass
-
-
-class Item(Object):
-    """an item that you can pick up"""
-
-    images = []
-
-    def _overwrite(self):
-        self.color = (255, 165, 0)  # orange
-        self.weight = 0
-        self.i = 0 # index of item image
-
-
-class Scroll(Item):
-    """a scroll with a spell on it"""
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.color = (200, 200, 0)
-        self.char = "i"
-        self.hint = "consumable magic scroll "
-        # TODO: scroll icons, hotkey tooltip?
-        self.spell = random.choice(("heal",
-                                    "magic map",
-                                    "blink",
-                                    "bleed",
-                                    "magic missile",
-                                    "fireball",
-                                    ))
-        # disarm onfuse hurt bleed combat bless defense bless bull strenght dragon strenght superman
-        # TODO: different image index (i) for different spells
-
-
-class Gold(Item):
-    """a heap of gold"""
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.color = (200, 200, 0)
-        self.char = "*"
-        self.value = random.randint(1, 10)
-
-class Arrows(Item):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.color = (14,55,15)
-        self.char = "a"
-        self.quantity = random.randint(1, 33)
-
-class Immobile(Object):
-    """immobile object like trees, shops, stairs, doors etc
-    immobile's can't be picked up """
-
-    def _overwrite(self):
-        self.stay_visible_once_explored = True
-
-
-class Shop(Immobile):
-    """a shop to trade items"""
-
-    images_closed = []
-
-    def close_shop(self):
-        self.closed = True
-        self.images = Shop.images_closed
-
-    def _overwrite(self):
-        super()._overwrite()
-        #self.images = Shop.images
-        self.color = (200, 200, 0)
-        self.char = "$"
-        self.hint = "press Space to buy hp"
-        self.closed = False
-
-class StairUp(Immobile):
-    """a stair, going upwards < or downwards >"""
-
-    def _overwrite(self):
-        self.char = "<"
-        self.color = (128, 0, 128)  # violet
-        #self.stay_visible_once_explored = True
-        self.hint = "press < to climb up"
-
-class StairDown(Immobile):
-    def _overwrite(self):
-        self.char = ">"
-        self.color = (128, 0, 128)  # violet
-        #self.stay_visible_once_explored = True
-        self.hint = "press > to climb down"
-
-
-
-class Monster(Object):
-    """a (moving?) dungeon Monster, like the player, a boss, a NPC..."""
-    images =[]
-
-    def _overwrite(self):
-        self.aggro = 3
-        self.char = "M"
-        self.shoot_arrows = False
-        self.shoot_magic = False
-
-        if self.color is None:
-            self.color = (255, 255, 0)
-
-    def ai(self, player):
-        """returns dx, dy toward the player (if distance < aggro) or randomly"""
-        #if self.immobile:
-        #    return 0, 0
-        distance = ((self.x - player.x) ** 2 + (self.y - player.y) ** 2) ** 0.5
-
-        if distance < self.aggro:
-            dx = player.x - self.x
-            dy = player.y - self.y
-            dx = minmax(dx, -1, 1)
-            dy = minmax(dy, -1, 1)
-        else:
-            dx = random.choice((-1, 0, 1))
-            dy = random.choice((-1, 0, 1))
-        try:
-            target = Game.dungeon[self.z][self.y + dy][self.x + dx]
-        except:
-            #print("monster trying illegally to leave dungeon")
-            return 0, 0
-            ##raise SystemError("out of dungeon?", self.x, self.y, self.z)
-        if target.block_movement:
-            #print("monster trying to move into a wall")
-            return 0, 0
-        #print("dx dy", self.__class__.__name__, dx, dy)
-        return dx, dy
-
-    def move(self, dx, dy, dz=0):
-        if dx > 0:
-            self.look_direction = 1
-        elif dx < 0:
-            self.look_direction = 0
-        try:
-            target = Game.dungeon[self.z + dz][self.y + dy][self.x + dx]
-        except:
-            raise SystemError("out of dungeon?", self.x, self.y, self.z)
-        # --- check if monsters is trying to run into a wall ---
-        if target.block_movement:
-            if isinstance(self, Player):
-                self.hitpoints -= 1
-                Game.log.append("ouch!")  # movement is not possible
-            return
-
-        self.x += dx
-        self.y += dy
-        self.z += dz
-
-
-class Wolf(Monster):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "W"
-        self.level = 1
-        self.aggro = 5
-        self.hitpoints = 30
-        self.attack = (2, 6)
-        self.defense = (2, 5)
-        self.damage = (2, 4)
-        self.agility = 0.4
-        self.natural_weapons = [WolfBite()]
-        self.image_name = "direwolf"
-
-
-class Snake(Monster):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "S"
-        self.aggro = 2
-        self.level = 1
-        self.hitpoints = 20
-        self.attack = (2, 4)
-        self.defense = (3, 3)
-        self.damage = (3, 4)
-        self.fighting_range = 3
-        self.natural_weapons = [SnakeBite()]
-        self.image_name = "snake"
-
-
-class Yeti(Monster):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "Y"
-        self.aggro = 4
-        self.level = 2
-        self.hitpoints = 20
-        self.attack = (8, 2)
-        self.defense = (4, 3)
-        self.damage = (4, 5)
-        self.fighting_range = 15
-        self.natural_weapons = [YetiSnowBall(), YetiSlap()]
-        self.image_name = "yeti"
-
-
-class Dragon(Monster):
-
-    def _overwrite(self):
-        super()._overwrite()
-        self.char = "D"
-        self.aggro = 6
-        self.level = 3
-        self.immobile = True
-        self.shoot_arrows = True
-        self.fighting_range = 15 #random.randint(10, 15)
-        self.hitpoints = 50
-        self.attack = (6, 3)
-        self.defense = (6, 3)
-        self.damage = (5, 3)
-        self.natural_weapons = [DragonBite(), DragonClaw(), DragonTail(), FireBreath()]
-        self.image_name = "dragon"
-
-
-class Player(Monster):
-
-    def _overwrite(self):
-        self.char = "@"
-        self.color = (0, 0, 255)
-        self.hitpoints = 100
-        self.hitpoints_max = 125
-        self.attack = (3, 6)
-        self.defense = (3, 5)
-        self.damage = (4, 5)
-        self.natural_weapons = [Fist(), Kick()]
-        self.items = {}
-        self.gold = 100
-        self.scrolls = {}
-        self.scroll_list = []
-        self.victims = {}
-        self.arrows = 5
-        self.image_name = "arch-mage"
-        self.sniffrange_monster = 4
-        self.sniffrange_items = 6
-
-    def calculate_scroll_list(self):
-        """returns a list of (key, spell name, number of scrolls) tuples"""
-
-        result = []
-        for i, spell in enumerate(self.scrolls):
-            result.append((ALPHABET[i], spell, self.scrolls[spell]))
-        self.scroll_list = result
-
-    def spell_from_key(self, key):
-        for i, spell, number in self.scroll_list:
-            if i == key and number > 0:
-                return spell
-        return None
-
-
-class Game():
-    dungeon = []  # list of list of list. 3D map representation, using text chars. z,y,x ! z=0: first level. z=1: second level etc
-    fov_map = []  # field of vie map, only for current level!
-    objects = {}  # container for all Object instances in this dungeon
-    tiles_x = 0
-    tiles_y = 0
-    torch_radius = 10 # for field of view calculation
-    log = []  # message log
-    game_over = False
-    cursor_x = 0  # absolute coordinate, tile
-    cursor_y = 0
-    player = None
-
-    # friend_image = "arch-mage-idle"
-    # foe_image = None
-
-    def __init__(self, tiles_x=80, tiles_y=40):
-        Game.tiles_x = tiles_x  # max. width of the level in tiles
-        Game.tiles_y = tiles_y  # max. height of the level in tiles, top row is 0, second row is 1 etc.
-        # self.checked = set()   # like a list, but without duplicates. for fov calculation
-        Game.player = Player(x=1, y=1, z=0)
-        Game.cursor_x = self.player.x
-        Game.cursor_y = self.player.y
-        # Monster(2,2,0)
-        Wolf(2, 2, 0)
-        #Yeti(2,2,0)
-        Snake(3, 3, 0)
-        Yeti(4, 4, 0)
-        Dragon(33, 6, 0)
-        Dragon(30, 5, 0)
-        Dragon(31, 4, 0)
-        Shop(7, 1, 0)
-        #for a in range(5):
-        #    Gold(2, 1+a , 0)
-        Gold(3,1,0)
-        Gold(4,1,0)
-
-        for _ in range(15):
-            Scroll(4, 4, 0)
-            Scroll(5, 4, 0)
-            Scroll(4, 6, 0)
-
-        self.levelmonsters = [Snake,Wolf, Yeti, Dragon ]
-        self.lootlist = [Gold, Arrows, Scroll]
-        # Scroll(4, 5, 0)
-        self.log.append("Welcome to the first dungeon level (level 0)!")
-        self.log.append("Use cursor keys to move around")
-        self.load_level(0, "level001.txt", "data")
-        # self.load_level(1, "level002.txt", "data")
-        # self.load_level(2, "level003.txt", "data")
-        # TODO join create_empty_dungeon_level mit create_rooms_tunnels
-        self.create_empty_dungeon_level(tiles_x, tiles_y, filled=True, z=1)  # dungoen is full of walls,
-        # carve out some rooms and tunnels in this new dungeon level
-        self.rooms = []
-        # append empty dungeon level
-        self.create_rooms_and_tunnels(z=1)  # carve out some random rooms and tunnels -> self.rooms
-        self.place_monsters(z=1)
-        self.place_loot(z=1)
-
-        self.turn = 1
-
-    def wait_a_turn(self):
-        Game.log.append("You stay around for one turn")
-
-    def shopping(self):
-        """shop hp for gold if player stays on a shop
-        otherwise, just wait a turn doing nothing
-        return True if shopping sucessfull, otherwise return False"""
-        # -----on shop buy 10 hp for one gold------
-        for o in [o for o in Game.objects.values() if o.z == self.player.z and
-                  o.x == self.player.x and  o.y == self.player.y and
-                  isinstance(o, Shop)]:
-            # player is in a shop
-            if o.closed:
-                Game.log.append("This shop has gone out of business. Find another shop!")
-                return False
-            if self.player.gold <= 0:
-                Game.log.append("You found a shop but you lack Gold to buy anything :-(")
-                return False
-            # player is in shop and has gold
-            if self.player.hitpoints >= self.player.hitpoints_max:
-                Game.log.append("You are already at your maximum health. Shopping is useless now.")
-                return False
-            # shopping
-            self.player.gold -= 1
-            self.player.hitpoints += 10
-            self.player.hitpoints = min(self.player.hitpoints, self.player.hitpoints_max)
-            Game.log.append("You spent one gold for healing")
-            # 20% chance that shop dissapears
-            if random.random() < 0.2:
-                o.close_shop()  # = True
-                Game.log.append("The shop is closed for business")
-            return True
-        else: # no shop found here
-            self.wait_a_turn()
-            return False
-
-
-
-
-
-    def new_turn(self):
-        self.turn += 1
-        for m in [o for o in Game.objects.values() if
-                  o.z == self.player.z and o != self.player and o.hitpoints > 0 and isinstance(o, Monster)]:
-            self.move_monster(m)
-            #self.remove_dead_monsters(m) # TODO: check if dead monster is removed from all lists
-
-    def player_has_new_position(self):
-        """called after postion change of player,
-        checks if the player can pick up something or stays
-        on an interesting tile"""
-        myfloor = []
-        # ---- pick up items from the floor -----
-        for o in [o for o in Game.objects.values() if (isinstance(o, Item) and o.z == self.player.z and
-                o.x == self.player.x and o.y == self.player.y)]:
-        #        myfloor.append(o)
-        #for o in myfloor:
-                if isinstance(o, Gold):
-                    Game.log.append("You found {} gold!".format(o.value))
-                    # delay, gold is added only after gold-fly animation
-                    # animation
-                    for _ in range(o.value):
-                        GoldSprite(pos=pygame.math.Vector2(Viewer.tile_to_pixel((o.x, o.y),center=True)))
-                    # kill gold from dungeon
-                    del Game.objects[o.number]
-
-
-                elif isinstance(o, Arrows):
-                    Game.log.append("You found {} arrows!".format(o.quantity))
-                    self.player.arrows += o.quantity
-                    del Game.objects[o.number]
-
-                elif isinstance(o, Scroll):
-                    Game.log.append("you found a scroll of {}".format(o.spell))
-                    if o.spell in self.player.scrolls:
-                        self.player.scrolls[o.spell] += 1
-                    else:
-                        self.player.scrolls[o.spell] = 1
-                    self.player.calculate_scroll_list()
-                    del Game.objects[o.number]             # kill this scroll instance in the dungeon
-
-    def other_arrow(self, shooterposition, targetposition, object="arrow"):
-        # returns  end-tile , victimposition(s)
-        # TODO: randomized / formula damage calculation
-        # check if line of tiles in arrow path
-        flightpath = get_line(shooterposition, targetposition)
-        victimposlist = [] # TODO: list of victimpositions (area damage, penetrating arrow)
-        for i, (x, y) in enumerate(flightpath):
-            if i == 0:         # flightpath = flightpath[1:] # remove first tile, because it is blocked by shooter
-                continue  # don't look for objects at shooterposition
-            # print(Game.dungeon[self.player.z][y][x]) # TODO: highlight flightpath with cursor movement ?
-            if Game.dungeon[self.player.z][y][x].block_flying:
-                targetposition = flightpath[i - 1]
-                break  # some tile is blocking the path
-            # is a monster blocking path ?
-            for o in [o for o in Game.objects.values() if
-                      o.z == self.player.z and o.y == y and o.x == x and isinstance(o, Monster)]:
-                # TODO: arrow/object damage calculation, hit or miss calculation
-                if object == "arrow":
-                    damage = random.randint(5,10)
-                elif object == "magic missile":
-                    damage = random.randint(15,15)
-                elif object == "fireball":
-                    damage = random.randint(20,40)
-                else:
-                    damage = 4 # TODO testen ob das jemals vorkommt
-                # example: a fireball hit the Yeti and makes 20 damage
-                Game.log.append("a {} hit the {} and makes {} damage!".format(object, o.__class__.__name__, damage))
-                o.hitpoints -= damage
-                victimposlist.append((o.x, o.y))
-                self.remove_dead_monsters(o)  # only if really dead
-                # non-penetration arrow. the flightpath stops here!
-                # TODO: penetration arrow
-                # return flightpath[:i]
-                return flightpath[i], victimposlist
-        return targetposition, []  # no victim
-        # print("flightpath", flightpath)
-
-    def player_arrow(self):
-        """fires an arrow from player to Cursor.
-           returns  end, victim"""
-        if self.player.arrows < 1:
-            Game.log.append("you must find/buy some arrows before you can shoot them")
-            return None, None
-        if Game.cursor_y == self.player.y and Game.cursor_x == self.player.x:
-            Game.log.append("you must move the cursor with mouse before shooting with f")
-            return None, None  # start, end, victim
-        self.player.arrows -= 1
-        return self.other_arrow((self.player.x, self.player.y),
-                                (Game.cursor_x, Game.cursor_y))
-
-    def checkfight(self, x, y, z):
-        """wir gehen davon aus dass nur der player schaut (checkt) ob er in ein Monster läuft"""
-        # Game.foe_image = None
-        for o in Game.objects.values():
-            if o == self.player:
-                continue
-            if o.hitpoints <= 0:
-                continue
-            if not isinstance(o, Monster):
-                continue
-            if o.z == z:
-                if o.x > self.player.x:
-                    o.look_direction = 0
-                elif o.x < self.player.x:
-                    o.look_direction = 1
-                if o.x == x and o.y == y:
-                    self.fight(self.player, o)
-                    return True
-        return False
-
-    def move_player(self, dx=0, dy=0):
-        if not self.checkfight(self.player.x + dx, self.player.y + dy, self.player.z):
-            self.player.move(dx, dy)
-            self.make_fov_map()
-            self.player_has_new_position()
-
-    def move_monster(self, m):
-        """moves a monster randomly, but not into another monster (or wall etc.).
-           starts a fight with player if necessary"""
-        dx, dy = m.ai(self.player)
-        # ai checked already that the move is legal (inside dungeon and not blocked by wall)
-        # now only needed to check i running in another monster or into the player
-        for o in Game.objects.values():
-            if o.z != self.player.z:
-                continue
-            if o.hitpoints < 1:
-                continue
-            if not isinstance(o, Monster):
-                continue
-            if o.x == m.x + dx and o.y == m.y + dy:
-                dx, dy = 0, 0
-                if o == self.player:
-                    self.fight(m, self.player)
-                break
-        m.x += dx
-        m.y += dy
-
-    def fight(self, a, b):
-        self.strike(a, b)  # first strike
-        if b.hitpoints > 0:
-            self.strike(b, a)  # counterstrike
-        self.remove_dead_monsters(a, b) # remove dead monsters from game
-
-    def remove_dead_monsters(self, *monster):
-        for mo in monster:  # a monster is a Game.object.value, the key is it's number
-            if mo != self.player and mo.hitpoints <= 0:
-                name = mo.__class__.__name__
-                if name not in self.player.victims:
-                    self.player.victims[name] = 1
-                else:
-                    self.player.victims[name] += 1
-                # del Game.objects[monster.number]
-                mo.kill()
-
-    def strike(self, a, b):
-        wa = random.choice(a.natural_weapons)
-        attack_value = roll(a.attack, wa.attack_bonus)
-        wd = random.choice(b.natural_weapons)
-        defense_value = roll(b.defense, wd.defense_bonus)
-        if attack_value > defense_value:
-            damage_value = roll(a.damage, wa.damage_bonus)
-            b.hitpoints -= damage_value
-        else:
-            damage_value = 0
-        Game.log.append("{} ({}hp) strikes at {} ({}hp) using {} against {}".format(
-            a.__class__.__name__,
-            a.hitpoints,
-            b.__class__.__name__,
-            b.hitpoints,
-            wa.__class__.__name__,
-            wd.__class__.__name__))
-        Game.log.append("{}d{}{}{}={}  vs  {}d{}{}{}={} damage: {} hp ({}d{}{}{}) {} --> has {}hp left".format(
-            a.attack[0], a.attack[1], "+" if wa.attack_bonus >= 0 else "", wa.attack_bonus, attack_value,
-            b.defense[0], b.defense[1], "+" if wd.defense_bonus >= 0 else "", wd.defense_bonus, defense_value,
-            damage_value, a.damage[0], a.damage[1], "+" if wa.damage_bonus >= 0 else "", wa.damage_bonus,
-            b.__class__.__name__, b.hitpoints))
-        # TODO: damage calculation only if hit occurs, else "no hit"
-
-    def check_player(self):
-        if self.player.hitpoints <= 0:
-            Game.game_over = True
-
-    def consume_scroll(self, spell):
-        self.player.scrolls[spell] -= 1
-        self.player.calculate_scroll_list()
-
-    def cast(self, spell):
-        if spell not in self.player.scrolls or self.player.scrolls[spell] < 1:
-            Game.log.append("You have currently no scroll of {}".format(spell))
-            return False  # no casting
-
-        # ----- spells that need no cursor position at all -----
-        if spell == "magic map": # make all tiles in this dungeon level explored
-            for y, line in enumerate(Game.dungeon[self.player.z]):
-                for x, map_tile in enumerate(line):
-                    map_tile.explored = True
-            self.consume_scroll(spell)
-            return True
-
-        elif spell == "heal": # give player some hitpoints
-            self.consume_scroll(spell)
-            self.log.append("your healing spell gives you +20 hp")
-            self.player.hitpoints += 20 # TODO: max_hp ?
-            return True
-
-        # ----- spells that need a cursor position different from player position ---
-        if Game.cursor_y == self.player.y and Game.cursor_x == self.player.x:
-            Game.log.append("you must select another tile with the mouse before casting {}".format(spell))
-            return False  # no casting
-
-        if spell == "bleed": # monster is  directly damaged, as long as it is visible.
-            for monster in [o for o in Game.objects.values() if o.z == self.player.z and
-                            o.y == Game.cursor_y and o.x ==  Game.cursor_x and
-                            isinstance(o, Monster) and o.hitpoints > 0 and
-                            Game.fov_map[o.y][o.x]]:
-                monster.hitpoints -= 20
-                Game.log.append("{} bleeds 20 hitpoints".format(monster.__class__.__name__))
-                self.consume_scroll(spell)
-                return (monster.x,monster.y) # return tile of bleeding
-            return False
-
-
-        elif spell == "magic missile": # shoot to Monster at cursor position, like arrow, but more damage
-            self.consume_scroll(spell)
-            # TODO check if target is outside line of sight / torchradius
-            return  self.other_arrow((self.player.x, self.player.y),
-                                    (Game.cursor_x, Game.cursor_y), "magic missile")
-            # return end, victim
-
-        elif spell == "fireball": # like magic missile, more damage # todo: area damage
-            self.consume_scroll(spell)
-            return self.other_arrow((self.player.x, self.player.y),
-                                    (Game.cursor_x, Game.cursor_y), "fireball")
-
-
-        elif spell == "blink":  # teleport the player to cursor position
-            target_tile = Game.dungeon[self.player.z][Game.cursor_y][Game.cursor_x]
-            if not target_tile.explored:
-                Game.log.append("You can not blink on a unexplored tile.")
-                return False
-            if target_tile.block_movement:
-                Game.log.append("You can not blink to this tile.")
-                return False
-            if not Game.fov_map[Game.cursor_y][Game.cursor_x]:
-                Game.log.append("You can not blink on a tile outside your field of view")
-                return False
-            for o in Game.objects.values():
-                if (o.z == self.player.z and o.y == Game.cursor_y and
-                        o.x ==  Game.cursor_x and
-                        isinstance(o, Monster) and o.hitpoints > 0):
-                    Game.log.append("You can not blink on top of a monster")
-                    return False
-            old = (self.player.x, self.player.y)
-            self.move_player(Game.cursor_x-self.player.x, Game.cursor_y-self.player.y)
-            self.consume_scroll(spell)
-            return old # success
-
-    def load_level(self, z, name, folder="data"):
-        """load a text file and return a list of non-empty lines without newline characters"""
-        lines = []
-        with open(os.path.join(folder, name), "r") as f:
-            for line in f:
-                if line.strip() != "":
-                    lines.append(line[:-1])  # exclude newline char
-        # return lines
-        level = []
-        for y, line in enumerate(lines):
-            row = []
-            for x, char in enumerate(line):
-                if char == "#":
-                    row.append(Wall())
-                else:
-                    row.append(Floor())
-                if char == "<":
-                    StairUp(x, y, z, char)
-                if char == ">":
-                    StairDown(x,y,z, char)
-                if char == "$":
-                    Shop(x, y, z, char)
-                if char == "a":
-                    Arrows(x,y,z,char)
-                if char == "*":
-                    Gold(x, y, z, char)
-                if char == "M":
-                    if random.random() < 0.5:
-                        Wolf(x, y, z)
-                    else:
-                        Snake(x, y, z)
-            level.append(row)
-        try:
-            Game.dungeon[z] = level
-        except:
-            Game.dungeon.append(level)
-        print("level loaded:", self.dungeon[z])
-
-    def create_rooms_and_tunnels(self, z=0, room_max_size=10, room_min_size=6, max_rooms=30):
-        """carve out some random rooms and connects them by tunnels. player is placed in the first room"""
-        rooms = []
-        num_rooms = 0
-        self.room_max_size = room_max_size
-        self.room_min_size = room_min_size
-        self.max_rooms = max_rooms
-
-        for r in range(self.max_rooms):
-            print("carving out room number {}...".format(r))
-            # random width and height
-            w = random.randint(self.room_min_size, self.room_max_size)
-            h = random.randint(self.room_min_size, self.room_max_size)
-            # random topleft position without going out of the boundaries of the map
-            x = random.randint(0, Game.tiles_x - w - 1)
-            y = random.randint(0, Game.tiles_y - h - 1)
-            # "Rect" class makes rectangles easier to work with
-            new_room = Rect(x, y, w, h)
-            # run through the other rooms and see if they intersect with this one
-            # failed = False
-            for other_room in rooms:
-                if new_room.intersect(other_room):
-                    # failed = True
-                    break
-            # if not failed:
-            else:  # for loop got through without a break
-                # this means there are no intersections, so this room is valid
-                # carve out this room!
-                self.create_room(new_room, z)
-                # center coordinates of new room, will be useful later
-                (new_x, new_y) = new_room.center()
-
-                if num_rooms == 0:
-                    # this is the first room, where the player starts at
-                    # create tunnel from player position to this room
-                    prev_x, prev_y = self.player.x, self.player.y
-                else:
-                    (prev_x, prev_y) = rooms[num_rooms - 1].center()
-                self.create_tunnel(prev_x, prev_y, new_x, new_y, z)
-                ### draw a coin (random number that is either 0 or 1)
-                ##if random.choice([0,1]) == 1:
-                ##    # first move horizontally, then vertically
-                ##    self.create_h_tunnel(prev_x, new_x, prev_y, z)
-                ##    self.create_v_tunnel(prev_y, new_y, new_x, z)
-                ##else:
-                ##    # first move vertically, then horizontally
-                ##    self.create_v_tunnel(prev_y, new_y, prev_x, z)
-                ##    self.create_h_tunnel(prev_x, new_x, new_y, z)
-                # finally, append the new room to the list
-                rooms.append(new_room)
-                num_rooms += 1
-        # --------- all rooms added. check stairs now -------
-        # ---------- stairs up ---------------
-        # check if this is level 0, add a single stair up
-        if z == 0:
-            # place stair up in a random room
-            r = random.choice(rooms)
-            StairUp(r.center()[0], r.center()[1], z, char="<")
-        else:
-            # collect all stairs down from previous level,
-            # make at same position a stair up, carve a tunnel to a random room if necessary
-            stairlist = [(o.x, o.y) for o in Game.objects.values() if
-                          o.z == z - 1 and isinstance(o, StairDown)]
-            print("creating prev stairlist:", stairlist)
-            for (x, y) in stairlist:
-                if Game.dungeon[z][y][x].char != ".":
-                    # carve tunnel to random room center
-                    r = random.choice(rooms)
-                    self.create_tunnel(x, y, r.center()[0], r.center()[1], z)
-                # make a stair!
-                StairUp(x, y, z, char="<")
-        # ------------------ stairs down ----------------
-        # select up to 3 random rooms and place a stair down in it's center
-        num_stairs = 0
-        stairs = random.randint(1, 3)
-        print("creating stairs down...")
-        while num_stairs < stairs:
-            r = random.choice(rooms)
-            x, y = r.center()
-            # is there already any object at this position?
-            objects_here = [o for o in Game.objects.values() if o.z == z and o.x == x and o.y == y]
-            if len(objects_here) > 0:
-                continue
-            StairDown(x, y, z, char=">")
-            num_stairs += 1
-        # --- copy local rooms to self.rooms ---
-        self.rooms =  rooms
-
-
-    def place_monsters(self, z):
-        """place a random monster inside a room
-        mayme more than one. maybe even 2 on the same tile
-        depending on levelmonsters
-        (in level 1 only snakes, in level 2 snakes or wolfes etc)
-        """
-        # TODO: better code to avoid 2 monsters spawn on same tile
-        for room in self.rooms:
-            #print("processing room", room)
-            #x1, y1, x2, y2 = room
-            # 10% chance for 0 monster in this room
-            # 70% chance for 1 monster, 15% for 2, 5% for 3
-            for _ in range(randomizer([0.1, 0.7,0.15,0.05])):
-                mo = random.choice(self.levelmonsters[:z]) # if z > len(levelmonsters), take any monster
-                try:
-                    x = random.randint(room.x1+1, room.x2-1)
-                    y = random.randint(room.y1+1, room.y2-1)
-                except:
-                    print("problem with placing monster in room:{}".format(room))
-                    return
-                mo(x,y,z) # create a new monster
-
-
-    def place_loot(self, z):
-        """each floor tile has a small chance to spawn loot and very small chance to spawn a shop"""
-        for y, line in enumerate(Game.dungeon[z]):
-            for x, tile in enumerate(line):
-                #print("tile = ", tile)
-                if isinstance(tile, Floor):
-                    if random.random() < 0.01:
-                        loot = random.choice(self.lootlist)
-                        loot(x,y,z)
-                    if random.random() < 0.001:
-                        Shop(x,y,z)
-
-    def use_stairs(self):
-        """go up or done one dungeon level, depending on stair"""
-        for o in Game.objects.values():
-            if (isinstance(o, StairUp) or
-                isinstance(o, StairDown)) and o.z == self.player.z and o.y == self.player.y and o.x == self.player.x:
-                break  # all ok, found a stair
-        else:
-            Game.log.append("You must find a stair up to ascend or descend")
-            return False
-        if isinstance(o, StairUp):
-            self.ascend()
-            return True
-        elif isinstance(o, StairDown):
-            self.descend()
-            return True
-
-    def ascend(self):
-        """go up one dungeon level (or leave the game if already at level 0)"""
-        if self.player.z == 0:
-            Game.log.append("You climb back to the surface and leave the dungeon. Good Bye!")
-            print(Game.log[-1])
-            Game.game_over = True
-        else:
-            Game.log.append("climbing up one level....")
-            self.player.z -= 1
-            self.make_fov_map()
-            self.player_has_new_position()
-
-    def descend(self):
-        """go down one dungeon level. create this level if necessary """
-        Game.log.append("climbing down one level, deeper into the dungeon...")
-        try:
-            l = Game.dungeon[self.player.z + 1]
-        except:
-            z_new = self.player.z + 1
-            Game.log.append("please wait a bit, i must create this level...")
-            self.create_empty_dungeon_level(Game.tiles_x, Game.tiles_y,
-                                            z=z_new)
-            self.create_rooms_and_tunnels(z=z_new)
-            self.place_monsters(z=z_new)
-            self.place_loot(z=z_new)
-        self.player.z += 1
-        self.make_fov_map()
-        self.player_has_new_position()
-        # return True
-
-    def create_empty_dungeon_level(self, max_x, max_y, filled=True, z=0):
-        """creates empty dungeon level and append it to Game.dungeon
-           if "filled" is False with floor tiles ('.') and an outer wall ('#')
-           otherwise all is filled with walls
-        """
-        # TODO: check max x,y from doors in previous level, randomize level dimension
-        # TODO: create tunnel from stair to closest room, not to random room
-        floor = []
-        for y in range(max_y):
-            line = []
-            for x in range(max_x):
-                if filled:
-                    line.append(Wall())  # fill the whole dungeon level with walls
-                else:
-                    # outer walls only
-                    line.append(Wall() if y == 0 or y == max_y - 1 or x == 0 or x == max_x - 1 else Floor())
-            floor.append(line)
-        try:
-            Game.dungeon[z] = floor
-        except:
-            Game.dungeon.append(floor)
-        # print(Game.dungeon)
-
-    def create_room(self, rect, z=0):
-        """needs a rect object and carves a room out of this (z) dungeon level. Each room has a wall"""
-        for x in range(rect.x1 + 1, rect.x2):
-            for y in range(rect.y1 + 1, rect.y2):
-                # replace the tile at this position with an floor tile
-                Game.dungeon[z][y][x] = Floor()  # replace whatever tile that was there before with a floor
-
-    def create_h_tunnel(self, x1, x2, y, z=0):
-        """create an horizontal tunnel in dungeon level z (filled with floor tiles)"""
-        for x in range(min(x1, x2), max(x1, x2) + 1):
-            Game.dungeon[z][y][x] = Floor()  # replace whatever tile that was there before with a floor
-
-    def create_v_tunnel(self, y1, y2, x, z=0):
-        """create an vertical tunnel in dungeon level z (filled with floor tiles)"""
-        for y in range(min(y1, y2), max(y1, y2) + 1):
-            Game.dungeon[z][y][x] = Floor()  # replace whatever tile that was there before with a floor
-
-    def create_tunnel(self, x1, y1, x2, y2, z=0):
-        if random.choice([0, 1]) == 1:
-            # first move horizontally, then vertically
-            self.create_h_tunnel(x1, x2, y1, z)
-            self.create_v_tunnel(y1, y2, x2, z)
-        else:
-            # first move vertically, then horizontally
-            self.create_v_tunnel(y1, y2, x1, z)
-            self.create_h_tunnel(x1, x2, y2, z)
-
-    def make_fov_map(self):
-        Game.fov_map = []
-        # self.checked = set() # clear the set of checked coordinates
-        px, py, pz = self.player.x, self.player.y, self.player.z
-        # set all tiles to False
-        for line in Game.dungeon[pz]:
-            row = []
-            for tile in line:
-                row.append(False)
-            Game.fov_map.append(row)
-        # set player's tile to visible
-        Game.fov_map[py][px] = True
-        # get coordinates form player to point at end of torchradius / torchsquare
-        endpoints = set()
-        for y in range(py - Game.torch_radius, py + Game.torch_radius + 1):
-            if y == py - Game.torch_radius or y == py + Game.torch_radius:
-                for x in range(px - Game.torch_radius, px + Game.torch_radius + 1):
-                    endpoints.add((x, y))
-            else:
-                endpoints.add((px - Game.torch_radius, y))
-                endpoints.add((px + Game.torch_radius, y))
-        for coordinate in endpoints:
-            # a line of points from the player position to the outer edge of the torchsquare
-            points = get_line((px, py), (coordinate[0], coordinate[1]))
-            self.calculate_fov_points(points)
-        # print(Game.fov_map)
-        # ---------- the fov map is now ready to use, but has some ugly artifacts ------------
-        # ---------- start post-processing fov map to clean up the artifacts ---
-        # -- basic idea: divide the torch-square into 4 equal sub-squares.
-        # -- look of a invisible wall is behind (from the player perspective) a visible
-        # -- ground floor. if yes, make this wall visible as well.
-        # -- see https://sites.google.com/site/jicenospam/visibilitydetermination
-        # ------ north-west of player
-        for xstart, ystart, xstep, ystep, neighbors in [
-            (-Game.torch_radius, -Game.torch_radius, 1, 1, [(0, 1), (1, 0), (1, 1)]),
-            (-Game.torch_radius, Game.torch_radius, 1, -1, [(0, -1), (1, 0), (1, -1)]),
-            (Game.torch_radius, -Game.torch_radius, -1, 1, [(0, -1), (-1, 0), (-1, -1)]),
-            (Game.torch_radius, Game.torch_radius, -1, -1, [(0, 1), (-1, 0), (-1, 1)])]:
-
-            for x in range(px + xstart, px, xstep):
-                for y in range(py + ystart, py, ystep):
-                    # not even in fov?
-                    try:
-                        visible = Game.fov_map[y][x]
-                    except:
-                        continue
-                    if visible:
-                        continue  # next, i search invisible tiles!
-                    # oh, we found an invisble tile! now let's check:
-                    # is it a wall?
-                    if Game.dungeon[pz][y][x].char != "#":
-                        continue  # next, i search walls!
-                    # --ok, found an invisible wall.
-                    # check south-east neighbors
-
-                    for dx, dy in neighbors:
-                        # does neigbor even exist?
-                        try:
-                            v = Game.fov_map[y + dy][x + dx]
-                            t = Game.dungeon[pz][y + dy][x + dx]
-                        except:
-                            continue
-                        # is neighbor a tile AND visible?
-                        if isinstance(t, Floor)  and v == True:
-                            # ok, found a visible floor tile neighbor. now let's make this wall
-                            # visible as well
-                            Game.fov_map[y][x] = True
-                            break  # other neighbors are irrelevant now
-
-    def calculate_fov_points(self, points):
-        """needs a points-list from Bresham's get_line method"""
-        for point in points:
-            x, y = point[0], point[1]
-            # player tile always visible
-            if x == self.player.x and y == self.player.y:
-                Game.fov_map[y][x] = True  # make this tile visible and move to next point
-                continue
-            # outside of dungeon level ?
-            try:
-                tile = Game.dungeon[self.player.z][y][x]
-            except:
-                continue  # outside of dungeon error
-            # outside of torch radius ?
-            distance = ((self.player.x - x) ** 2 + (self.player.y - y) ** 2) ** 0.5
-            if distance > Game.torch_radius:
-                continue
-
-            Game.fov_map[y][x] = True  # make this tile visible
-            if tile.block_sight:
-                break  # forget the rest
-
-
 class CursorSprite(VectorSprite):
 
+    images = {}  # {(grey, grid_size): Surface}, one image for each of the flickering colors
+
     def create_image(self):
-        self.image = pygame.surface.Surface((Viewer.grid_size[0],
-                                             Viewer.grid_size[1]))
-        c = random.randint(100, 250)
-        pygame.draw.rect(self.image, (c, c, c), (0, 0, Viewer.grid_size[0],
-                                                 Viewer.grid_size[1]), 3)
-        self.image.set_colorkey((0, 0, 0))
-        self.image.convert_alpha()
+        c = rng.cosmetic.randint(100, 250)
+        key = (c, Viewer.grid_size)
+        if key not in self.images:
+            image = pygame.surface.Surface((Viewer.grid_size[0],
+                                            Viewer.grid_size[1]))
+            pygame.draw.rect(image, (c, c, c), (0, 0, Viewer.grid_size[0],
+                                                Viewer.grid_size[1]), 3)
+            image.set_colorkey((0, 0, 0))
+            self.images[key] = image
+        self.image = self.images[key]
         self.rect = self.image.get_rect()
 
     def update(self, seconds):
@@ -1873,24 +690,42 @@ class Viewer():
     grid_size = (32, 32)
     pcx = 0  # player x coordinate in pixel
     pcy = 0  # player y coordinate in pixel
-
-    def __init__(self, game, width=640, height=400, grid_size=(32, 32), fps=60, ):
+    gold_in_flight = 0  # gold already picked up, but still flying as GoldSprite to the panel
+    savegame = "roguebasin.sav"  # file name for saving with F5
+    metrics_file = "roguebasin_metrics.json"  # F4 and the end of the game write the profiler stats here (.json or .csv)
+    metrics_interval = 0.5  # seconds between two updates of the profiler overlay (F3)
+    replay = None  # Replay to play back instead of taking the actions from the keyboard
+    replay_delay = 0.15  # seconds between two actions of the replay
+    skip_animations = False  # True: never wait for animations (fast replays)
+    particles = None  # Particles of all explosions, created in prepare_spritegroups
+    chunk_size = 16  # tiles. draw_dungeon blits pre-rendered chunks of chunk_size x chunk_size tiles
+    chunk_cache_size = 48  # number of chunk surfaces to keep, see chunk_surface
+    # palette of the radar: not explored, wall, floor, stair down, stair up, shop, item, monster
+    radar_colors = [(10, 10, 10), (50, 50, 250), (150, 150, 150), (128, 255, 128), (64, 255, 64),
+                    (200, 200, 200), (0, 200, 0), (255, 0, 0)]
+    # bytes.translate tables: tile number -> radar color, explored flag -> 0 or 255 (bit mask)
+    radar_tiles = bytes(1 if n < len(TILES) and TILES[n].block_movement else 2 for n in range(256))
+    radar_explored = bytes(255 if n else 0 for n in range(256))
+
+    def __init__(self, game, width=640, height=400, grid_size=(32, 32), fps=60, run=True):
         """Initialize pygame, window, background, font,...
-           default arguments """
+           run: start the main loop. False only prepares the Viewer (e.g. for tests and benchmarks)"""
         self.game = game
+        self.game.renderer = self  # the game hands over visual effects to handle_events
         self.fps = fps
         # position in pixel where all the gold sprites are flying to:
         Viewer.grid_size = grid_size  # make global readable
         Viewer.width = width
         Viewer.height = height
         GoldSprite.blackhole = pygame.math.Vector2(Viewer.width - self.panel_width + 10, Viewer.panel_width + 80)
-        self.random1 = random.randint(1, 1000)  # necessary for Viewer.wall_and_floor_theme
-        self.random2 = random.randint(1, 1000)
+        self.random1 = rng.cosmetic.randint(1, 1000)  # necessary for Viewer.wall_and_floor_theme
+        self.random2 = rng.cosmetic.randint(1, 1000)
         pygame.init()
         # player center in pixel
         Viewer.pcx = (width - Viewer.panel_width) // 2  # set player in the middle of the screen
         Viewer.pcy = (height - Viewer.log_height) // 2
         self.radarblipsize = 4  # pixel
+        self.radar_key = None  # game state of the radar picture, see draw_radar
         self.logscreen_fontsize = 15
         self.screen = pygame.display.set_mode((self.width, self.height), pygame.DOUBLEBUF)
         self.clock = pygame.time.Clock()
@@ -1927,15 +762,31 @@ class Viewer():
         self.darkfloors = []
         self.lightwalls = []
         self.darkwalls = []
+        self.chunks = collections.OrderedDict()  # {(z, chunk x, chunk y, dark): (signature, surface)}
+        self.drawn = None  # (z, map version, player x, player y) of the picture on screen, see update_dungeon
+        self.lit = set()  # x, y of the tiles painted lit, see update_dungeon
+        self.explored = b""  # explored flags of the level when it was painted, see update_dungeon
+        self.show_metrics = profiler.enabled  # profiler overlay, toggled with F3
+        self.metrics_image = None  # picture of the profiler overlay, see draw_metrics
+        self.metrics_time = 0  # playtime of the next update of metrics_image
         self.create_tiles()
+        self.overhang = self.object_overhang()
         self.wall_and_floor_theme()
 
         self.prepare_spritegroups()
         self.cursor = CursorSprite(pos=pygame.math.Vector2(x=Viewer.pcx, y=Viewer.pcy))
-        self.run()
+        # the game screen without sprites, to paint over the sprites of the last frame
+        self.spriteless_background = pygame.Surface((Viewer.width - Viewer.panel_width, Viewer.height))
+        self.animation = 0  # how many seconds animation should be played until the game accept inputs, new turn etc again
+        self.redraw = True
+        self.replay_actions = None if self.replay is None else iter(self.replay)  # None: not playing back
+        self.replay_time = 0  # playtime of the next action of the replay
+        if run:
+            self.run()
 
     def prepare_spritegroups(self):
         self.allgroup = pygame.sprite.LayeredUpdates()  # for drawing
+        Viewer.particles = Particles()  # explosion fragments, not sprites
         self.whole_screen_group = pygame.sprite.Group()
         self.flytextgroup = pygame.sprite.Group()
         #self.cursorgroup = pygame.sprite.Group()
@@ -1957,26 +808,24 @@ class Viewer():
         """takes a tile coordinate (x,y) and starts explosion animation there"""
         x,y = Viewer.tile_to_pixel(startpos, center=True)
         for _ in range(50 if frags is None else frags):
-            mo = pygame.math.Vector2(x=random.randint(5 if minspeed is None else minspeed,
+            mo = pygame.math.Vector2(x=rng.cosmetic.randint(5 if minspeed is None else minspeed,
                                                     150 if maxspeed is None else maxspeed),y =0)
-            mo.rotate_ip(random.randint(0,360))
+            mo.rotate_ip(rng.cosmetic.randint(0,360))
             if duration is None:
-                duration = random.random() * 1.5 + 0.5 # between half and 2 seconds
+                duration = rng.cosmetic.random() * 1.5 + 0.5 # between half and 2 seconds
 
             if color is None:
-                c = [random.randint(1,255),random.randint(1,255),random.randint(1,255)] # any color except black
+                c = [rng.cosmetic.randint(1,255),rng.cosmetic.randint(1,255),rng.cosmetic.randint(1,255)] # any color except black
             else:
                 c = color
             # randomize a little bit each color value
             for value in c:
-                value += random.randint(-20,20)
+                value += rng.cosmetic.randint(-20,20)
             # sanity check for colors
             c = (minmax(c[0], 0, 255),
                  minmax(c[1], 0, 255),
                  minmax(c[2], 0, 255))
-            FragmentSprite(pos=pygame.math.Vector2(x,y), move = mo,
-                     max_age = duration, age = age, color=c,
-                     kill_on_edge = True, gravity=gravity)
+            Viewer.particles.emit(x, y, mo.x, mo.y, max_age=duration, age=age, color=c, gravity=gravity)
 
 
     @staticmethod
@@ -2001,8 +850,8 @@ class Viewer():
         """moves the cursor to tiles xy, """
         target_x, target_y = self.game.player.x + x, self.game.player.y + y
         # check if the target tile is inside the current level dimensions
-        level_width = len(Game.dungeon[self.game.player.z][0])
-        level_height = len(Game.dungeon[self.game.player.z])
+        level_width = Game.dungeon[self.game.player.z].width
+        level_height = Game.dungeon[self.game.player.z].height
         #print("level dimension in tiles:", level_width, level_height, Game.cursor_x, Game.cursor_y, dx, dy)
         if target_x < 0 or target_y < 0 or target_x >= level_width or target_y >= level_height:
             #print("mouse outside level tiles", x, y)
@@ -2028,7 +877,7 @@ class Viewer():
                 for file in files:
                     if file[-4:].lower() == ".jpg" or file[-5:].lower() == ".jpeg":
                         self.backgroundfilenames.append(os.path.join(root, file))
-            random.shuffle(self.backgroundfilenames)  # remix sort order
+            rng.cosmetic.shuffle(self.backgroundfilenames)  # remix sort order
             self.background = pygame.image.load(self.backgroundfilenames[0])
 
         except:
@@ -2182,6 +1031,21 @@ class Viewer():
             lightfloors.append(pygame.Surface.subsurface(self.floors_img, (x, y, 32, 32)))
             darkfloors.append(pygame.Surface.subsurface(self.floors_dark_img, (x, y, 32, 32)))
         Floor.images = [lightfloors, darkfloors]
+        self.chunks.clear()  # all chunk surfaces show the old walls and floors
+        self.drawn = None  # paint everything again
+
+    def object_overhang(self):
+        """returns how many pixels the largest object image reaches into the tiles to its right and below"""
+        width, height = self.grid_size
+        todo = [Object]
+        while todo:
+            cls = todo.pop()
+            todo.extend(cls.__subclasses__())
+            for image in cls.__dict__.get("images", ()):
+                if isinstance(image, pygame.Surface):
+                    width = max(width, image.get_width())
+                    height = max(height, image.get_height())
+        return width - self.grid_size[0], height - self.grid_size[1]
 
     def tile_blit(self, surface, x_pos, y_pos, corr_x=0, corr_y=0):
         """correctly blits a surface at tile-position x,y, so that the player is always centered at pcx, pcy"""
@@ -2197,123 +1061,294 @@ class Viewer():
 
     def start_healing_sprites(self):
         for _ in range(15):
-            p = pygame.math.Vector2(self.pcx + Viewer.grid_size[0] // 2 + random.randint(-20, 20),
+            p = pygame.math.Vector2(self.pcx + Viewer.grid_size[0] // 2 + rng.cosmetic.randint(-20, 20),
                                     self.pcy + Viewer.grid_size[1])
-            m = pygame.math.Vector2(0, -random.random() * 15 - 3)
-            a = random.random() * -1.5
+            m = pygame.math.Vector2(0, -rng.cosmetic.random() * 15 - 3)
+            a = rng.cosmetic.random() * -1.5
             HealingSprite(pos=p, move=m, age=a, max_age=2)
 
-    def draw_dungeon(self):
-        z = self.game.player.z
+    def visible_tiles(self):
+        """returns x1, y1, x2, y2: the rectangle of tiles (of the current level) that are
+           (at least partly) visible in the game screen. x2 and y2 are exclusive, like in range()"""
+        level = Game.dungeon[self.game.player.z]
         px, py = self.game.player.x, self.game.player.y
-        # first, draw dungeon tiles (walls and floors)
-        for y, line in enumerate(Game.dungeon[z]):
-            for x, map_tile in enumerate(line):
-                distance = ((x - px) ** 2 + (y - py) ** 2) ** 0.5
-                # ---- check if tiles is outside torch radius of player ----
-                # ---- or otherwise (mostly) invisible
-                if distance > Game.torch_radius or not Game.fov_map[y][x]:
-                    dark = True # 1
-                else:
-                    dark = False # 0
-                    # -- only blit (dark) if tile is explored. only draw explored Items (stairs)
-                # --------blit basic dungeon tiles (wall, floor) -------
-                if not isinstance(map_tile, Wall) and not isinstance(map_tile, Floor):
-                    raise SystemError("invalid map tile")
-                images = map_tile.images[dark]
-                i = map_tile.decoration % len(images)
-                c = images[i]
-                if dark and not map_tile.explored:
+        gw, gh = self.grid_size
+        # same limits as in tile_blit
+        x1 = px - (self.pcx + gw) // gw
+        y1 = py - (self.pcy + gh) // gh
+        x2 = px + (Viewer.width - Viewer.panel_width - self.pcx) // gw + 1
+        y2 = py + (Viewer.height - Viewer.log_height - self.pcy) // gh + 1
+        return max(0, x1), max(0, y1), min(level.width, x2), min(level.height, y2)
+
+    def tiles_in_rect(self, rect):
+        """returns x1, y1, x2, y2 (like visible_tiles) of the tiles that are (partly) inside rect (pixel)"""
+        gw, gh = self.grid_size
+        px, py = self.game.player.x, self.game.player.y
+        x1, y1, x2, y2 = self.visible_tiles()
+        return (max(x1, px + (rect.left - self.pcx) // gw), max(y1, py + (rect.top - self.pcy) // gh),
+                min(x2, px - (self.pcx - rect.right) // gw), min(y2, py - (self.pcy - rect.bottom) // gh))
+
+    def lit_tiles(self):
+        """returns a set with x, y of all tiles inside the torch radius of the player that are visible"""
+        px, py = self.game.player.x, self.game.player.y
+        radius = Game.torch_radius
+        fov_map = Game.fov_map
+        lit = set()
+        for y in range(max(0, py - radius), min(fov_map.height, py + radius + 1)):
+            for x in range(max(0, px - radius), min(fov_map.width, px + radius + 1)):
+                if (x - px) ** 2 + (y - py) ** 2 <= radius ** 2 and fov_map.cells[y * fov_map.width + x]:
+                    lit.add((x, y))
+        return lit
+
+    def chunk_surface(self, level, z, cx, cy, dark, immobiles):
+        """returns a surface with the static part (walls, floors, stairs, shops) of the chunk
+           cx, cy: the tiles cx * chunk_size, cy * chunk_size to (cx + 1) * chunk_size - 1, ...
+           dark: True for the dark images, unexplored tiles get the unknown_tile
+           immobiles: tuple of (x, y, images) for the immobiles inside the chunk
+           The surface is painted again only if the tiles (or explored flags) of the chunk,
+           its immobiles or the wall and floor theme have changed"""
+        cs = Viewer.chunk_size
+        x1, y1 = cx * cs, cy * cs
+        x2, y2 = min(level.width, x1 + cs), min(level.height, y1 + cs)
+        rows = [slice(y * level.width + x1, y * level.width + x2) for y in range(y1, y2)]
+        signature = b"".join(level.tiles[r] for r in rows)
+        if dark:
+            signature += b"".join(level.explored[r] for r in rows)
+        signature = (signature, immobiles)
+        key = (z, cx, cy, dark)
+        cached = self.chunks.get(key)
+        if cached is not None and cached[0] == signature:
+            self.chunks.move_to_end(key)
+            return cached[1]
+        gw, gh = self.grid_size
+        surface = pygame.Surface(((x2 - x1) * gw, (y2 - y1) * gh), pygame.SRCALPHA).convert_alpha()
+        for y in range(y1, y2):
+            for x in range(x1, x2):
+                if dark and not level.is_explored(x, y):
                     c = self.unknown_tile
-                if not dark and not map_tile.explored:
-                    map_tile.explored = True # only dungeon Tile instances can have attribute explored
-                self.tile_blit(c, x, y)
-                # --- immobiles (shop, stair... ) #
-                for o in [o for o in Game.objects.values() if
-                          isinstance(o, Immobile) and o.z == z and
-                          o.x == x and o.y == y]:
-                    #print(dark)
-                    c = o.images[dark]
-                    if dark and not map_tile.explored:
-                            continue # skip
-                    self.tile_blit(c, x, y)
-                # ----- items (arrows, gold etc)---
-                for o in [o for o in Game.objects.values() if
-                          isinstance(o, Item) and o.z == z and
-                          o.x == x and o.y == y]:
-                    c = o.images[dark]
-                    if dark and not map_tile.explored:
-                        continue
-                    self.tile_blit(c, x, y)
+                else:
+                    images = level.tile(x, y).images[dark]
+                    c = images[level.decoration(x, y) % len(images)]
+                surface.blit(c, ((x - x1) * gw, (y - y1) * gh))
+        for x, y, images in immobiles:
+            if dark and not level.is_explored(x, y):
+                continue
+            surface.blit(images[dark], ((x - x1) * gw, (y - y1) * gh))
+        self.chunks[key] = (signature, surface)
+        if len(self.chunks) > Viewer.chunk_cache_size:
+            self.chunks.popitem(last=False)  # forget the least recently used chunk
+        return surface
+
+    def draw_dungeon(self, rect=None):
+        """blits the dark version of all chunks inside the game screen (see chunk_surface), then
+           the lit tiles (inside torch radius and field of view) out of the lit version of the
+           chunks near the player, row by row, then items and monsters.
+           rect: paint only this part (pixel) of the game screen, background included.
+           Without rect the whole game screen, the caller has to blit the background"""
+        game_screen = pygame.Rect(0, 0, Viewer.width - Viewer.panel_width, Viewer.height - Viewer.log_height)
+        if rect is None:
+            rect = game_screen
+            x1, y1, x2, y2 = self.visible_tiles()
+        else:
+            rect = pygame.Rect(rect).clip(game_screen)
+            self.screen.blit(self.background, rect, rect)
+            x1, y1, x2, y2 = self.tiles_in_rect(rect)
+        z = self.game.player.z
+        px, py = self.game.player.x, self.game.player.y
+        level = Game.dungeon[z]
+        radius = Game.torch_radius
+        radius_squared = radius ** 2
+        cs = Viewer.chunk_size
+        gw, gh = self.grid_size
+        objects = Game.objects
+        immobiles = collections.defaultdict(list)  # {(chunk x, chunk y): [(x, y, images), ...]}
+        for n in objects.select(Immobile, z):
+            o = objects[n]
+            images = Shop.images_closed if isinstance(o, Shop) and o.closed else o.images
+            immobiles[(o.x // cs, o.y // cs)].append((o.x, o.y, images))
+        # only inside the game screen (or rect), not below the panel or the log
+        self.screen.set_clip(rect)
+        # ---- dark (or unexplored) dungeon tiles ----
+        for cy in range(y1 // cs, (y2 - 1) // cs + 1 if y1 < y2 and x1 < x2 else 0):
+            for cx in range(x1 // cs, (x2 - 1) // cs + 1):
+                c = self.chunk_surface(level, z, cx, cy, True, tuple(immobiles.get((cx, cy), ())))
+                self.screen.blit(c, self.tile_to_pixel((cx * cs, cy * cs)))
+        # ---- lit tiles: inside torch radius of player and visible ----
+        lx1, ly1 = max(x1, px - radius), max(y1, py - radius)
+        lx2, ly2 = min(x2, px + radius + 1), min(y2, py + radius + 1)
+        cells = Game.fov_map.cells
+        for cy in range(ly1 // cs, (ly2 - 1) // cs + 1 if ly1 < ly2 and lx1 < lx2 else 0):
+            for cx in range(lx1 // cs, (lx2 - 1) // cs + 1):
+                c = self.chunk_surface(level, z, cx, cy, False, tuple(immobiles.get((cx, cy), ())))
+                # the part of the chunk inside the torch square
+                ax1, ay1 = max(lx1, cx * cs), max(ly1, cy * cs)
+                ax2, ay2 = min(lx2, cx * cs + cs), min(ly2, cy * cs + cs)
+                width, height = ax2 - ax1, ay2 - ay1
+                mask = bytearray(width * height)  # the fov mask: one byte per tile, 1 if lit
+                for y in range(ay1, ay2):
+                    for x in range(ax1, ax2):
+                        if (x - px) ** 2 + (y - py) ** 2 <= radius_squared and cells[y * level.width + x]:
+                            mask[(y - ay1) * width + x - ax1] = 1
+                # blit each run of lit tiles in a row of the mask at once
+                for row in range(height):
+                    start = mask.find(1, row * width, (row + 1) * width)
+                    while start != -1:
+                        end = mask.find(0, start, (row + 1) * width)
+                        if end == -1:
+                            end = (row + 1) * width
+                        x, y = ax1 + start - row * width, ay1 + row
+                        area = ((x - cx * cs) * gw, (y - cy * cs) * gh, (end - start) * gw, gh)
+                        self.screen.blit(c, self.tile_to_pixel((x, y)), area)
+                        start = mask.find(1, end, (row + 1) * width)
+        # ----- items (arrows, gold etc)---
+        for n in objects.select(Item, z):
+            x, y = objects.x[n], objects.y[n]
+            if not (x1 <= x < x2 and y1 <= y < y2):
+                continue
+            dark = (x - px) ** 2 + (y - py) ** 2 > radius_squared or not Game.fov_map.visible(x, y)
+            if dark and not level.is_explored(x, y):
+                continue
+            self.tile_blit(objects[n].images[dark], x, y)
         # ------- now the monsters on top of all, -----
         # -- whole dungeon has to be already be painted, because
-        # sometimes monster are bigger than tiles
-        self.draw_all_monsters()
+        # sometimes monster are bigger than tiles: monsters left of and above x1, y1 reach into rect
+        self.draw_all_monsters((x1 - 1, y1 - 1, x2, y2))
+        self.screen.set_clip(None)
 
-    def draw_all_monsters(self):
+    def draw_all_monsters(self, tiles=None):
+        """tiles: x1, y1, x2, y2 (see visible_tiles) of the tiles to look for monsters, default all visible tiles"""
         z = self.game.player.z
         px, py = self.game.player.x, self.game.player.y
-        # first, draw dungeon tiles (walls and floors)
-        for y, line in enumerate(Game.dungeon[z]):
-            for x, map_tile in enumerate(line):
-                distance = ((x - px) ** 2 + (y - py) ** 2) ** 0.5
-                if distance > Game.torch_radius or not Game.fov_map[y][x]:
-                    continue # no monsters visible in the darkdark = True # 1
-                # it is not dark here
-                for o in [o for o in Game.objects.values() if
-                     isinstance(o, Monster) and o.hitpoints > 0 and
-                     o.z == z and o.x == x and o.y == y]:
-                    # TODO: use sprites here (with animation) instead of tiles
-                    c = o.images[o.look_direction]
-                    self.tile_blit(c, x,y)
+        radius_squared = Game.torch_radius ** 2
+        x1, y1, x2, y2 = self.visible_tiles() if tiles is None else tiles
+        objects = Game.objects
+        xs, ys, hitpoints, look_directions = objects.x, objects.y, objects.hitpoints, objects.look_direction
+        # walk over the monster columns of this level, not over every tile of the screen
+        for n in objects.select(Monster, z):
+            x, y = xs[n], ys[n]
+            if hitpoints[n] <= 0 or not (x1 <= x < x2 and y1 <= y < y2):
+                continue  # dead or outside the game screen
+            if (x - px) ** 2 + (y - py) ** 2 > radius_squared or not Game.fov_map.visible(x, y):
+                continue  # no monsters visible in the dark
+            # TODO: use sprites here (with animation) instead of tiles
+            c = objects.classes[objects.kind[n] - 1].images[look_directions[n]]
+            self.tile_blit(c, x, y)
+
+    def update_dungeon(self):
+        """paints the game screen again after the game has changed, also into spriteless_background,
+           and returns a list of rects that have changed on screen.
+           Only dirty tiles are painted: tiles where objects came, went or changed their look
+           (see SpatialIndex.changed), the difference of the field of view (tiles that became
+           lit or dark) and newly explored tiles. If the player has moved, the old picture is
+           scrolled and the strips that scrolled into the game screen are painted.
+           Everything is painted if the level, its tiles or the wall and floor theme have changed"""
+        z, px, py = self.game.player.z, self.game.player.x, self.game.player.y
+        gw, gh = self.grid_size
+        game_screen = pygame.Rect(0, 0, Viewer.width - Viewer.panel_width, Viewer.height - Viewer.log_height)
+        changed = Game.spatial.changed
+        Game.spatial.changed = set()
+        lit = self.lit_tiles()
+        drawn, self.drawn = self.drawn, (z, Game.map_versions.get(z, 0), px, py)
+        dirty = lit ^ self.lit
+        self.lit = lit
+        level = Game.dungeon[z]
+        explored, self.explored = self.explored, bytes(level.explored)
+        if (changed is None or drawn is None or drawn[:2] != self.drawn[:2] or
+                abs(px - drawn[2]) * gw >= game_screen.width or abs(py - drawn[3]) * gh >= game_screen.height):
+            self.screen.blit(self.background, (0, 0))
+            self.draw_dungeon()
+            self.spriteless_background.blit(self.screen, game_screen, game_screen)
+            return [pygame.Rect(0, 0, Viewer.width, Viewer.height)]
+        # explored while travelling, so neither lit now nor at the last redraw
+        x1, y1, x2, y2 = self.visible_tiles()
+        for y in range(y1, y2):
+            start, end = y * level.width + x1, y * level.width + x2
+            if explored[start:end] != self.explored[start:end]:
+                dirty.update((x, y) for x in range(x1, x2) if explored[start + x - x1] != self.explored[start + x - x1])
+        dirty.update((x, y) for x, y, tz in changed if tz == z)
+        rects = []
+        dx, dy = px - drawn[2], py - drawn[3]
+        if dx != 0 or dy != 0:
+            self.spriteless_background.subsurface(game_screen).scroll(-dx * gw, -dy * gh)
+            self.screen.blit(self.spriteless_background, game_screen, game_screen)
+            # the strips of the game screen that need new tiles
+            if dx > 0:
+                rects.append(pygame.Rect(game_screen.width - dx * gw, 0, dx * gw, game_screen.height))
+            elif dx < 0:
+                rects.append(pygame.Rect(0, 0, -dx * gw, game_screen.height))
+            if dy > 0:
+                rects.append(pygame.Rect(0, game_screen.height - dy * gh, game_screen.width, dy * gh))
+            elif dy < 0:
+                rects.append(pygame.Rect(0, 0, game_screen.width, -dy * gh))
+        # the dirty tiles of each chunk together in one rect
+        cs = Viewer.chunk_size
+        chunks = {}  # {(chunk x, chunk y): [x1, y1, x2, y2]}
+        for x, y in dirty:
+            box = chunks.setdefault((x // cs, y // cs), [x, y, x, y])
+            box[:] = min(box[0], x), min(box[1], y), max(box[2], x), max(box[3], y)
+        for x1, y1, x2, y2 in chunks.values():
+            left, top = self.tile_to_pixel((x1, y1))
+            rect = pygame.Rect(left, top, (x2 - x1 + 1) * gw + self.overhang[0], (y2 - y1 + 1) * gh + self.overhang[1])
+            if rect.colliderect(game_screen):
+                rects.append(rect.clip(game_screen))
+        for rect in rects:
+            self.draw_dungeon(rect)
+            self.spriteless_background.blit(self.screen, rect, rect)
+        return [game_screen] if dx != 0 or dy != 0 else rects
+
+    def radar_image(self):
+        """returns the radar picture (not scaled, one pixel per tile) of the tiles around the player:
+           an 8 bit surface with Viewer.radar_colors as palette. Built row by row from the tiles and
+           explored flags of the level, then the objects are stamped in from Game.objects"""
+        z, px, py = self.game.player.z, self.game.player.x, self.game.player.y
+        level = Game.dungeon[z]
+        delta = int(self.panel_width / 2 // self.radarblipsize)
+        size = 2 * delta + 1
+        pixels = bytearray(size * size)  # 0: not explored or outside of the level
+        x1, x2 = max(0, px - delta), min(level.width, px + delta + 1)
+        for y in range(max(0, py - delta), min(level.height, py + delta + 1)):
+            start = y * level.width
+            colors = level.tiles[start + x1:start + x2].translate(Viewer.radar_tiles)
+            explored = level.explored[start + x1:start + x2].translate(Viewer.radar_explored)
+            # keep the color of explored tiles only, with python's (fast) large integers
+            colors = int.from_bytes(colors, "little") & int.from_bytes(explored, "little")
+            i = (y - py + delta) * size + x1 - px + delta
+            pixels[i:i + x2 - x1] = colors.to_bytes(x2 - x1, "little")
+        objects = Game.objects
+        xs, ys = objects.x, objects.y
+        player = self.game.player
+        for cls, color, sniffrange in ((StairDown, 3, None), (StairUp, 4, None), (Shop, 5, None),
+                                       (Item, 6, player.sniffrange_items), (Monster, 7, player.sniffrange_monster)):
+            for n in objects.select(cls, z):
+                x, y = xs[n], ys[n]
+                if abs(x - px) > delta or abs(y - py) > delta:
+                    continue
+                if sniffrange is None:
+                    if not level.is_explored(x, y):
+                        continue
+                elif not Game.fov_map.visible(x, y) and (x - px) ** 2 + (y - py) ** 2 >= sniffrange ** 2:
+                    continue
+                pixels[(y - py + delta) * size + x - px + delta] = color
+        image = pygame.image.frombuffer(bytes(pixels), (size, size), "P")
+        image.set_palette(Viewer.radar_colors)
+        return image
 
     def draw_radar(self):
+        # the radar picture only changes when the game changes, scale it only then
+        key = (self.game.turn, self.game.player.z, self.game.player.x, self.game.player.y, len(Game.objects),
+               Game.fov_map, self.radarblipsize)
+        if key != self.radar_key:
+            self.radar_key = key
+            image = self.radar_image()
+            self.radar_scaled = pygame.transform.scale(image, (image.get_width() * self.radarblipsize,
+                                                               image.get_height() * self.radarblipsize))
         # make black square in top of panel
-        self.radarscreen.fill((10, 10, 10))  # clear radarscreen
-        delta_tiles = int(self.panel_width / 2 // self.radarblipsize)
-        # make a radar blit for each explored dungeong tile
-        for x in range(self.game.player.x - delta_tiles, self.game.player.x + delta_tiles + 1):
-            if x < 0:
-                continue
-            for y in range(self.game.player.y - delta_tiles, self.game.player.y + delta_tiles + 1):
-                if y < 0:
-                    continue
-                distance = ((x - self.game.player.x) ** 2 + (y - self.game.player.y) ** 2) ** 0.5
-                try:
-                    t = Game.dungeon[self.game.player.z][y][x]
-                except:
-                    continue
-                color = (10, 10, 10)  # black
-                dx = -(x - self.game.player.x) * self.radarblipsize
-                dy = -(y - self.game.player.y) * self.radarblipsize
-                if t.explored:
-                    if t.block_movement:
-                        color = (50, 50, 250)  # blue wall
-                    else:
-                        color = (150, 150, 150)  # light grey corridor
-                    # pygame.draw.rect(self.radarscreen, color,
-                    #                 (self.rcx - dx, self.rcy - dy, self.radarblipsize, self.radarblipsize))
-                # ---if a stair is there, paint it (if explored) ---
-                for o in Game.objects.values():
-                    if o.z == self.game.player.z and o.y == y and o.x == x:
-                        if Game.dungeon[self.game.player.z][y][x].explored:
-                            if isinstance(o, StairDown):
-                                color = (128, 255, 128)
-                            elif isinstance(o, StairUp):
-                                    color = (64, 255, 64)
-                            elif isinstance(o, Shop):
-                                color = (200, 200, 200)
-                        if isinstance(o, Item):
-                            if Game.fov_map[y][x] or distance < self.game.player.sniffrange_items:
-                                color = (0, 200, 0)
-                        elif isinstance(o, Monster):
-                            if Game.fov_map[y][x] or distance < self.game.player.sniffrange_monster:
-                                color = (255, 0, 0)
-
-                pygame.draw.rect(self.radarscreen, color,
-                                 (self.rcx - dx, self.rcy - dy, self.radarblipsize, self.radarblipsize))
+        self.radarscreen.fill(Viewer.radar_colors[0])  # clear radarscreen
+        delta = int(self.panel_width / 2 // self.radarblipsize)
+        self.radarscreen.blit(self.radar_scaled, (self.rcx - delta * self.radarblipsize,
+                                                  self.rcy - delta * self.radarblipsize))
         # make withe glowing dot at center of radarmap
-        white = random.randint(200, 255)
+        white = rng.cosmetic.randint(200, 255)
         color = (white, white, white)
         pygame.draw.rect(self.radarscreen, color, (self.rcx, self.rcy, self.radarblipsize, self.radarblipsize))
         # blit radarscreen on screen
@@ -2337,7 +1372,7 @@ class Viewer():
         # -y65 ----------------------
         self.panelscreen.blit(self.goldstack_image, (5,65))
         write(self.panelscreen, text="   {}".format(
-            self.game.player.gold), x=5, y=65, color=(255, 255, 0), font_size=24)
+            self.game.player.gold - Viewer.gold_in_flight), x=5, y=65, color=(255, 255, 0), font_size=24)
 
         # --- write cursor information into panel ---
         # - y95 ------
@@ -2345,29 +1380,30 @@ class Viewer():
         tilex, tiley = Game.cursor_x,  Game.cursor_y
         ##print("cursor is at ", tilex, tiley, "=", self.tile_to_pixel(tilex, tiley))
         ##print("tile:", tilex, tiley)
-        t = Game.dungeon[self.game.player.z][tiley][tilex]
+        t = Game.dungeon[self.game.player.z].tile(tilex, tiley)
+        explored = Game.dungeon[self.game.player.z].is_explored(tilex, tiley)
 
         write(self.panelscreen, text="x:{} y:{} turn:{}".format(tilex, tiley, self.game.turn), x=5, y=95,
               color=(255, 255, 255),
               font_size=16)
         # tile information
         # - y115
-        write(self.panelscreen, text=t.__class__.__name__ if t.explored else "not yet explored", x=5, y=115,
+        write(self.panelscreen, text=t.__class__.__name__ if explored else "not yet explored", x=5, y=115,
               color=(255, 255, 255), font_size=16)
         # objects on top of that tile ?
         here = []
         hints = []
-        if t.explored:
-            for o in Game.objects.values():
+        if explored:
+            for o in Game.spatial.at(tilex, tiley, self.game.player.z):
                 # print("object:",o)
-                if o.z == self.game.player.z and o.x == tilex and o.y == tiley and o.hitpoints > 0:
+                if o.hitpoints > 0:
                     if not isinstance(o, Monster):
                         here.append(o)
                         if o.hint is not None:
                             hints.append(o.hint)
                     else:
                         # monster only if inside fov
-                        if Game.fov_map[o.y][o.x]:
+                        if Game.fov_map.visible(o.x, o.y):
                             here.append(o)
                             if o.hint is not None:
                                 hints.append(o.hint)
@@ -2426,34 +1462,24 @@ class Viewer():
         # ---- blit logscreen ------
         self.screen.blit(self.logscreen, (0, Viewer.height - self.log_height))
 
-    def new_turn_in_Viewer(self):
-        """new turn in Viewer, calls new turn in Game and updates graphics that may have changed, plays animations etc"""
-        # all shooters (except player) shoot their arrows at the same time
-
-        for monster in [o for o in Game.objects.values() if
-                        o != self.game.player and o.z == self.game.player.z and
-                        isinstance(o, Monster) and o.shoot_arrows and o.hitpoints>0]:
-            # calculate distance to player
-            distance = ((monster.x - self.game.player.x) ** 2 + (monster.y - self.game.player.y) ** 2) ** 0.5
-            # monster shoots at you if it can, player is in shooting range and player sees monster
-            if Game.fov_map[monster.y][monster.x] and distance < monster.fighting_range:
-                ## FlyObject (start, end)
-                end, victimpos = self.game.other_arrow((monster.x, monster.y),
-                                                    (self.game.player.x, self.game.player.y), object="fire")
-                start = self.tile_to_pixel((monster.x, monster.y), center=True)
+    def handle_events(self, events):
+        """called from Game.flush_events: starts the animations for all visual effects
+           the game has emitted, and plays them before the game continues"""
+        for name, data in events:
+            if name == "monster missile":
+                start = self.tile_to_pixel(data["start"], center=True)
                 # decide tpye of flying object
-                if isinstance(monster, Dragon):
+                if data["shooter"] == "Dragon":
                     flyclass = DragonFireSprite
-                if isinstance(monster, Yeti):
+                elif data["shooter"] == "Yeti":
                     flyclass = IceBallSprite
-                if isinstance(monster, Snake):
+                else:
                     flyclass = PoisonSpitSprite
-                #a = IceBallSprite(startpos=start, endpos=self.tile_to_pixel(end, center=True))
-                a = flyclass(startpos=start, endpos=self.tile_to_pixel(end, center=True))
+                a = flyclass(startpos=start, endpos=self.tile_to_pixel(data["end"], center=True))
                 if self.playtime + a.duration > self.animation:
                     self.animation = self.playtime + a.duration
                 # make a explosion on impact (at the player)
-                if len(victimpos) > 0:
+                if len(data["victims"]) > 0:
                     self.explosion_at_tile(startpos=(self.game.player.x, self.game.player.y),
                                            color=a.explosion_color,
                                            minspeed=a.explosion_minspeed,
@@ -2461,21 +1487,107 @@ class Viewer():
                                            frags=a.explosion_frags,
                                            duration = a.explosion_duration,
                                            age=-a.duration)
-        
+            elif name in ("arrow", "magic missile", "fireball"):
+                flyclass = {"arrow": ArrowSprite, "magic missile": MagicMissileSprite,
+                            "fireball": FireBallSprite}[name]
+                a = flyclass(startpos=self.tile_to_pixel(data["start"], center=True),
+                             endpos=self.tile_to_pixel(data["end"], center=True))
+                self.animation = self.playtime + a.duration
+                if name != "arrow":  # todo arrow victim impact animation
+                    for victimpos in data["victims"]:
+                        self.explosion_at_tile(victimpos, age=-a.duration)
+            elif name == "heal":
+                self.start_healing_sprites()
+            elif name == "bleed":
+                # play blood animation for 1 second at victimtile
+                duration = 0.45
+                BleedingSprite(pos=pygame.math.Vector2(self.tile_to_pixel(data["pos"], center=False)),
+                               max_age=duration, zoom_delta = 0.1)
+                self.animation = self.playtime + duration
+            elif name == "blink":
+                BlinkSprite(pos=pygame.math.Vector2(self.tile_to_pixel(data["start"])), zoom_delta = -0.008, max_age=2) # shrink
+                BlinkSprite(pos=pygame.math.Vector2(self.tile_to_pixel(data["end"])) +
+                                pygame.math.Vector2(Viewer.grid_size[0], 0),
+                            zoom_delta= 0.005, max_age=1.4)
+            elif name == "gold":
+                # the gold is already in the players pocket, but the panel shows it only after the gold-fly animation
+                Viewer.gold_in_flight += data["value"]
+                for _ in range(data["value"]):
+                    GoldSprite(pos=pygame.math.Vector2(self.tile_to_pixel(data["pos"], center=True)))
+            elif name == "level":
+                self.wall_and_floor_theme() # new walls and floor colors
         self.animate_sprites_only()
-        #self.draw_panel()  # to update player hitpoints
-        old_gold = self.game.player.gold
-        self.game.new_turn()
-        
-        delta_gold = self.game.player.gold - old_gold
-        if delta_gold > 0:
-            self.explosion_at_tile(startpos=(self.game.player.x, self.game.player.y),
-                                     frags=delta_gold, minspeed=10, maxspeed=50, gravity="gold")
         self.redraw = True
-        # self.redraw = True
+
+    def act(self, action, *args):
+        """let the game do one action (see Game.step) and redraw the screen afterwards.
+           Does nothing while a replay is playing"""
+        if self.replay_actions is not None:
+            return None
+        result = self.game.step(action, *args)
+        self.redraw = True
+        return result
+
+    def play_replay(self):
+        """let the game do the next action of the replay, if it is time for it"""
+        if self.replay_actions is None or self.playtime < self.replay_time:
+            return
+        for action, args in self.replay_actions:
+            self.game.step(action, *args)
+            break
+        else:
+            self.replay_actions = None  # the player can continue the game
+            Game.log.append("end of replay")
+        self.replay_time = self.playtime + Viewer.replay_delay
+        self.redraw = True
+
+    def update_sprites(self, seconds):
+        """remove all sprites and explosion fragments from the screen, then move them"""
+        self.allgroup.clear(self.screen, self.spriteless_background)
+        Viewer.particles.clear(self.screen, self.spriteless_background)
+        self.allgroup.update(seconds)
+        Viewer.particles.update(seconds)
+
+    def draw_sprites(self):
+        """draw all explosion fragments and sprites, returns the rects that have changed"""
+        return Viewer.particles.draw(self.screen) + self.allgroup.draw(self.screen)
+
+    def draw_metrics(self):
+        """draw the p50/p95/p99 durations of all sections the profiler has measured (see Profiler)
+           in the top left corner. The picture is updated only every metrics_interval seconds.
+           returns the rect of the overlay"""
+        if self.metrics_image is None or self.playtime >= self.metrics_time:
+            lines = ["{:<26}{:>6}{:>8}{:>8}{:>8}".format("section (ms)", "count", "p50", "p95", "p99")]
+            for name, row in profiler.stats().items():
+                lines.append("{:<26}{:>6}{:>8.2f}{:>8.2f}{:>8.2f}".format(
+                    name[:25], row["count"], row["p50_ms"], row["p95_ms"], row["p99_ms"]))
+            font = get_font("mono", 14)
+            h = font.get_linesize()
+            self.metrics_image = pygame.Surface((max(font.size(line)[0] for line in lines) + 10,
+                                                 h * len(lines) + 10))
+            for i, line in enumerate(lines):
+                self.metrics_image.blit(font.render(line, True, (255, 255, 255)), (5, 5 + i * h))
+            self.metrics_time = self.playtime + self.metrics_interval
+        return self.screen.blit(self.metrics_image, (0, 0))
+
+    def hide_metrics(self):
+        """remove the profiler overlay from the screen"""
+        if self.metrics_image is not None:
+            rect = self.metrics_image.get_rect()
+            self.screen.blit(self.spriteless_background, rect, rect)
+            pygame.display.update(rect)
+        self.show_metrics = False
+
+    def export_metrics(self):
+        """write the profiler stats into Viewer.metrics_file"""
+        profiler.export(Viewer.metrics_file)
+        Game.log.append("profiler stats written to {}".format(Viewer.metrics_file))
+        self.redraw = True
 
     def animate_sprites_only(self):
         """loop as long as necessary to finish all animations, before coninuing with main loop"""
+        if Viewer.skip_animations:
+            return
         while self.animation > self.playtime:
             milliseconds = self.clock.tick(self.fps)  #
             seconds = milliseconds / 1000
@@ -2489,9 +1601,8 @@ class Viewer():
                     if event.key == pygame.K_ESCAPE:
                         return # running = False
 
-            self.allgroup.clear(self.screen, self.spriteless_background)
-            self.allgroup.update(seconds)
-            self.allgroup.draw(self.screen)
+            self.update_sprites(seconds)
+            self.draw_sprites()
             #self.draw_panel() # TODO: remove? Fragments destroy panel otherwise. making area for Fragment sprite?
             pygame.display.update()
 
@@ -2503,7 +1614,6 @@ class Viewer():
         self.game.make_fov_map()
         self.redraw = True
         # exittime = 0
-        self.spriteless_background = pygame.Surface((Viewer.width-Viewer.panel_width, Viewer.height))
         # fill panel color into spriteless background
         #pygame.draw.rect(self.spriteless_background,(64, 128, 64), (self.width-self.panel_width,
         #                                                            self.panel_width, self.panel_width,
@@ -2512,7 +1622,6 @@ class Viewer():
         self.screen.blit(self.spriteless_background, (0,0))
         ###    pygame.display.flip()
         show_range = False
-        self.animation = 0  # how many seconds animation should be played until the game accept inputs, new turn etc again
         reset_cursor = True
         log_lines = len(Game.log)
         while running:
@@ -2533,6 +1642,8 @@ class Viewer():
                 running = False
             milliseconds = self.clock.tick(self.fps)  #
             seconds = milliseconds / 1000
+            if profiler.enabled:
+                profiler.add("frame", seconds)
             # --- redraw whole screen if animation has ended ----
             # if animation > self.playtime and animation < (self.playtime + seconds):
             #    self.redraw = True
@@ -2593,110 +1704,55 @@ class Viewer():
                     if event.mod & pygame.KMOD_CTRL:  # any or both ctrl keys are pressed
                         key = pygame.key.name(event.key)  # name of event key: a, b, c etc.
                         spell = self.game.player.spell_from_key(key)  # get the spell that is currently bond to this key
-                        result =  self.game.cast(spell)  # sucessfull casting -> new turn
-                        # --- spell animations ----
-                        if spell == "magic missile":
-                            end, victimposlist = result
-                            a = MagicMissileSprite(startpos=(self.pcx+Viewer.grid_size[0]//2,
-                                                      self.pcy+Viewer.grid_size[1]//2), endpos=self.tile_to_pixel(end, center=True))
-                            self.animation = self.playtime + a.duration
-                            if len(victimposlist) > 0:
-                                for victimpos in victimposlist:
-                                    self.explosion_at_tile(victimpos, age=-a.duration)
-                            self.animate_sprites_only()
-                        elif spell == "fireball":
-                            end, victimposlist = result
-                            a = FireBallSprite(startpos=(self.pcx+Viewer.grid_size[0]//2,
-                                                      self.pcy+Viewer.grid_size[1]//2), endpos=self.tile_to_pixel(end, center=True))
-                            self.animation = self.playtime + a.duration
-                            if len(victimposlist) > 0:
-                                for victimpos in victimposlist:
-                                    self.explosion_at_tile(victimpos, age=-a.duration)
-                            self.animate_sprites_only()
-                        elif spell == "heal":
-                            if result:
-                                self.start_healing_sprites()
-
-                        elif spell == "bleed":
-                            if result:
-                                # play blood animation for 1 second at victimtile (result)
-                                duration = 0.45
-                                BleedingSprite(pos=pygame.math.Vector2(self.tile_to_pixel(result, center=False)), max_age=duration, zoom_delta = 0.1)
-                                self.animation = self.playtime + duration
-                                self.animate_sprites_only()
-
-                        elif spell == "blink":
-                            if result: # result old position
-                                BlinkSprite(pos=pygame.math.Vector2(self.tile_to_pixel(result)), zoom_delta = -0.008, max_age=2) # shrink
-                                BlinkSprite(pos=pygame.math.Vector2(self.pcx+Viewer.grid_size[0], self.pcy), zoom_delta= 0.005,
-                                            max_age=1.4)
-
-                        if result:
-                            self.new_turn_in_Viewer()
+                        self.act("cast", spell, Game.cursor_x, Game.cursor_y)  # sucessfull casting -> new turn
                     # --- end of spellcasting, no CTRL key is pressed ---
                     else:
 
                         # ---- -simple player movement with cursor keys -------
                         if event.key in (pygame.K_RIGHT, pygame.K_KP6):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(1, 0)
+                            self.act("move", 1, 0)
 
                         if event.key in (pygame.K_LEFT, pygame.K_KP4):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(-1, 0)
+                            self.act("move", -1, 0)
 
                         if event.key in (pygame.K_UP, pygame.K_KP8):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(0, -1)
+                            self.act("move", 0, -1)
 
                         if event.key in (pygame.K_DOWN, pygame.K_KP2):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(0, 1)
+                            self.act("move", 0, 1)
 
                         # --- diagonal movement ---
                         if event.key in (pygame.K_KP7, pygame.K_HOME):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(-1, -1)
+                            self.act("move", -1, -1)
 
                         if event.key in (pygame.K_KP9, pygame.K_PAGEUP):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(1, -1)
+                            self.act("move", 1, -1)
 
                         if event.key in (pygame.K_KP1, pygame.K_END):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(-1, 1)
+                            self.act("move", -1, 1)
 
                         if event.key in (pygame.K_KP3, pygame.K_PAGEDOWN):
-                            self.new_turn_in_Viewer()
-                            self.game.move_player(1, 1)
+                            self.act("move", 1, 1)
 
                         if event.key == pygame.K_SPACE:
-                            # Game.turn += 1  # wait a turn
-                            if self.game.shopping():
-                                 self.start_healing_sprites()
-                            self.new_turn_in_Viewer()
-
+                            # wait a turn or go shopping
+                            self.act("wait")
 
                         if event.key == pygame.K_f:
                             # fire arrow to cursor
-                            end, victimpos = self.game.player_arrow()  # None , None, None  when player can not shoot, otherwise startpos, endpos, victim
-                            if end is not None:
-                                a = ArrowSprite(startpos=(self.pcx+Viewer.grid_size[0]//2,
-                                                          self.pcy+Viewer.grid_size[1]//2),
-                                                endpos=self.tile_to_pixel(end, center=True))
-                                self.animation = self.playtime + a.duration
-                                if len(victimpos) > 0:
-                                    pass  # todo victim impact animation
-
-                                self.animate_sprites_only()
-                                self.new_turn_in_Viewer()
+                            self.act("fire", Game.cursor_x, Game.cursor_y)
+
+                        if event.key == pygame.K_t:
+                            # travel to cursor, without animation for each step
+                            self.act("travel", Game.cursor_x, Game.cursor_y)
+
+                        if event.key == pygame.K_x:
+                            # auto-explore until something interesting happens
+                            self.act("explore")
 
                         if event.key in (pygame.K_LESS, pygame.K_GREATER):
-                            self.new_turn_in_Viewer()
-                            # go up a level
-                            if self.game.use_stairs():
-                                self.redraw = True
-                                self.wall_and_floor_theme() # new walls and floor colors
+                            # go up or down a level
+                            self.act("stairs")
                                 #if self.game.player.z == 100:
                                 #    Flytext("You have won", fontsize=64, color=(230,230,25),
                                 #            pos=pygame.math.Vector2(400,400),
@@ -2705,9 +1761,6 @@ class Viewer():
                                 #    self.animate_sprites_only()
                                 #    Game.game_over = True
 
-
-
-
                         if event.key == pygame.K_PLUS:
                             if event.mod & pygame.KMOD_SHIFT:
                                 # zoom out radar
@@ -2717,9 +1770,7 @@ class Viewer():
                                 self.redraw = True
                             else:
                                 # more torch radius
-                                Game.torch_radius += 1
-                                self.game.make_fov_map()
-                                self.redraw = True
+                                self.act("torch", 1)
 
 
                         if event.key == pygame.K_MINUS:
@@ -2730,9 +1781,34 @@ class Viewer():
                                 self.redraw = True
                             else:
                                 # --- decrease torch radius ----
-                                Game.torch_radius -= 1
-                                self.game.make_fov_map()
-                                self.redraw = True
+                                self.act("torch", -1)
+
+                        if event.key == pygame.K_v:
+                            # --- switch to next field of view algorithm, for comparison ----
+                            names = list(FOV_ALGORITHMS)
+                            self.act("fov", names[(names.index(Game.fov_algorithm) + 1) % len(names)])
+
+                        if event.key == pygame.K_F3:
+                            # --- start or stop the profiler and its overlay ----
+                            if profiler.enabled:
+                                profiler.disable()
+                                self.hide_metrics()
+                            else:
+                                profiler.enable()
+                                self.show_metrics = True
+                                self.metrics_image = None
+
+                        if event.key == pygame.K_F4 and profiler.enabled:
+                            # --- snapshot of the profiler stats ----
+                            self.export_metrics()
+
+                        if event.key == pygame.K_F5:
+                            # --- save the game, continue later with --load ----
+                            self.game.save(Viewer.savegame)
+                            Game.log.append("game saved in {}".format(Viewer.savegame))
+                            self.redraw = True
+
+            self.play_replay()
 
             # --- set cursor to mouse if inside play area -----
             x,y =  self.pixel_to_tile(pygame.mouse.get_pos())
@@ -2743,51 +1819,30 @@ class Viewer():
             # screen_without_sprites = self.screen.copy()
             # self.allgroup.clear(bgd=self.screen)
 
-            #self.allgroup.clear(self.screen, self.spriteless_background)
-            self.screen.blit(self.spriteless_background, (0,0) ) # NOTICE: out-comment this line for very cool effect at goldexplosion
-            self.allgroup.update(seconds)
+            # remove the sprites of the last frame (only where they have been) and move them
+            self.update_sprites(seconds)
 
             dirtyrects = []
 
-            if len(self.allgroup) >1:
-                self.draw_radar()
-                #self.draw_panel()  # always draw panel #über allgropu draw: münzen sichtbar,  flackert
-                # append radar and panel to dirtyrects
-                #dirtyrects.append(pygame.Rect(Viewer.width-Viewer.panel_width, 0, Viewer.panel_width, Viewer.height))
-            self.draw_panel()  # always draw panel #unter allgropu draw: münzen unsichtbar, flackert
-            dirtyrects.append(pygame.Rect(Viewer.width - Viewer.panel_width, 0, Viewer.panel_width, Viewer.height))
-            dirtyrects.extend(self.allgroup.draw(self.screen))
-
-
             if self.redraw:
-                #print(self.pixel_to_tile(pygame.mouse.get_pos()))
-                #if self.pixel_to_tile(pygame.mouse.get_pos()) is not (None, None) and reset_cursor:
-
-                    #if reset_cursor and
-                #    Game.cursor_x, Game.cursor_y = 0, 0
-                #reset_cursor = True
-                # delete everything on screen
-                self.screen.blit(self.background, (0, 0))
                 # --- order of drawing (back to front) ---
-                self.draw_dungeon()
-
+                # only the tiles that have changed since the last turn, see update_dungeon
+                dirtyrects.extend(self.update_dungeon())
+            if self.redraw or len(self.allgroup) > 1 or len(Viewer.particles) > 0:
                 self.draw_radar()
-                dirtyrects.append((0, 0, Viewer.width, Viewer.height))
-                self.draw_panel()
+            if self.redraw or len(Game.log) > log_lines:
                 self.draw_log()
-                self.spriteless_background.blit(self.screen, (0, 0))
-
-            elif len(Game.log) > log_lines:
-                self.draw_log()  # always draw log
                 log_lines = len(Game.log)
-                dirtyrects.append((0, Viewer.height - self.log_height, Viewer.width, self.log_height))
-
-
-            #dirtyrects.append((Viewer.width - self.panel_width, 0, Viewer.panel_width, Viewer.height))
+                log_rect = pygame.Rect(0, Viewer.height - self.log_height, Viewer.width - self.panel_width, self.log_height)
+                self.spriteless_background.blit(self.screen, log_rect, log_rect)  # sprites may fly over the log
+                dirtyrects.append(log_rect)
+            self.draw_panel()  # always draw panel
+            dirtyrects.append(pygame.Rect(Viewer.width - Viewer.panel_width, 0, Viewer.panel_width, Viewer.height))
+            dirtyrects.extend(self.draw_sprites())
+            if self.show_metrics:
+                dirtyrects.append(self.draw_metrics())
 
             self.redraw = False
-            #self.draw_panel()
-
 
             # write text below sprites
             fps_text = "FPS: {:5.3}".format(self.clock.get_fps())
@@ -2807,11 +1862,64 @@ class Viewer():
         # -----------------------------------------------------
         pygame.mouse.set_visible(True)
         pygame.quit()
+        if profiler.enabled:
+            profiler.export(Viewer.metrics_file)
+            print("profiler stats written to", Viewer.metrics_file)
         print("you killed:")
         for v in self.game.player.victims:
             print(v, self.game.player.victims[v])
 
 
+# sections timed by the profiler when it is enabled (see Profiler in roguebasin_engine)
+for _name in ("update_dungeon", "draw_dungeon", "draw_radar", "draw_panel", "draw_log",
+              "update_sprites", "draw_sprites"):
+    profiler.watch(Viewer, _name)
+
+
 if __name__ == '__main__':
-    g = Game(tiles_x=80, tiles_y=40)
-    Viewer(g, width=1200, height=800, grid_size=(32, 32))  # , (35,35))
+    parser = argparse.ArgumentParser(description="roguebasin_python3, a roguelike game")
+    parser.add_argument("--seed", type=int, default=None, help="same seed, same dungeon and same fights")
+    parser.add_argument("--pregenerate", choices=("thread", "process", "none"), default="thread",
+                        help="generate the next dungeon level in advance, in a thread or process")
+    parser.add_argument("--load", metavar="FILE", default=None, help="continue a game saved with F5")
+    parser.add_argument("--record", metavar="FILE", default=None,
+                        help="record the seed and all actions of a new game into FILE (also after a crash)")
+    parser.add_argument("--replay", metavar="FILE", default=None, help="play a game recorded with --record again")
+    parser.add_argument("--fast", action="store_true", help="--replay without waiting for animations")
+    parser.add_argument("--headless", action="store_true",
+                        help="--replay without a window, as fast as possible, and print the result")
+    parser.add_argument("--profile", metavar="FILE", nargs="?", const=Viewer.metrics_file, default=None,
+                        help="time turns and drawing from the start, write the stats (.json or .csv) "
+                             "at the end. F3: profiler on/off with overlay, F4: write stats now")
+    args = parser.parse_args()
+    if args.profile is not None:
+        Viewer.metrics_file = args.profile
+        profiler.enable()
+    if args.load is not None and (args.record is not None or args.replay is not None):
+        parser.error("--record and --replay need a new game, not --load")
+    Game.pregenerate = None if args.pregenerate == "none" else args.pregenerate
+    if args.replay is not None:
+        replay = Replay.load(args.replay)
+        if args.headless:
+            g = replay.play()
+            print("replay finished: turn {}, level {}, hitpoints {}, game over: {}".format(
+                g.turn, g.player.z, g.player.hitpoints, Game.game_over))
+            raise SystemExit
+        g = replay.new_game()
+        Viewer.replay = replay
+        if args.fast:
+            Viewer.replay_delay = 0
+            Viewer.skip_animations = True
+    elif args.load is None:
+        g = Game(tiles_x=80, tiles_y=40, seed=args.seed)
+    else:
+        g = Game.load(args.load)
+        Viewer.savegame = args.load
+    if args.record is not None:
+        Game.replay = Replay.start(g)
+    try:
+        Viewer(g, width=1200, height=800, grid_size=(32, 32))  # , (35,35))
+    finally:
+        if Game.replay is not None:
+            Game.replay.save(args.record)
+            print("replay written to", args.record)
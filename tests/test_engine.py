@@ -0,0 +1,433 @@
+"""tests for roguebasin_engine, the game without pygame. Run them with: python -m pytest"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # the hand-made levels are loaded from the folder data
+
+from roguebasin_engine import (Game, rng, Level, WALL, FLOOR, FOV_ALGORITHMS, shadowcast_fov, Gold,
+                               Item, Monster, StairUp, StairDown, generate_level, read_level_text,
+                               read_level_binary, compile_level, Object, Replay)
+
+
+class HeadlessTest(unittest.TestCase):
+
+    def test_fresh_game_can_step(self):
+        game = Game()
+        turn = game.turn
+        game.step("move", 0, 0)
+        game.step("wait")
+        self.assertIsNotNone(Game.fov_map)
+        self.assertGreater(game.turn, turn)
+
+    def test_engine_prints_nothing(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            game = Game()
+            for _ in range(5):
+                game.step("wait")
+        self.assertEqual(out.getvalue(), "")
+        self.assertTrue(any(line.startswith("level loaded:") for line in Game.log))
+
+    def test_unknown_action(self):
+        game = Game()
+        with self.assertRaises(ValueError):
+            game.step("dance")
+
+
+def small_room():
+    """a 9 x 9 level: a room with a wall pillar at 4,3"""
+    level = Level(9, 9)
+    level.fill_rect(1, 1, 7, 7, FLOOR)
+    level.set_tile(4, 3, WALL)
+    return level
+
+
+class FovTest(unittest.TestCase):
+
+    def test_walls_cast_shadows(self):
+        level = small_room()
+        for name, algorithm in FOV_ALGORITHMS.items():
+            fov_map = algorithm(level, 4, 5, 10)
+            self.assertTrue(fov_map.visible(4, 5), name)
+            self.assertTrue(fov_map.visible(4, 3), name)  # the pillar itself
+            self.assertTrue(fov_map.visible(1, 1), name)
+            self.assertTrue(fov_map.visible(0, 8), name)  # walls of the room
+            self.assertFalse(fov_map.visible(4, 2), name)  # behind the pillar
+            self.assertFalse(fov_map.visible(4, 1), name)
+
+    def test_radius(self):
+        level = small_room()
+        for name, algorithm in FOV_ALGORITHMS.items():
+            fov_map = algorithm(level, 4, 5, 2)
+            self.assertTrue(fov_map.visible(2, 5), name)
+            self.assertFalse(fov_map.visible(1, 5), name)
+            self.assertFalse(fov_map.visible(7, 7), name)
+
+    def test_cache(self):
+        game = Game()
+        fov_map = Game.fov_map
+        game.make_fov_map()
+        self.assertIs(Game.fov_map, fov_map)  # same place, same radius: from Game.fov_cache
+        game.step("torch", -1)
+        self.assertIsNot(Game.fov_map, fov_map)
+        game.step("torch", 1)
+        self.assertIs(Game.fov_map, fov_map)
+
+
+class LevelTest(unittest.TestCase):
+
+    def test_tiles_are_flyweights(self):
+        level = small_room()
+        self.assertIs(level.tile(0, 0), level.tile(4, 3))
+        self.assertTrue(level.tile(4, 3).block_movement)
+        self.assertFalse(level.tile(4, 4).block_movement)
+        self.assertEqual(len(level.tiles), 81)
+        self.assertEqual(level.tiles.count(WALL), 81 - 48)
+
+    def test_explore(self):
+        level = small_room()
+        self.assertFalse(level.is_explored(4, 5))
+        level.explore(shadowcast_fov(level, 4, 5, 10))
+        self.assertTrue(level.is_explored(4, 5))
+        self.assertFalse(level.is_explored(4, 1))
+        level.explore_all()
+        self.assertTrue(level.is_explored(4, 1))
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def test_at_move_and_remove(self):
+        game = Game()
+        gold = Gold(2, 3, 1)
+        self.assertIn(gold, Game.spatial.at(2, 3, 1))
+        self.assertEqual(Game.spatial.at(2, 3, 1, Monster), [o for o in Game.spatial.at(2, 3, 1)
+                                                                if isinstance(o, Monster)])
+        Game.spatial.move(gold, 3, 3, 1)
+        self.assertNotIn(gold, Game.spatial.at(2, 3, 1))
+        self.assertIn(gold, Game.spatial.at(3, 3, 1, Gold))
+        self.assertEqual((gold.x, gold.y, gold.z), (3, 3, 1))
+        self.assertIn(gold, Game.spatial.level(1, Item))
+        gold.kill()
+        self.assertNotIn(gold, Game.spatial.level(1))
+        self.assertEqual(Game.spatial.at(99, 99, 1), [])
+
+
+class RandomStreamsTest(unittest.TestCase):
+
+    def play(self, seed, cosmetic=0):
+        """a game of some turns. cosmetic: random numbers to draw for effects on the screen"""
+        game = Game(seed=seed)
+        for _ in range(cosmetic):
+            rng.cosmetic.random()
+        for _ in range(10):
+            game.step("wait")
+        return (bytes(Game.dungeon[1].tiles), list(Game.log),
+                sorted((o.number, type(o).__name__, o.x, o.y, o.hitpoints) for o in Game.spatial.level(1)))
+
+    def test_same_seed_same_game(self):
+        self.assertEqual(self.play(5), self.play(5))
+        self.assertNotEqual(self.play(5)[0], self.play(6)[0])
+
+    def test_effects_change_nothing(self):
+        self.assertEqual(self.play(5, cosmetic=100), self.play(5))
+
+
+class TravelTest(unittest.TestCase):
+
+    def test_explore_then_travel(self):
+        game = Game(seed=4)
+        for monster in Game.spatial.level(game.player.z, Monster):
+            if monster is not game.player:
+                monster.kill()  # nobody disturbs the walk
+        level = Game.dungeon[game.player.z]
+        start = (game.player.x, game.player.y)
+        explored = sum(level.explored)
+        for _ in range(20):
+            game.step("explore")
+        self.assertGreater(sum(level.explored), explored)
+        game.step("travel", *start)
+        self.assertEqual((game.player.x, game.player.y), start)
+
+    def test_travel_to_unknown_tile(self):
+        game = Game(seed=4)
+        self.assertFalse(game.step("travel", -1, -1))
+        self.assertEqual(Game.log[-1], "You can not travel there")
+
+    def test_path_cache(self):
+        game = Game(seed=4)
+        x, y = game.player.x, game.player.y
+        path = game.find_path(x, y)
+        self.assertEqual(path, ())
+        self.assertIs(game.find_path(x, y), path)
+
+
+def dive(game, levels):
+    """walk down some stairs. returns the tiles and objects of each new level"""
+    seen = []
+    game.player.hitpoints = 10 ** 6
+    for _ in range(levels):
+        stair = next(iter(Game.spatial.level(game.player.z, StairDown)))
+        Game.spatial.move(game.player, stair.x, stair.y, game.player.z)
+        game.step("stairs")
+        z = game.player.z
+        seen.append((bytes(Game.dungeon[z].tiles),
+                     sorted((type(o).__name__, o.x, o.y) for o in Game.spatial.level(z))))
+    return seen
+
+
+class LevelGenerationTest(unittest.TestCase):
+
+    def tearDown(self):
+        Game.stop_workers()
+        Game.pregenerate = "thread"
+
+    def test_stairs_up_in_every_room_center(self):
+        for seed in range(50):
+            rooms = generate_level(seed, 2, 30, 16, ["Snake"], ["Gold"], max_rooms=3).rooms
+            stairs_up = [room.center() for room in rooms]
+            plan = generate_level(seed, 2, 30, 16, ["Snake"], ["Gold"], stairs_up=stairs_up, max_rooms=3)
+            up = {(x, y) for name, x, y in plan.spawns if name == "StairUp"}
+            down = {(x, y) for name, x, y in plan.spawns if name == "StairDown"}
+            self.assertEqual(up, set(stairs_up))
+            self.assertTrue(down)
+            self.assertFalse(up & down)
+
+    def test_density(self):
+        def spawned(density):
+            plan = generate_level(4, 3, 80, 40, ["Snake"], ["Gold"], density=density)
+            return [name for name, x, y in plan.spawns if name in ("Snake", "Gold")]
+        self.assertEqual(generate_level(4, 3, 80, 40, ["Snake"], ["Gold"]).spawns,
+                         generate_level(4, 3, 80, 40, ["Snake"], ["Gold"], density=1.0).spawns)
+        self.assertEqual(spawned(0), [])
+        self.assertGreater(len(spawned(3)), len(spawned(1)))
+
+    def test_stairs_up_below_stairs_down(self):
+        game = Game(seed=11)
+        for _ in range(4):
+            dive(game, 1)
+            z = game.player.z
+            self.assertTrue(Game.spatial.at(game.player.x, game.player.y, z, StairUp))
+            self.assertEqual(sorted((o.x, o.y) for o in Game.spatial.level(z, StairUp)),
+                             sorted((o.x, o.y) for o in Game.spatial.level(z - 1, StairDown)))
+
+    def test_pregenerated_levels_are_identical(self):
+        Game.pregenerate = None
+        expected = dive(Game(seed=5), 4)
+        Game.pregenerate = "thread"
+        self.assertEqual(dive(Game(seed=5), 4), expected)
+
+
+def snapshot(game):
+    """everything a savegame must keep. Thaws all frozen levels (see Game.freeze_level)"""
+    for z in list(Game.frozen):
+        game.thaw_level(z)
+    objects = sorted((o.number, type(o).__name__, o.x, o.y, o.z, o.hitpoints, o.look_direction)
+                     for z in range(len(Game.dungeon)) for o in Game.spatial.level(z))
+    levels = [(bytes(level.tiles), bytes(level.decorations), bytes(level.explored)) for level in Game.dungeon]
+    return objects, levels, game.turn, list(Game.log), game.player.number
+
+
+class SaveGameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, "test.sav")
+
+    def tearDown(self):
+        Game.stop_workers()
+        self.folder.cleanup()
+
+    def test_round_trip(self):
+        for compress in (True, False):
+            game = Game(seed=7)
+            dive(game, 3)
+            game.step("wait")
+            expected = snapshot(game)
+            game.save(self.filename, compress)
+            self.assertEqual(snapshot(Game.load(self.filename)), expected)
+
+    def test_loaded_game_plays_on_the_same(self):
+        game = Game(seed=7)
+        dive(game, 2)
+        game.save(self.filename)
+        for _ in range(10):
+            game.step("wait")
+        expected = snapshot(game)
+        game = Game.load(self.filename)
+        for _ in range(10):
+            game.step("wait")
+        self.assertEqual(snapshot(game), expected)
+
+    def test_not_a_savegame(self):
+        with open(self.filename, "wb") as f:
+            f.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            Game.load(self.filename)
+
+
+class LevelFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, "level.txt")
+        with open(self.filename, "w") as f:
+            f.write("####\n#<.*\n\n#>\n")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_read_text(self):
+        width, height, tiles, spawns = read_level_text(self.filename)
+        self.assertEqual((width, height), (4, 3))
+        self.assertEqual(bytes(tiles), bytes([WALL] * 5 + [FLOOR] * 3 + [WALL, FLOOR, WALL, WALL]))
+        self.assertEqual(spawns, [(b"<", 1, 1), (b"*", 3, 1), (b">", 1, 2)])
+
+    def test_compiled_level_is_the_same(self):
+        expected = read_level_text(self.filename)
+        binary = compile_level(self.filename)
+        width, height, tiles, spawns = read_level_binary(binary)
+        self.assertEqual((width, height, bytes(tiles), list(spawns)),
+                         (expected[0], expected[1], bytes(expected[2]), list(expected[3])))
+
+
+class FreezeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        Game.stop_workers()
+        Game.cold_folder = None
+        Game.forget_cold_files()
+        self.folder.cleanup()
+
+    def hot_levels(self):
+        return [z for z in range(len(Game.dungeon)) if Game.dungeon.is_decoded(z) or Game.spatial.count(z) > 0]
+
+    def use_stairs(self, game, levels):
+        cls = StairDown if levels > 0 else StairUp
+        for _ in range(abs(levels)):
+            stair = next(iter(Game.spatial.level(game.player.z, cls)))
+            Game.spatial.move(game.player, stair.x, stair.y, game.player.z)
+            game.step("stairs")
+            self.assertLessEqual(len(self.hot_levels()), Game.hot_levels)
+
+    def test_hot_levels_stay_bounded(self):
+        game = Game(seed=3)
+        game.player.hitpoints = 10 ** 6
+        self.use_stairs(game, 12)
+        self.use_stairs(game, -6)
+        self.use_stairs(game, 10)
+        self.assertTrue(Game.frozen)
+
+    def test_thaw_gives_back_the_same_objects(self):
+        for folder in (None, self.folder.name):
+            Game.cold_folder = folder
+            game = Game(seed=3)
+            expected = sorted((o.number, type(o).__name__, o.x, o.y, o.hitpoints, o.look_direction,
+                               getattr(o, "spell", None), getattr(o, "value", None))
+                              for o in Game.spatial.level(1))
+            generation = rng.generation.getstate()
+            game.freeze_level(1)
+            self.assertEqual(Game.spatial.count(1), 0)
+            self.assertEqual(len(os.listdir(self.folder.name)) > 0, folder is not None)
+            game.thaw_level(1)
+            self.assertEqual(sorted((o.number, type(o).__name__, o.x, o.y, o.hitpoints, o.look_direction,
+                                     getattr(o, "spell", None), getattr(o, "value", None))
+                                    for o in Game.spatial.level(1)), expected)
+            # thawing creates no new random values: the generation stream is untouched
+            self.assertEqual(rng.generation.getstate(), generation)
+
+    def test_games_with_the_same_seed_keep_their_cold_files_apart(self):
+        Game.cold_folder = self.folder.name
+        Game(seed=3).freeze_level(1)
+        first = Game.cold_files
+        Game.cold_files = None  # as if another process plays the same seed
+        Game(seed=3).freeze_level(1)
+        self.assertNotEqual(Game.cold_files, first)
+        # the same file names, but each game has its own
+        self.assertEqual(sorted(os.listdir(Game.cold_files)), sorted(os.listdir(first)))
+        Game.forget_cold_files()
+        self.assertEqual(os.listdir(self.folder.name), [os.path.basename(first)])
+
+class EntityStoreTest(unittest.TestCase):
+
+    def test_select_matches_the_objects(self):
+        game = Game(seed=3)
+        for z in (0, 1):
+            self.assertEqual(Game.objects.select(Monster, z),
+                             sorted(o.number for o in Game.spatial.level(z, Monster)))
+        self.assertEqual(len(Game.objects), len(Game.objects.select(Object)))
+
+    def test_columns_and_kill(self):
+        game = Game(seed=3)
+        gold = Gold(5, 6, 0, value=42)
+        self.assertEqual((gold.x, gold.y, gold.z, gold.value), (5, 6, 0, 42))
+        gold.hitpoints = 7
+        self.assertEqual(Game.objects.hitpoints[gold.number], 7)
+        self.assertIs(Game.objects[gold.number], gold)
+        gold.kill()
+        self.assertNotIn(gold.number, Game.objects)
+        self.assertNotIn(gold.number, Game.objects.select(Gold))
+
+    def test_only_slots_as_arguments(self):
+        game = Game(seed=3)
+        with self.assertRaises(TypeError):
+            Gold(1, 1, 0, colour=(1, 2, 3))
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.folder.name, "test.rpl")
+        self.settings = Game.torch_radius, Game.fov_algorithm
+
+    def tearDown(self):
+        Game.torch_radius, Game.fov_algorithm = self.settings
+        Game.replay = None
+        Game.stop_workers()
+        self.folder.cleanup()
+
+    def play(self, game):
+        """some actions of each kind, only through Game.step: everything else would not be recorded"""
+        actions = [("move", 1, 0), ("wait",), ("torch", 1), ("fov", "raycast"), ("explore",),
+                   ("move", 0, 1), ("fire", game.player.x + 3, game.player.y), ("cast", "heal", 0, 0)]
+        actions += [("explore",)] * 30
+        for action in actions:
+            if Game.game_over:
+                break
+            game.step(*action)
+            stairs = [o for o in Game.spatial.level(game.player.z, StairDown)
+                      if Game.dungeon[game.player.z].is_explored(o.x, o.y)]
+            if stairs and game.player.z < 3:
+                game.step("travel", stairs[0].x, stairs[0].y)
+                if (game.player.x, game.player.y) == (stairs[0].x, stairs[0].y):
+                    game.step("stairs")
+
+    def test_playback_gives_the_same_game(self):
+        game = Game(seed=10)  # dives to level 3 and survives
+        Game.replay = Replay.start(game)
+        self.play(game)
+        self.assertEqual(game.player.z, 3)
+        expected = snapshot(game)
+        Game.replay.save(self.filename)
+        Game.replay = None
+        replay = Replay.load(self.filename)
+        self.assertEqual(snapshot(replay.play()), expected)
+
+    def test_not_a_replay(self):
+        with open(self.filename, "wb") as f:
+            f.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            Replay.load(self.filename)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""tests for roguebasin_pathfinding. Run them with: python -m pytest"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from roguebasin_pathfinding import DijkstraMap, UNREACHABLE, astar, nearest
+
+# a wall with a gap on the right side. "#": not walkable
+MAP = ["......",
+       "#####.",
+       "......"]
+WIDTH = len(MAP[0])
+HEIGHT = len(MAP)
+WALKABLE = bytes(0 if c == "#" else 1 for row in MAP for c in row)
+
+
+class DijkstraMapTest(unittest.TestCase):
+
+    def test_distances(self):
+        flow = DijkstraMap(WALKABLE, WIDTH, HEIGHT, [(0, 2)])
+        self.assertEqual(flow.distance(0, 2), 0)
+        self.assertEqual(flow.distance(5, 1), 5)
+        self.assertEqual(flow.distance(0, 0), 10)  # around the wall
+        self.assertEqual(flow.distance(2, 1), UNREACHABLE)  # a wall
+        self.assertEqual(flow.distance(-1, 0), UNREACHABLE)
+
+    def test_downhill(self):
+        flow = DijkstraMap(WALKABLE, WIDTH, HEIGHT, [(0, 2)])
+        x, y = 0, 0
+        steps = 0
+        while (x, y) != (0, 2):
+            dx, dy = flow.downhill(x, y)
+            x += dx
+            y += dy
+            steps += 1
+        self.assertEqual(steps, 10)
+        self.assertIsNone(flow.downhill(0, 2))
+
+    def test_max_distance(self):
+        flow = DijkstraMap(WALKABLE, WIDTH, HEIGHT, [(0, 2)], max_distance=3)
+        self.assertEqual(flow.distance(3, 2), 3)
+        self.assertEqual(flow.distance(4, 2), UNREACHABLE)
+
+
+class AstarTest(unittest.TestCase):
+
+    def test_path(self):
+        path = astar(WALKABLE, WIDTH, HEIGHT, (0, 0), (0, 2))
+        self.assertEqual(len(path), 10)
+        self.assertEqual(path[-1], (0, 2))
+        for x, y in path:
+            self.assertEqual(WALKABLE[y * WIDTH + x], 1)
+
+    def test_start_is_goal(self):
+        self.assertEqual(astar(WALKABLE, WIDTH, HEIGHT, (3, 0), (3, 0)), [])
+
+    def test_bump_into_goal(self):
+        # the goal is a wall: the path ends there
+        self.assertEqual(astar(WALKABLE, WIDTH, HEIGHT, (2, 0), (2, 1)), [(2, 1)])
+
+    def test_no_path(self):
+        closed = bytearray(WALKABLE)
+        closed[1 * WIDTH + 5] = 0  # close the gap
+        self.assertIsNone(astar(closed, WIDTH, HEIGHT, (0, 0), (0, 2)))
+
+
+class NearestTest(unittest.TestCase):
+
+    def test_nearest(self):
+        goals = bytearray(WIDTH * HEIGHT)
+        goals[2 * WIDTH + 0] = 1
+        goals[0 * WIDTH + 3] = 1
+        self.assertEqual(nearest(WALKABLE, WIDTH, HEIGHT, (0, 0), goals), (3, 0))
+        self.assertIsNone(nearest(WALKABLE, WIDTH, HEIGHT, (0, 0), bytearray(WIDTH * HEIGHT)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""tests for the drawing of roguebasin_pygame without a window (SDL dummy video driver).
+   Skipped if pygame is not installed. Run them with: python -m pytest"""
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # images and hand-made levels are loaded from the folder data
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+try:
+    import pygame
+    import roguebasin_pygame
+except ImportError:
+    pygame = None
+
+
+@unittest.skipIf(pygame is None, "pygame is not installed")
+class UpdateDungeonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.game = roguebasin_pygame.Game(seed=4)
+        with contextlib.redirect_stdout(io.StringIO()):  # the Viewer reports missing images
+            self.viewer = roguebasin_pygame.Viewer(self.game, run=False)
+        self.game.renderer = None  # no animations
+        self.game_screen = pygame.Rect(0, 0, self.viewer.width - self.viewer.panel_width,
+                                       self.viewer.height - self.viewer.log_height)
+
+    def picture(self):
+        return pygame.image.tobytes(self.viewer.screen.subsurface(self.game_screen), "RGB")
+
+    def assert_same_as_full_redraw(self):
+        incremental = self.picture()
+        self.viewer.drawn = None  # paint everything
+        self.viewer.update_dungeon()
+        self.assertEqual(incremental, self.picture())
+
+    def test_player_moves(self):
+        self.viewer.update_dungeon()
+        for dx, dy in ((1, 0), (1, 0), (0, 1), (0, 1), (-1, 0)):
+            self.game.step("move", dx, dy)
+            self.viewer.update_dungeon()
+            self.assert_same_as_full_redraw()
+
+    def test_objects_change(self):
+        self.viewer.update_dungeon()
+        player = self.game.player
+        gold = roguebasin_pygame.Gold(player.x + 1, player.y, player.z)
+        self.game.step("wait")
+        self.viewer.update_dungeon()
+        self.assert_same_as_full_redraw()
+        gold.kill()
+        self.game.step("wait")
+        self.viewer.update_dungeon()
+        self.assert_same_as_full_redraw()
+
+
+if __name__ == "__main__":
+    unittest.main()